@@ -0,0 +1,140 @@
+# Library API
+# The whole pipeline (location check, highest point, nearest nodes, routes) without any prompt or quit():
+# a Planner loads the network, its node index, the DEM (and its max index) and one routing graph per walking
+# speed once, and then plans evacuations for any number of locations
+import shapely
+from shapely.geometry import Point, LineString
+from closures import Closures, link_min_altitudes, route_still_valid
+from creativity_marks import radius_and_speed
+from elevation import elevation_array, load_max_index, open_dem
+from network import load_network
+from plotter import Plotter
+from route_cache import route_cache, graph_version
+from routing import NoPath
+from task_1 import location_check
+from task_2_highest_point import highest_point
+from task_3 import node_index, nearest_nodes
+from task_4 import build_graph, paths, WALKING_SPEEDS
+
+# Possible statuses of an evacuation
+OK, OUTSIDE, NO_PATH = 'ok', 'outside boundaries', 'no path'
+
+
+# Result of planning one evacuation. Everything but the location, fitness and status is None unless
+# the status is OK (the destination, radius and altitudes are also set when no path was found)
+class Evacuation:
+    def __init__(self, location, fitness, status, destination=None, radius=None, altitudes=None,
+                 local_array=None, out_trans=None, short_path=None, short_path_data=None, fast_path=None,
+                 fast_path_data=None, user_to_node=None, node_to_dest=None):
+        self.location = location
+        self.fitness = fitness
+        self.status = status
+        self.destination = destination
+        self.radius = radius
+        self.altitudes = altitudes
+        self.local_array = local_array
+        self.out_trans = out_trans
+        self.short_path = short_path
+        self.short_path_data = short_path_data
+        self.fast_path = fast_path
+        self.fast_path_data = fast_path_data
+        self.user_to_node = user_to_node
+        self.node_to_dest = node_to_dest
+
+    # Flat summary of the evacuation (one row of the batch output)
+    def record(self):
+        result = {'easting': self.location.x, 'northing': self.location.y, 'fitness': self.fitness,
+                  'status': self.status}
+        if self.destination is not None:
+            result.update(dest_easting=self.destination.x, dest_northing=self.destination.y, radius=self.radius,
+                          user_altitude=float(self.altitudes[0]), max_altitude=float(self.altitudes[1]))
+        if self.status == OK:
+            result.update(short_distance=self.short_path_data[0], short_time=self.short_path_data[1],
+                          fast_distance=self.fast_path_data[0], fast_time=self.fast_path_data[1],
+                          short_fids='|'.join(self.short_path.fids), fast_fids='|'.join(self.fast_path.fids))
+        return result
+
+    # The summary plus the route lines as lists of coordinates
+    def to_json(self):
+        result = self.record()
+        if self.status == OK:
+            result.update(short_line=shapely.get_coordinates(self.short_path.line).tolist(),
+                          fast_line=shapely.get_coordinates(self.fast_path.line).tolist())
+        return result
+
+    def plotter(self):
+        return Plotter(self.location, self.destination, self.altitudes, self.local_array, self.out_trans,
+                       self.radius, self.fast_path, self.fast_path_data, self.short_path, self.short_path_data,
+                       self.user_to_node, self.node_to_dest)
+
+
+class Planner:
+    def __init__(self, method='astar'):
+        self.method = method
+        self.network = load_network()
+        self.idx = node_index(self.network)
+        self.raster = open_dem()
+        # Memory-mapped rather than copied: every long-lived planner (e.g. one per service worker) shares it
+        self.elevation_data = elevation_array(self.raster)
+        load_max_index(self.raster, self.elevation_data)
+        self.graphs = {speed: build_graph(self.network, self.raster, speed, self.elevation_data)
+                       for speed in WALKING_SPEEDS}
+        self.closures = {speed: Closures(self.network, graph) for speed, graph in self.graphs.items()}
+        self._min_altitudes = None
+
+    # Applying a closure update to the graph of every walking speed. The cached routes which are still optimal
+    # are kept (see closures.route_still_valid), the others will be searched again when next asked for.
+    # Returns the change of each graph, to repair trees computed on them
+    def _update(self, update):
+        changes = {}
+        for speed, closures in self.closures.items():
+            old_version = graph_version(closures.graph)
+            change = changes[speed] = update(closures)
+            route_cache.revalidate(old_version, graph_version(closures.graph),
+                                   lambda entry: route_still_valid(entry, change))
+        return changes
+
+    # Closing, reopening or slowing down (travel time multiplied by factor) links given by their ITN fids
+    def close(self, fids):
+        links = [self.network.link(fid) for fid in fids]
+        return self._update(lambda closures: closures.close(links))
+
+    def reopen(self, fids):
+        links = [self.network.link(fid) for fid in fids]
+        return self._update(lambda closures: closures.reopen(links))
+
+    def slow(self, fids, factor):
+        links = [self.network.link(fid) for fid in fids]
+        return self._update(lambda closures: closures.slow(links, factor))
+
+    # Closing every link lying below the water level (m), reopening the ones above it again
+    def flood(self, water_level):
+        if self._min_altitudes is None:
+            self._min_altitudes = link_min_altitudes(self.network, self.raster, self.elevation_data)
+        return self._update(lambda closures: closures.flood(self._min_altitudes, water_level))
+
+    # Planning the evacuation of someone at the given BNG coordinates with the given fitness level (1 to 10)
+    def evacuate(self, easting, northing, fitness):
+        location = Point(easting, northing)
+        if location_check(location) is None:
+            return Evacuation(location, fitness, OUTSIDE)
+
+        radius, walking_speed = radius_and_speed(fitness)
+        destination, raster, local_array, out_trans, radius, altitudes = \
+            highest_point(location, radius, self.raster, self.elevation_data, interactive=False)
+        no_path = Evacuation(location, fitness, NO_PATH, destination, radius, altitudes)
+
+        nearest_to_user, nearest_to_dest = nearest_nodes(self.network, self.idx, location, destination)
+        if nearest_to_user == nearest_to_dest:
+            return no_path
+        try:
+            short_path, short_path_data, fast_path, fast_path_data = \
+                paths(self.network, raster, walking_speed, nearest_to_user, nearest_to_dest, self.method,
+                      self.graphs[walking_speed])
+        except NoPath:
+            return no_path
+
+        user_to_node = LineString([(location.x, location.y), nearest_to_user[1]])
+        node_to_dest = LineString([nearest_to_dest[1], (destination.x, destination.y)])
+        return Evacuation(location, fitness, OK, destination, radius, altitudes, local_array, out_trans,
+                          short_path, short_path_data, fast_path, fast_path_data, user_to_node, node_to_dest)
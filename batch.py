@@ -0,0 +1,97 @@
+# Batch evacuation mode
+# Routing every start location of a CSV or GeoPackage file (BNG easting and northing plus a fitness level)
+# across a pool of worker processes, and streaming one result row per location to a CSV file.
+# Usage: python batch.py locations.csv results.csv [--processes N] [--maps DIR [--map-format pdf]] [--route-cache DIR]
+# CSV input needs 'easting', 'northing' and 'fitness' columns; GeoPackage input needs point geometries and a
+# 'fitness' column. An 'id' column is copied to the output when present.
+# With --maps, each worker also renders (headless) the map of every route it finds to DIR/<id>.<format>.
+# With --route-cache, the routes found are also stored in DIR, where every worker (and later runs) can reuse them
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import geopandas as gpd
+from api import Planner, OK
+from route_cache import route_cache
+
+FIELDS = ['id', 'easting', 'northing', 'fitness', 'status', 'dest_easting', 'dest_northing', 'radius',
+          'user_altitude', 'max_altitude', 'short_distance', 'short_time', 'fast_distance', 'fast_time',
+          'short_fids', 'fast_fids']
+
+# Planner (network, node index, DEM and routing graphs) loaded once in the parent, and the map options.
+# With the 'fork' start method the workers inherit it instead of loading their own copy
+_state = {}
+
+
+def load_state():
+    if not _state:
+        _state['planner'] = Planner()
+    return _state
+
+
+# Workers do not print the progress messages of every single location
+def _init_worker(maps=None, map_format='png', route_cache_dir=None):
+    sys.stdout = open(os.devnull, 'w')
+    load_state()
+    _state.update(maps=maps, map_format=map_format)
+    route_cache.directory = route_cache_dir
+
+
+def read_locations(path):
+    if path.lower().endswith('.csv'):
+        with open(path, newline='') as file:
+            for i, record in enumerate(csv.DictReader(file)):
+                yield record.get('id', i), float(record['easting']), float(record['northing']), int(record['fitness'])
+    else:
+        locations = gpd.read_file(path)
+        ids = locations['id'] if 'id' in locations else range(len(locations))
+        for row_id, point, fitness in zip(ids, locations.geometry, locations['fitness']):
+            yield row_id, point.x, point.y, int(fitness)
+
+
+# Running the whole pipeline (highest point, nearest nodes, routes) for one location
+def evacuate(record):
+    row_id, easting, northing, fitness = record
+    state = load_state()
+    evacuation = state['planner'].evacuate(easting, northing, fitness)
+    if evacuation.status == OK and state.get('maps'):
+        evacuation.plotter().save(os.path.join(state['maps'], str(row_id) + '.' + state['map_format']))
+    return dict(evacuation.record(), id=row_id)
+
+
+# Results are written as soon as they arrive (in input order), so memory does not grow with the input size
+def run_batch(in_path, out_path, processes=None, chunksize=16, maps=None, map_format='png',
+              route_cache_dir=None):
+    load_state()
+    if maps:
+        os.makedirs(maps, exist_ok=True)
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(start_method)
+    count = 0
+    worker_args = maps, map_format, route_cache_dir
+    with open(out_path, 'w', newline='') as file, context.Pool(processes, _init_worker, worker_args) as pool:
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for result in pool.imap(evacuate, read_locations(in_path), chunksize):
+            writer.writerow(result)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route many start locations to safety.')
+    parser.add_argument('locations', help='CSV or GeoPackage of start locations')
+    parser.add_argument('output', help='CSV file for the results')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--maps', default=None, help='directory for a map of every route')
+    parser.add_argument('--map-format', default='png', choices=['png', 'pdf'], help='format of the maps')
+    parser.add_argument('--route-cache', default=None, help='directory for routes shared between the workers')
+    args = parser.parse_args()
+    count = run_batch(args.locations, args.output, args.processes, maps=args.maps, map_format=args.map_format,
+                      route_cache_dir=args.route_cache)
+    print(count, 'locations routed, results in', args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# Benchmark suite
+# Generates synthetic data of every requested size (see synthetic.py, no licensed data needed) and times each
+# stage of the pipeline on it: network compilation and loading, node index, DEM conversion and max index,
+# elevation sampling, highest point search, graph build, routing, route geometry and map rendering.
+# The wall time and the process's peak resident memory after every stage are written to a JSON file.
+# With --memory the peak of the memory allocated during each stage is traced too (with tracemalloc, which
+# slows the pure Python stages down several times: their timings are then only comparable to traced runs).
+# Usage: python benchmarks/run.py results.json [--nodes 2500 10000 40000] [--queries 50] [--maps 3]
+#                                              [--method astar] [--memory] [--compare previous.json]
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from shapely.geometry import Point, LineString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elevation
+import plotter
+import synthetic
+import task_4
+from elevation import compile_dem, load_dem, load_max_index, sample_elevation
+from network import compile_network, load_network
+from route_geometry import RouteGeometry
+from routing import SEARCHES, NoPath, route_totals
+from spatial_index import NodeIndex
+from task_2_highest_point import highest_point
+
+# Search radius (m) and walking speed used for every query (the fittest class)
+RADIUS = 3000
+SPEED = task_4.WALKING_SPEEDS[0]
+
+
+# Timing (and tracing the memory of) one stage: `with Stage(results, 'name', count):` records its wall time,
+# the time per item when it processes count items, the peak resident memory so far and its peak traced memory
+class Stage:
+    def __init__(self, results, name, count=None, memory=False):
+        self.results = results
+        self.name = name
+        self.count = count
+        self.memory = memory
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        # ru_maxrss is in kB on Linux
+        result = {'seconds': seconds, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10}
+        if self.count:
+            result.update(count=self.count, ms_per_item=seconds * 1000 / self.count)
+        if self.memory:
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        self.results[self.name] = result
+
+
+# The modules keep what they loaded per (relative) path: emptied before every dataset
+def reset_caches():
+    elevation._dems.clear()
+    elevation._max_indexes.clear()
+    for basemap in plotter._basemaps.values():
+        basemap.dataset.close()
+    plotter._basemaps.clear()
+    task_4._link_times.clear()
+
+
+# Running every stage on a dataset of about n_nodes road nodes, generated in a temporary directory
+def run_size(n_nodes, queries=50, maps=3, method='astar', memory=False, seed=0, keep=False):
+    work_dir = tempfile.mkdtemp(prefix='flood-bench-')
+    stages = {}
+    cwd = os.getcwd()
+    try:
+        with Stage(stages, 'generate'):
+            info = synthetic.generate(work_dir, n_nodes, seed=seed)
+        # The modules read their data from their default relative paths
+        os.chdir(work_dir)
+        reset_caches()
+
+        def stage(name, count=None):
+            return Stage(stages, name, count, memory)
+
+        with stage('itn_compile'):
+            compile_network()
+        with stage('network_load'):
+            network = load_network()
+        with stage('node_index_build'):
+            idx = NodeIndex.build(network.node_coords)
+
+        # Query locations spread over the road network
+        rng = np.random.default_rng(seed)
+        low, high = network.node_coords.min(axis=0), network.node_coords.max(axis=0)
+        locations = rng.uniform(low, high, (queries, 2))
+
+        with stage('nearest_nodes', queries):
+            idx.nearest(locations, 1)
+        with stage('dem_compile'):
+            compile_dem()
+        raster = load_dem()
+        elevation_data = raster.read(1)
+        with stage('max_index_build'):
+            load_max_index(raster, elevation_data)
+        with stage('elevation_sampling', len(network.geom_coords)):
+            sample_elevation(raster, elevation_data, network.geom_coords)
+
+        with stage('highest_point', queries), contextlib.redirect_stdout(io.StringIO()):
+            found = [highest_point(Point(x, y), RADIUS, raster, elevation_data, interactive=False)
+                     for x, y in locations.tolist()]
+        destinations = np.array([(dest.x, dest.y) for dest, *_ in found])
+        user_nodes = idx.nearest(locations, 1)[0][:, 0]
+        dest_nodes = idx.nearest(destinations, 1)[0][:, 0]
+
+        with stage('graph_build', len(task_4.WALKING_SPEEDS)):
+            graph = {speed: task_4.build_graph(network, raster, speed, elevation_data)
+                     for speed in task_4.WALKING_SPEEDS}[SPEED]
+        with stage('graph_build_stored', len(task_4.WALKING_SPEEDS)):
+            task_4._link_times.clear()
+            for speed in task_4.WALKING_SPEEDS:
+                task_4.build_graph(network, raster, speed, elevation_data)
+
+        search = SEARCHES[method]
+        routes = []
+        with stage('routing', queries):
+            for source, target in zip(user_nodes.tolist(), dest_nodes.tolist()):
+                try:
+                    routes.append((search(graph, source, target, 'length'), search(graph, source, target, 'time')))
+                except NoPath:
+                    routes.append(None)
+        found_routes = [pair for pair in routes if pair is not None]
+
+        with stage('geometry', 2 * len(found_routes)):
+            for pair in found_routes:
+                for route in pair:
+                    # The line is only assembled when first used
+                    RouteGeometry.from_route(network, route).line
+
+        rendered = [i for i, pair in enumerate(routes) if pair is not None][:maps]
+        with stage('rendering', len(rendered) or None), contextlib.redirect_stdout(io.StringIO()):
+            for i in rendered:
+                dest, _, local_array, out_trans, radius, altitudes = found[i]
+                short, fast = [RouteGeometry.from_route(network, route) for route in routes[i]]
+                short_data, fast_data = [route_totals(graph, route) for route in routes[i]]
+                user_to_node = LineString([locations[i], network.node_coords[user_nodes[i]]])
+                node_to_dest = LineString([network.node_coords[dest_nodes[i]], (dest.x, dest.y)])
+                plotter.Plotter(Point(locations[i]), dest, altitudes, local_array, out_trans, radius, fast,
+                                fast_data, short, short_data, user_to_node, node_to_dest).save(os.path.join(work_dir,
+                                                                                                     'map.png'))
+
+        info.update(routes=len(found_routes), queries=queries)
+        return {'size': info, 'stages': stages}
+    finally:
+        os.chdir(cwd)
+        if keep:
+            print('Data kept in', work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_table(run):
+    print('%d nodes, %d links, DEM %d x %d' % (run['size']['nodes'], run['size']['links'], *run['size']['dem_shape']))
+    for name, result in run['stages'].items():
+        print('  %-20s %9.3f s %16s %10.1f MB rss %12s' % (
+            name, result['seconds'], '%.3f ms/item' % result['ms_per_item'] if 'ms_per_item' in result else '',
+            result['max_rss_mb'], '%.1f MB peak' % result['peak_mb'] if 'peak_mb' in result else ''))
+
+
+# Time ratio (this run over the previous one) of every stage of the sizes found in both result files,
+# per item for the stages processing several items
+def compare(results, previous):
+    before = {run['size']['nodes']: run['stages'] for run in previous['runs']}
+    for run in results['runs']:
+        stages = before.get(run['size']['nodes'])
+        if stages is None:
+            continue
+        print('%d nodes, time ratio to the previous run:' % run['size']['nodes'])
+        for name, result in run['stages'].items():
+            unit = 'ms_per_item' if 'ms_per_item' in result else 'seconds'
+            if unit in stages.get(name, {}) and stages[name][unit] > 0:
+                print('  %-20s %6.2fx' % (name, result[unit] / stages[name][unit]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory of every pipeline stage on synthetic data.')
+    parser.add_argument('output', help='JSON file for the results')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[2500, 10000, 40000],
+                        help='approximate numbers of road nodes of the datasets')
+    parser.add_argument('--queries', type=int, default=50, help='locations routed per dataset')
+    parser.add_argument('--maps', type=int, default=3, help='maps rendered per dataset')
+    parser.add_argument('--method', default='astar', choices=sorted(SEARCHES), help='route search')
+    parser.add_argument('--memory', action='store_true', help='trace the memory allocated by every stage')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the data and the queries')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data')
+    parser.add_argument('--compare', help='previous results file to compare the timings with')
+    args = parser.parse_args()
+
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+               'settings': {'queries': args.queries, 'maps': args.maps, 'method': args.method,
+                            'memory': args.memory, 'seed': args.seed},
+               'runs': []}
+    for n_nodes in args.nodes:
+        run = run_size(n_nodes, args.queries, args.maps, args.method, args.memory, args.seed, args.keep)
+        print_table(run)
+        results['runs'].append(run)
+        # Written after every size so that a long run still leaves the finished sizes
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Synthetic input data for the benchmarks
+# A road network in the ITN JSON format, a DEM as an ASCII grid and a palette basemap GeoTIFF of any size,
+# written with the same relative layout as the real data (itn/, elevation/, background/) so that the
+# project's modules find them with their default paths when run from the output directory.
+# Usage: python benchmarks/synthetic.py output_dir [--nodes 10000] [--spacing 100] [--dem-cell 25] [--seed 0]
+import argparse
+import json
+import math
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+# South west corner of the generated area (BNG), as on the Isle of Wight
+ORIGIN = (430000, 75000)
+# Paths of the generated files relative to the output directory (the modules' default paths)
+ITN_FILE = os.path.join('itn', 'solent_itn.json')
+DEM_FILE = os.path.join('elevation', 'SZ.asc')
+BACKGROUND_FILE = os.path.join('background', 'raster-50k_2724246.tif')
+# Margin (m) left around the road network by the DEM and the basemap
+MARGIN = 6000
+
+
+# Road network on a jittered square grid of about n_nodes junctions, `spacing` metres apart. About one in ten
+# grid edges is dropped so that the routes are not all straight, and every link has intermediate vertices
+def make_itn(n_nodes, spacing=100, seed=0):
+    rng = np.random.default_rng(seed)
+    side = max(2, math.ceil(math.sqrt(n_nodes)))
+    rows, cols = np.divmod(np.arange(side * side), side)
+    coords = np.column_stack([ORIGIN[0] + MARGIN + cols * spacing, ORIGIN[1] + MARGIN + rows * spacing])
+    coords = coords + rng.uniform(-0.2, 0.2, coords.shape) * spacing
+    node_ids = ['osgb4000000%09d' % i for i in range(len(coords))]
+    nodes = {node_id: {'coords': [round(x, 3), round(y, 3)]} for node_id, (x, y) in zip(node_ids, coords.tolist())}
+
+    # Horizontal and vertical grid edges, some of them dropped, walked in a random direction
+    index = np.arange(side * side).reshape(side, side)
+    starts = np.concatenate([index[:, :-1].ravel(), index[:-1, :].ravel()])
+    ends = np.concatenate([index[:, 1:].ravel(), index[1:, :].ravel()])
+    keep = rng.random(len(starts)) < 0.9
+    starts, ends = starts[keep], ends[keep]
+    flip = rng.random(len(starts)) < 0.5
+    starts, ends = np.where(flip, ends, starts), np.where(flip, starts, ends)
+
+    # Two intermediate vertices per link, moved off the straight line
+    a, b = coords[starts], coords[ends]
+    bends = [a + (b - a) * t + rng.uniform(-0.1, 0.1, a.shape) * spacing for t in (1 / 3, 2 / 3)]
+    vertices = np.stack([a, bends[0], bends[1], b], axis=1)
+    lengths = np.hypot(*np.diff(vertices, axis=1).transpose(2, 0, 1)).sum(axis=1)
+
+    links = {}
+    for i, (start, end, length, line) in enumerate(zip(starts.tolist(), ends.tolist(), lengths.tolist(),
+                                                       np.round(vertices, 3).tolist())):
+        links['osgb5000000%09d' % i] = {'start': node_ids[start], 'end': node_ids[end], 'length': length,
+                                        'coords': line}
+    return {'roadnodes': nodes, 'roadlinks': links}
+
+
+# Bounds (left, bottom, right, top) of the DEM and basemap around a network of n_nodes
+def area_bounds(n_nodes, spacing=100):
+    side = max(2, math.ceil(math.sqrt(n_nodes)))
+    extent = (side - 1) * spacing + 2 * MARGIN
+    return ORIGIN[0], ORIGIN[1], ORIGIN[0] + extent, ORIGIN[1] + extent
+
+
+# Hilly terrain: a sum of random Gaussian hills (up to ~200 m) over a low plain, with a nodata sea strip
+# along the southern edge like the real DEM's coastline
+def make_dem(bounds, cell=25, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    left, bottom, right, top = bounds
+    n_cols, n_rows = int(math.ceil((right - left) / cell)), int(math.ceil((top - bottom) / cell))
+    xs = left + (np.arange(n_cols) + 0.5) * cell
+    ys = top - (np.arange(n_rows) + 0.5) * cell
+    altitude = np.full((n_rows, n_cols), 5.0, dtype=np.float32)
+    n_hills = max(4, int((right - left) * (top - bottom) / 25e6))
+    for x, y, height, width in zip(rng.uniform(left, right, n_hills), rng.uniform(bottom, top, n_hills),
+                                   rng.uniform(40, 200, n_hills), rng.uniform(800, 4000, n_hills)):
+        # Separable: one row and one column profile per hill
+        altitude += (height * np.exp(-((ys - y) / width) ** 2)[:, None]
+                     * np.exp(-((xs - x) / width) ** 2)[None, :]).astype(np.float32)
+    altitude[-max(1, n_rows // 50):, :] = -9999
+    return altitude, from_origin(left, top, cell, cell)
+
+
+def write_ascii_grid(path, altitude, transform):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cell = transform.a
+    with open(path, 'w') as file:
+        file.write('ncols %d\nnrows %d\nxllcorner %r\nyllcorner %r\ncellsize %r\nNODATA_value -9999\n'
+                   % (altitude.shape[1], altitude.shape[0], transform.c, transform.f - altitude.shape[0] * cell,
+                      cell))
+        np.savetxt(file, altitude, fmt='%.2f')
+
+
+# Basemap: a paletted, tiled GeoTIFF of random map-like blocks (land, roads, water, woods)
+def write_background(path, bounds, cell=10, seed=0):
+    rng = np.random.default_rng(seed + 2)
+    left, bottom, right, top = bounds
+    width, height = int(math.ceil((right - left) / cell)), int(math.ceil((top - bottom) / cell))
+    coarse = rng.integers(0, 8, (height // 32 + 1, width // 32 + 1), dtype=np.uint8)
+    image = np.kron(coarse, np.ones((32, 32), dtype=np.uint8))[:height, :width]
+    palette = {0: (250, 248, 240, 255), 1: (240, 235, 220, 255), 2: (255, 255, 255, 255), 3: (180, 210, 240, 255),
+               4: (200, 230, 190, 255), 5: (230, 200, 120, 255), 6: (170, 170, 170, 255), 7: (120, 160, 110, 255)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1, dtype='uint8',
+                       transform=from_origin(left, top, cell, cell), tiled=True, compress='deflate') as dataset:
+        dataset.write(image, 1)
+        dataset.write_colormap(1, palette)
+
+
+# Writing a whole dataset into out_dir. Returns its size
+def generate(out_dir, n_nodes, spacing=100, dem_cell=25, background_cell=10, seed=0):
+    itn = make_itn(n_nodes, spacing, seed)
+    os.makedirs(os.path.join(out_dir, 'itn'), exist_ok=True)
+    with open(os.path.join(out_dir, ITN_FILE), 'w') as file:
+        json.dump(itn, file)
+    bounds = area_bounds(n_nodes, spacing)
+    altitude, transform = make_dem(bounds, dem_cell, seed)
+    write_ascii_grid(os.path.join(out_dir, DEM_FILE), altitude, transform)
+    write_background(os.path.join(out_dir, BACKGROUND_FILE), bounds, background_cell, seed)
+    return {'nodes': len(itn['roadnodes']), 'links': len(itn['roadlinks']), 'dem_shape': list(altitude.shape),
+            'bounds': list(bounds)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic ITN network, DEM and basemap for the benchmarks.')
+    parser.add_argument('output', help='directory to write the data into')
+    parser.add_argument('--nodes', type=int, default=10000, help='approximate number of road nodes')
+    parser.add_argument('--spacing', type=float, default=100, help='distance between junctions (m)')
+    parser.add_argument('--dem-cell', type=float, default=25, help='DEM cell size (m)')
+    parser.add_argument('--background-cell', type=float, default=10, help='basemap pixel size (m)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    print(generate(args.output, args.nodes, args.spacing, args.dem_cell, args.background_cell, args.seed))
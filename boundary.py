@@ -0,0 +1,76 @@
+# Location validation
+# The island polygon is read once and kept prepared, together with a coarse grid of its bounding box whose
+# cells are classified as inside, outside or crossing the coastline. Arrays of points are then checked in one
+# call: only the points falling in a crossing cell need an exact point-in-polygon test
+import geopandas as gpd
+import numpy as np
+import shapely
+
+ISLAND_PATH = 'shape/isle_of_wight.shp'
+# Bounding box of the study area (task 1): min easting, min northing, max easting, max northing
+BOX = (430000, 80000, 465000, 95000)
+OUTSIDE, BOUNDARY, INSIDE = 0, 1, 2
+
+
+class Boundary:
+    def __init__(self, polygon, box=BOX, grid=64):
+        self.polygon = polygon
+        shapely.prepare(self.polygon)
+        self.box = box
+        self.bounds = polygon.bounds
+        self.grid = grid
+        self.cell_x = (self.bounds[2] - self.bounds[0]) / grid
+        self.cell_y = (self.bounds[3] - self.bounds[1]) / grid
+        rows, cols = np.mgrid[:grid, :grid]
+        x0 = self.bounds[0] + cols * self.cell_x
+        y0 = self.bounds[1] + rows * self.cell_y
+        cells = shapely.box(x0, y0, x0 + self.cell_x, y0 + self.cell_y)
+        self.cells = np.full((grid, grid), BOUNDARY, dtype=np.int8)
+        self.cells[~shapely.intersects(polygon, cells)] = OUTSIDE
+        self.cells[shapely.covers(polygon, cells)] = INSIDE
+
+    @classmethod
+    def from_file(cls, path=ISLAND_PATH, **kwargs):
+        return cls(shapely.union_all(gpd.read_file(path).geometry.values), **kwargs)
+
+    # Whether each point is on the island (inside the polygon or on its edge)
+    def on_island(self, xs, ys):
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        col = np.floor((xs - self.bounds[0]) / self.cell_x)
+        row = np.floor((ys - self.bounds[1]) / self.cell_y)
+        # Points on the far edges of the bounding box belong to the last cells
+        in_bounds = ((xs >= self.bounds[0]) & (xs <= self.bounds[2]) & (ys >= self.bounds[1])
+                     & (ys <= self.bounds[3]))
+        col = np.clip(np.where(in_bounds, col, 0), 0, self.grid - 1).astype(np.intp)
+        row = np.clip(np.where(in_bounds, row, 0), 0, self.grid - 1).astype(np.intp)
+        state = np.where(in_bounds, self.cells[row, col], OUTSIDE)
+        result = state == INSIDE
+        crossing = state == BOUNDARY
+        result[crossing] = shapely.intersects_xy(self.polygon, xs[crossing], ys[crossing])
+        return result
+
+    # Whether each point is in the bounding box (edges included)
+    def in_box(self, xs, ys):
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        return (xs >= self.box[0]) & (xs <= self.box[2]) & (ys >= self.box[1]) & (ys <= self.box[3])
+
+    # Checking many locations: 'box' if in the bounding box, 'island' if outside it but on the island,
+    # otherwise None (as an object array)
+    def check(self, xs, ys):
+        xs, ys = np.ravel(xs).astype(np.float64), np.ravel(ys).astype(np.float64)
+        result = np.full(xs.shape, None, dtype=object)
+        box = self.in_box(xs, ys)
+        result[box] = 'box'
+        rest = np.flatnonzero(~box)
+        result[rest[self.on_island(xs[rest], ys[rest])]] = 'island'
+        return result
+
+
+_boundaries = {}
+
+
+# The boundary is only read and prepared once per process
+def load_boundary(path=ISLAND_PATH):
+    if path not in _boundaries:
+        _boundaries[path] = Boundary.from_file(path)
+    return _boundaries[path]
@@ -0,0 +1,104 @@
+# Flood closures
+# Links can be closed (they can no longer be walked) or slowed (their travel time is multiplied by a factor),
+# one by one or by flooding every link lying below a water level. Only the weights of the edges of the changed
+# links are rewritten in the routing graph, and the trees and cached routes already computed are repaired
+# instead of being computed again
+from collections import namedtuple
+import numpy as np
+from elevation import sample_elevation
+from routing import repair_tree
+
+# Edges whose weights were rewritten by an update, and whether any of them became cheaper
+Change = namedtuple('Change', ['edges', 'decreased'])
+
+
+# Lowest DEM altitude along every link (sampled at the vertices of its geometry). Vertices on nodata cells (the sea,
+# the edge of the grid) are left out: a link with no vertex on data has an infinite altitude and is never flooded
+def link_min_altitudes(network, raster, elevation_data):
+    altitudes = sample_elevation(raster, elevation_data, network.geom_coords).astype(np.float64)
+    missing = np.isnan(altitudes)
+    if raster.nodata is not None:
+        missing |= altitudes == raster.nodata
+    altitudes[missing] = np.inf
+    return np.minimum.reduceat(altitudes, network.geom_offsets[:-1])
+
+
+# Links (as network positions) which are under water at the given level
+def flooded_links(min_altitudes, water_level):
+    return np.flatnonzero(min_altitudes < water_level)
+
+
+# Closures of the links of one routing graph
+class Closures:
+    def __init__(self, network, graph):
+        self.network = network
+        self.graph = graph
+        # Weights without any closure, to reopen links
+        self.base = {name: values.copy() for name, values in graph.weights.items()}
+        # Links closed one by one, links under water and slowdown factor of the slowed links
+        self.closed = set()
+        self.flooded = set()
+        self.factors = {}
+        # Edges of the graph walking each link (both ways): link i has edges edge_order[edge_offsets[i]:...[i + 1]]
+        self._edge_order = np.argsort(graph.links, kind='stable')
+        self._edge_offsets = np.zeros(network.n_links + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.links, minlength=network.n_links), out=self._edge_offsets[1:])
+
+    def edges(self, links):
+        links = np.asarray(links, dtype=np.int64)
+        counts = self._edge_offsets[links + 1] - self._edge_offsets[links]
+        first = np.repeat(self._edge_offsets[links] - np.cumsum(counts) + counts, counts)
+        return self._edge_order[first + np.arange(len(first))]
+
+    # Rewriting the weights of the edges of some links from their current state
+    def _apply(self, links):
+        edges = self.edges(np.unique(np.asarray(list(links), dtype=np.int64)))
+        edge_links = self.graph.links[edges].tolist()
+        closed = np.array([link in self.closed or link in self.flooded for link in edge_links], dtype=bool)
+        factors = np.array([self.factors.get(link, 1.0) for link in edge_links])
+        decreased = False
+        for name, base in self.base.items():
+            values = np.where(closed, np.inf, base[edges] * (factors if name == 'time' else 1.0))
+            decreased = decreased or bool(np.any(values < self.graph.weights[name][edges]))
+            self.graph.update_weights(name, edges, values)
+        return Change(edges, decreased)
+
+    def close(self, links):
+        self.closed.update(int(link) for link in links)
+        return self._apply(links)
+
+    def reopen(self, links):
+        self.closed.difference_update(int(link) for link in links)
+        return self._apply(links)
+
+    # Slowing links down: their travel time is multiplied by factor (1 restores the normal speed)
+    def slow(self, links, factor):
+        for link in links:
+            if factor == 1:
+                self.factors.pop(int(link), None)
+            else:
+                self.factors[int(link)] = factor
+        return self._apply(links)
+
+    # Closing every link under water at the given level, and reopening the ones flooded by a previous
+    # (higher) level which are now above water
+    def flood(self, min_altitudes, water_level):
+        flooded = set(flooded_links(min_altitudes, water_level).tolist())
+        changed = flooded.symmetric_difference(self.flooded)
+        self.flooded = flooded
+        return self._apply(changed)
+
+    # Repairing a tree computed on the graph before the change (see routing.repair_tree)
+    @staticmethod
+    def repair(graph, tree, change, weight):
+        return repair_tree(graph, tree, change.edges, weight)
+
+
+# Whether a route (as cached by paths(): both routes and their data) is still optimal after a change:
+# a route avoiding every changed edge cannot have been beaten when no edge became cheaper
+def route_still_valid(entry, change):
+    if change.decreased:
+        return False
+    changed = set(change.edges.tolist())
+    short_path, _, fast_path, _ = entry
+    return not changed.intersection(short_path.edges) and not changed.intersection(fast_path.edges)
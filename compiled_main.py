@@ -1,84 +1,113 @@
-import pandas as pd
-import geopandas as gpd
+import os
 import numpy as np
 from shapely.geometry import Point, LineString, Polygon
 import rasterio
-from rasterio import mask
-import json
-from rtree import index
-import networkx as nx
+from network import load_network
+from boundary import load_boundary
+from spatial_index import load_node_index
+from elevation import sample_profiles, mask_elevation, load_max_index, open_dem, DemWindow
+from routing import Graph, SEARCHES, route_totals
+from hierarchy import hierarchy_search
+from instrumentation import count, span, traced, enable_from_environment, finish
+from route_geometry import RouteGeometry
+from route_cache import route_cache, graph_version
 from plotter import Plotter
 
 
-class Roadlink:
-    def __init__(self, fid, node_a, node_b, length, alt_diff):
-        self.fid = fid
-        self.node_a = node_a
-        self.node_b = node_b
-        self.length = length
-        self.alt_diff = alt_diff
-
-    # Calculating the time required to travel the roadlink.
-    # The function identifies three different values (to be used in the network).
-    # For climbing roadlinks, different 'time penalties' are used depending on the fitness level typed by the user.
-    # For descending roadlinks, Langmuir's integration to Naismith's rule was used
-
-    def time_weight(self, length, speed, alt_diff):
-        base = length / speed
-        slope = alt_diff / length * 100
-
-        # Climbing time weight
-        if speed == 5000 / 60:
-            with_slope_asc = base + abs(alt_diff / 10)
-        elif speed == 4000 / 60:
-            with_slope_asc = base + 1.25 * abs(alt_diff / 10)
-        else:
-            with_slope_asc = base + 1.5 * abs(alt_diff / 10)
-
-        # Descending time weight
-        if 5 < abs(slope) < 12:
-            with_slope_des = base - abs(alt_diff / 30)
-            if with_slope_des < 0:
-                with_slope_des = 0.001
-        elif abs(slope) > 12:
-            with_slope_des = base + abs(alt_diff / 30)
-        else:
-            with_slope_des = base
-
-        return base, with_slope_asc, with_slope_des
-
-    # Alternative 1 (Naismith's rule without Langmuir's integration)
-
-    # def time_weight(self, length, speed, alt_diff):
-    #     base = length / speed
-    #
-    #     # Climbing time weight
-    #     if speed == 5000 / 60:
-    #         with_slope_asc = base + abs(alt_diff / 10)
-    #     elif speed == 4000 / 60:
-    #         with_slope_asc = base + 1.25 * abs(alt_diff / 10)
-    #     else:
-    #         with_slope_asc = base + 1.5 * abs(alt_diff / 10)
-    #
-    #     with_slope_des = base
-    #
-    #     return base, with_slope_asc, with_slope_des
-
-    # Alternative code 2 (producing the same paths of the image
-    # in the assignment instructions for the test point)
-
-    # def time_weight(self, length, speed, alt_diff):
-    #     base = length / speed
-    #     if speed == 5000 / 60:
-    #         with_slope_asc = abs(base + alt_diff / 10)
-    #     elif speed == 4000 / 60:
-    #         with_slope_asc = abs(base + 1.25 * (alt_diff / 10))
-    #     else:
-    #         with_slope_asc = abs(base + 1.5 * (alt_diff / 10))
-    #
-    #     with_slope_des = base
-    #
-    #     return base, with_slope_asc, with_slope_des
+# Walking speeds (m/min) of the three fitness classes
+WALKING_SPEEDS = (5000 / 60, 4000 / 60, 3500 / 60)
+# Climbing 'time penalties' of the three fitness classes (minutes per 10 m of climb)
+CLIMB_FACTORS = (1, 1.25, 1.5)
+# Version of the time model below, stored with the link times computed with it
+TIME_MODEL_VERSION = 3
+# Rises and drops summed per link by link_profiles
+PROFILE_NAMES = ('ascent', 'descent', 'gentle_ascent', 'steep_ascent', 'gentle_descent', 'steep_descent')
+# Number of links whose profiles are sampled together (their samples then stay in the processor's cache)
+PROFILE_CHUNK = 4096
+
+
+# Climbing time penalty of a walking speed (other speeds than the fitness classes' are counted as the slowest)
+def climb_factor(speed):
+    return CLIMB_FACTORS[WALKING_SPEEDS.index(speed)] if speed in WALKING_SPEEDS else CLIMB_FACTORS[-1]
+
+
+# Calculating the time required to travel every link, in both directions, as array operations over all the links,
+# from their elevation profiles (see link_profiles).
+# The time penalty of the fitness level is added to the base time for every 10 m climbed along the link.
+# For the descents, Langmuir's integration to Naismith's rule was used: 10 minutes are taken off for every 300 m
+# of gentle descent (5 to 12 % slope) and added for every 300 m of steep descent (over 12 %).
+# Returns the times walking the links forward (from start to end node) and backward
+def link_times(length, profiles, speed):
+    base = length / speed
+
+    def walk(climb, gentle_descent, steep_descent):
+        time = base + climb_factor(speed) * climb / 10 - gentle_descent / 30 + steep_descent / 30
+        return np.where(time < 0, 0.001, time)
+
+    # Walked backward, the link's rises are descents and its drops climbs
+    return (walk(profiles['ascent'], profiles['gentle_descent'], profiles['steep_descent']),
+            walk(profiles['descent'], profiles['gentle_ascent'], profiles['steep_ascent']))
+
+
+# Elevation profile of every link: the total rise and drop walking it forward along its geometry, sampled about
+# every DEM cell (see elevation.sample_profiles), and the rise and drop of its gentle and steep pieces
+def link_profiles(network, raster, elevation_data=None):
+    # Only reading the window of elevation data spanned by the roads
+    if elevation_data is None:
+        elevation_data = DemWindow(raster)
+    profiles = {name: np.zeros(network.n_links) for name in PROFILE_NAMES}
+    offsets = network.geom_offsets
+    for start in range(0, network.n_links, PROFILE_CHUNK):
+        stop = min(start + PROFILE_CHUNK, network.n_links)
+        links, runs, rises = sample_profiles(raster, elevation_data, offsets[start:stop + 1] - offsets[start],
+                                             network.geom_coords[offsets[start]:offsets[stop]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.abs(rises / runs * 100)
+        gentle, steep = (5 < slope) & (slope < 12), slope > 12
+        up, down = np.maximum(rises, 0), np.maximum(-rises, 0)
+        parts = {'ascent': up, 'descent': down, 'gentle_ascent': up * gentle, 'steep_ascent': up * steep,
+                 'gentle_descent': down * gentle, 'steep_descent': down * steep}
+        for name in PROFILE_NAMES:
+            profiles[name][start:stop] = np.bincount(links, weights=parts[name], minlength=stop - start)
+    return profiles
+
+
+# Link times loaded or computed per artifact path, with the stamp (network and DEM hashes, time model version)
+# they were computed for: a newer network or DEM replaces them
+_link_times = {}
+
+
+# Link times of every fitness class, as two (fitness classes, links) arrays: forward and backward, with the links'
+# elevation profiles. They are computed in one pass the first time and stored with the compiled network, for the
+# DEM they were sampled from, so that choosing a fitness class afterwards is a column lookup (and any other
+# walking speed only needs the stored profiles)
+def load_link_times(network, raster, elevation_data=None):
+    # Only stored for a compiled network and a binary DEM (see elevation.Dem), whose source hashes identify them
+    dem_hash = raster.meta.get('source_hash') if isinstance(raster.meta, dict) else None
+    path = os.path.join(network.directory, 'link_times.npz') if network.directory and dem_hash else None
+    stamp = dict(source_hash=network.meta.get('source_hash') or '', dem_hash=dem_hash or '',
+                 version=TIME_MODEL_VERSION)
+    if path in _link_times and _link_times[path][0] == stamp:
+        return _link_times[path][1]
+    if path and os.path.exists(path):
+        with np.load(path) as data:
+            if (all(str(data[name]) == str(value) for name, value in stamp.items())
+                    and np.array_equal(data['speeds'], WALKING_SPEEDS)):
+                _link_times[path] = stamp, (data['forward'], data['backward'],
+                                            {name: data[name] for name in PROFILE_NAMES})
+                return _link_times[path][1]
+
+    with span('link_times'):
+        profiles = link_profiles(network, raster, elevation_data)
+        times = [link_times(network.link_length, profiles, speed) for speed in WALKING_SPEEDS]
+        forward = np.stack([time_forward for time_forward, _ in times])
+        backward = np.stack([time_backward for _, time_backward in times])
+    if path:
+        tmp_path = path[:-len('.npz')] + '.tmp-' + str(os.getpid()) + '.npz'
+        np.savez(tmp_path, forward=forward, backward=backward, speeds=WALKING_SPEEDS, **profiles, **stamp)
+        os.replace(tmp_path, path)
+        _link_times[path] = stamp, (forward, backward, profiles)
+    return forward, backward, profiles
 
 
 # Defining the radius for searching for the highest point
@@ -124,39 +153,40 @@ def user_input():
         except ValueError:
             print('Invalid input. Input is not a coordinate.')
 
-    # Defining the bounding box vertices against which checking the user location
-    data = {'point': ['bottom_left', 'bottom_right', 'top_right', 'top_left'],
-            'easting_coordinate': [430000, 465000, 465000, 430000],
-            'northing_coordinate': [80000, 80000, 95000, 95000]}
-
-    # Creating a dataframe and its polygon
-    df = pd.DataFrame(data)
-    box_poly = Polygon(df[['easting_coordinate', 'northing_coordinate']].values)
-
     # Checking the user location
-    # First attempt (for task 1): checking the bounding box
-    if box_poly.contains(user_loc) or box_poly.touches(user_loc):
+    check = location_check(user_loc)
+    if check == 'box':
         print('You are in the bounding box.')
+    elif check == 'island':
+        print('You are not in the bounding box but on the island.')
     else:
-        # Second attempt (for task 6): checking with the shapefile
-        shape = gpd.read_file('shape/isle_of_wight.shp')
-        if shape.contains(user_loc).iloc[0] or shape.touches(user_loc).iloc[0]:
-            print('You are not in the bounding box but on the island.')
-        else:
-            print('Invalid location: outside boundaries, quitting.')
-            quit()
+        print('Invalid location: outside boundaries, quitting.')
+        quit()
 
     return user_loc
 
 
+# Checking a location: 'box' if in the bounding box, 'island' if outside it but on the island, otherwise None
+# (the island boundary is only loaded once and reused by every check)
+def location_check(user_loc):
+    return load_boundary().check(user_loc.x, user_loc.y)[0]
+
+
 # Task 2
 # Searching for the highest point withing the defined radius from the user location
-def highest_point(location, radius):
+# An already opened raster and its elevation data (a full array) can be passed in to avoid reading the file again.
+# When not interactive, the search is never extended beyond 5000 m without asking
+def highest_point(location, radius, raster=None, elevation_data=None, interactive=True):
     print('Highest point search in progress..\n')
     buffer = location.buffer(radius)
-    # Reading elevation data file to get the raster which defines the bounding box
-    raster = rasterio.open('elevation/SZ.asc')
-    elevation_data = raster.read(1)
+    # Getting the shared elevation dataset which defines the bounding box
+    if raster is None:
+        raster = open_dem()
+    # Only reading the window of elevation data around the searched area (grown when the radius is increased)
+    if elevation_data is None:
+        elevation_data = DemWindow(raster)
+    if isinstance(elevation_data, DemWindow):
+        elevation_data.ensure_bounds(*buffer.bounds)
     # Searching for the raster bounds and creating its polygon
     elevation_bounds = raster.bounds
     elevation_poly = Polygon([(elevation_bounds[0], elevation_bounds[1]),
@@ -168,16 +198,12 @@ def highest_point(location, radius):
     user_altitude = elevation_data[user_row, user_col]
     # Finding the intersection between the user location buffer and the elevation polygon
     mask_polygon = buffer.intersection(elevation_poly)
-    # Identifying local area's highest altitude
-    local_altitude_array, out_transform = rasterio.mask.mask(dataset=raster, shapes=[mask_polygon],
-                                                             crop=True, filled=False)
-    max_altitude = np.max(local_altitude_array)
-    # Determining the pixel of the highest point
-    loc = np.where(local_altitude_array == max_altitude)
-    row_highest_point = loc[1][0]
-    col_highest_point = loc[2][0]
+    # Identifying local area's highest altitude and its pixel with the precomputed max index of the DEM
+    # (only the blocks crossing the edge of the searched area are scanned)
+    row_highest_point, col_highest_point, max_altitude = \
+        load_max_index(raster, elevation_data).highest(mask_polygon)
     # Convert the row and the column into BNG coordinates
-    x, y = rasterio.transform.xy(out_transform, row_highest_point, col_highest_point)
+    x, y = rasterio.transform.xy(raster.transform, row_highest_point, col_highest_point)
     # Creating a Point class instance for the destination
     dest = Point(x, y)
     print('Current altitude:', int(user_altitude), 'm')
@@ -189,41 +215,48 @@ def highest_point(location, radius):
             radius += 1000
             print('Increasing the search radius by 1000 m. Search radius:', radius, 'm.')
             dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude) = highest_point(
-                location, radius)
+                location, radius, raster, elevation_data, interactive)
             return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
-        else:
+        elif interactive:
             inc = input("5000 m search radius reached. Would you like to increase it anyway?"
                         " Type 'y' to proceed or any other input to resume the current search:\n")
             if inc.lower() == 'y':
                 radius += 500
                 print('Increasing the search radius by 500 m. Search radius:', radius, 'm.')
                 dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude) = \
-                    highest_point(location, radius)
+                    highest_point(location, radius, raster, elevation_data, interactive)
                 return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
             else:
                 print('Current search resumed.')
 
+    # Cutting the searched area out of the DEM (only for the final radius) to be plotted
+    local_altitude_array, out_transform = mask_elevation(raster, elevation_data, [mask_polygon])
+
     return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
 
 
+# Loading the node index saved with the network (built in one pass the first time)
+def node_index(network):
+    return load_node_index(network)
+
+
+# Identifying the nearest node (identifier and coordinates) to the user and to the destination
+@traced('nearest_nodes')
+def nearest_nodes(network, idx, user, dest):
+    # Both points are snapped in a single query
+    nearest, _ = idx.nearest([(user.x, user.y), (dest.x, dest.y)], 1)
+    nearest_to_user, nearest_to_dest = [(str(network.node_ids[i]), network.node_coords[i].tolist())
+                                        for i in nearest[:, 0]]
+    return nearest_to_user, nearest_to_dest
+
+
 # Task 3
 # Identifying the nearest ITN node to the user and the nearest to the destination
 def itn_nodes_parser(user, dest):
-    # Opening the ITN data as a dictionary
-    with open('itn/solent_itn.json') as file:
-        itn_dict = json.load(file)
-    # Creating an index and adding each node's data to the index
-    idx = index.Index()
-    for i, node in enumerate(itn_dict['roadnodes'].items()):
-        idx.insert(i, (node[1]['coords'][0], node[1]['coords'][1]), obj=node[0])
-    # # Assigning the two variables to empty strings to deal with a PEP8 notification
-    nearest_to_user = ''
-    nearest_to_dest = ''
-    # Identifying the nearest node to the user and destination
-    for i in idx.nearest((user.x, user.y), 1, objects='raw'):
-        nearest_to_user = i, itn_dict['roadnodes'][i]['coords']
-    for i in idx.nearest((dest.x, dest.y), 1, objects='raw'):
-        nearest_to_dest = i, itn_dict['roadnodes'][i]['coords']
+    # Loading the precompiled ITN network (the JSON is only parsed again when it changes)
+    network = load_network()
+    idx = node_index(network)
+    nearest_to_user, nearest_to_dest = nearest_nodes(network, idx, user, dest)
     # Avoiding empty paths from trying to be plotted
     if nearest_to_user == nearest_to_dest:
         print('No paths available for the searched area, quitting.')
@@ -234,99 +267,76 @@ def itn_nodes_parser(user, dest):
     user_to_node = LineString([(user.x, user.y), (nearest_to_user[1][0], nearest_to_user[1][1])])
     node_to_dest = LineString([(nearest_to_dest[1][0], nearest_to_dest[1][1]), (dest.x, dest.y)])
 
-    return itn_dict, nearest_to_user, nearest_to_dest, user_to_node, node_to_dest
+    return network, nearest_to_user, nearest_to_dest, user_to_node, node_to_dest
+
+
+# Task 4
+# Building the routing graph of the network for the given walking speed
+@traced('build_graph')
+def build_graph(network, raster, speed, elevation_data=None):
+    # The link times of the fitness classes are all computed at once (or loaded), any other speed's from the profiles
+    time_forward, time_backward, profiles = load_link_times(network, raster, elevation_data)
+    if speed in WALKING_SPEEDS:
+        column = WALKING_SPEEDS.index(speed)
+        time_forward, time_backward = time_forward[column], time_backward[column]
+    else:
+        time_forward, time_backward = link_times(network.link_length, profiles, speed)
+
+    # Building the routing graph on the network's adjacency arrays, with one length and one time weight per edge
+    adj_links = network.adj_links
+    return Graph.from_network(network, length=network.link_length[adj_links],
+                              time=np.where(network.adj_forward, time_forward[adj_links], time_backward[adj_links]))
 
 
 # Task 4
 # Identifying the shortest and fastest routes between the two identified nodes
-def paths(itn, raster, speed, nearest_to_user, nearest_to_dest):
+# The search can be 'astar' (default), 'local' (A* on the part of the graph around both nodes),
+# 'bidirectional', a plain 'dijkstra' or 'ch' (contraction hierarchy, built once and stored with the compiled network).
+# A graph already built for this walking speed can be passed in to avoid building it again.
+# Routes already found between the same nodes at the same speed are taken from the cache (None disables it)
+def paths(network, raster, speed, nearest_to_user, nearest_to_dest, method='astar', graph=None, cache=route_cache):
 
     print('Fastest path search in progress..\n')
 
-    def link_alt_diff():
-        # Retrieving point 1 altitude
-        p1_xy = itn['roadnodes'][attr['start']]['coords'][0], itn['roadnodes'][attr['start']]['coords'][1]
-        p1_row, p1_col = raster.index(p1_xy[0], p1_xy[1])
-        p1_alt = elevation_data[p1_row, p1_col]
-        # Retrieving point 2 altitude
-        p2_xy = itn['roadnodes'][attr['end']]['coords'][0], itn['roadnodes'][attr['end']]['coords'][1]
-        p2_row, p2_col = raster.index(p2_xy[0], p2_xy[1])
-        p2_alt = elevation_data[p2_row, p2_col]
-        # Calculating the difference in altitude
-        diff = p2_alt - p1_alt
-
-        return diff
-
-    elevation_data = raster.read(1)
-
-    # Retrieving data for each node and adding it to a Roadlink object list
-    roadlink_list = []
-    for osgb, attr in itn['roadlinks'].items():
-        alt_diff = link_alt_diff()
-        # Adding data
-        roadlink_list.append(Roadlink(osgb, attr['start'], attr['end'], attr['length'], alt_diff))
-
-    # Initializing a directed graph
-    graph = nx.DiGraph()
-    # Adding to the graph two edges for each roadlink for allowing different weights:
-    # if walking uphill from A to B the time counting the slope is added, otherwise the base time is used
-    for link in roadlink_list:
-        base, with_slope_asc, with_slope_des = link.time_weight(link.length, speed, link.alt_diff)
-        if link.alt_diff > 0:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=with_slope_asc)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=with_slope_des)
-        elif link.alt_diff == 0:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=base)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=base)
-        else:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=with_slope_des)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=with_slope_asc)
-
-    # Identifying the shortest route
-    short_path = nx.dijkstra_path(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='length')
-    # Identifying shortest route's length
-    short_path_distance = nx.dijkstra_path_length(graph, source=nearest_to_user[0],
-                                                  target=nearest_to_dest[0], weight='length')
-
-    roads = itn['roadlinks']
-    # Creating its geoDataFrame to be plotted
-    links = []
-    geom = []
-    short_path_time = 0
-
-    first_node = short_path[0]
-    for node in short_path[1:]:
-        link_fid = graph.edges[first_node, node]['fid']
-        links.append(link_fid)
-        link_time = graph.edges[first_node, node]['time']
-        short_path_time += link_time
-        geom.append(LineString(roads[link_fid]['coords']))
-        first_node = node
-
-    short_path_gpd = gpd.GeoDataFrame({'fid': links, 'geometry': geom})
-
-    # Identifying the fastest route
-    fast_path = nx.dijkstra_path(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='time')
-    # Identifying fastest route's travel time
-    fast_path_time = nx.dijkstra_path_length(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='time')
-
-    # Creating its geoDataFrame to be plotted
-    links = []
-    geom = []
-    fast_path_distance = 0
-
-    first_node = fast_path[0]
-    for node in fast_path[1:]:
-        link_fid = graph.edges[first_node, node]['fid']
-        links.append(link_fid)
-        link_dist = graph.edges[first_node, node]['length']
-        fast_path_distance += link_dist
-        geom.append(LineString(roads[link_fid]['coords']))
-        first_node = node
-
-    fast_path_gpd = gpd.GeoDataFrame({'fid': links, 'geometry': geom})
-
-    return short_path_gpd, (short_path_distance, short_path_time), fast_path_gpd, (fast_path_distance, fast_path_time)
+    if graph is None:
+        graph = build_graph(network, raster, speed)
+
+    source = network.node(nearest_to_user[0])
+    target = network.node(nearest_to_dest[0])
+
+    # The cache entries are only valid for this graph (network, elevation data and walking speed)
+    cached = None
+    if cache is not None:
+        version = graph_version(graph)
+        key = cache.key(source, target, speed)
+        cached = cache.get(key, version)
+        count('route_cache_misses' if cached is None else 'route_cache_hits')
+
+    if cached is None:
+        search = hierarchy_search if method == 'ch' else SEARCHES[method]
+
+        # Identifying the shortest route, with its length and travel time
+        with span('search', method=method, weight='length'):
+            short_path = search(graph, source, target, 'length')
+        count('nodes_settled', short_path.settled)
+        short_path_data = route_totals(graph, short_path)
+
+        # Identifying the fastest route and its travel time
+        with span('search', method=method, weight='time'):
+            fast_path = search(graph, source, target, 'time')
+        count('nodes_settled', fast_path.settled)
+        fast_path_data = route_totals(graph, fast_path)
+
+        if cache is not None:
+            cache.put(key, (short_path, short_path_data, fast_path, fast_path_data), version)
+    else:
+        short_path, short_path_data, fast_path, fast_path_data = cached
+
+    # Their geometries to be plotted (built from the network's link coordinate arrays when first used)
+    short_path_geom = RouteGeometry.from_route(network, short_path)
+    fast_path_geom = RouteGeometry.from_route(network, fast_path)
+
+    return short_path_geom, short_path_data, fast_path_geom, fast_path_data
 
 
 # Task 5
@@ -335,29 +345,41 @@ def paths(itn, raster, speed, nearest_to_user, nearest_to_dest):
 
 def main():
     # Calling task 1 and task 6
-    user_location = user_input()
+    with span('user_input'):
+        user_location = user_input()
 
-    radius, walking_speed = defining_radius_and_speed()
+    with span('defining_radius_and_speed'):
+        radius, walking_speed = defining_radius_and_speed()
 
     # Calling task 2
-    destination, raster, local_array, out_trans, radius, altitudes = highest_point(user_location, radius)
+    with span('highest_point'):
+        destination, raster, local_array, out_trans, radius, altitudes = highest_point(user_location, radius)
 
     # Calling task 3
-    itn_data, nearest_to_user, nearest_to_destination, user_to_node, node_to_dest = \
-        itn_nodes_parser(user_location, destination)
+    with span('itn_nodes_parser'):
+        network, nearest_to_user, nearest_to_destination, user_to_node, node_to_dest = \
+            itn_nodes_parser(user_location, destination)
 
     # Calling task 4
-    short_path_gpd, short_path_data, fast_path_gpd, fast_path_data = \
-        paths(itn_data, raster, walking_speed, nearest_to_user, nearest_to_destination)
+    with span('paths'):
+        short_path, short_path_data, fast_path, fast_path_data = \
+            paths(network, raster, walking_speed, nearest_to_user, nearest_to_destination)
 
     print('Path found! Your safe place is at:', destination.x, destination.y)
     print('Loading map..')
 
     # Calling task 5
     plotter = Plotter(user_location, destination, altitudes, local_array, out_trans, radius,
-                      fast_path_gpd, fast_path_data, short_path_gpd, short_path_data, user_to_node, node_to_dest)
-    plotter.background_map()
+                      fast_path, fast_path_data, short_path, short_path_data, user_to_node, node_to_dest)
+    with span('background_map'):
+        plotter.background_map()
 
 
 if __name__ == "__main__":
-    main()
+    # Recording the time spent in every stage when the FLOOD_TRACE environment variable gives a trace file
+    trace_path = enable_from_environment()
+    try:
+        main()
+    finally:
+        if trace_path:
+            finish(trace_path)
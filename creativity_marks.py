@@ -0,0 +1,30 @@
+# Task 6 (creativity)
+# Defining the radius for searching for the highest point and the walking speed from the fitness level
+
+
+def radius_and_speed(fit):
+    if fit >= 6:
+        radius = 5000
+        walking_speed = 5000 / 60
+    elif fit >= 5:
+        radius = 4000
+        walking_speed = 4000 / 60
+    else:
+        radius = 3000
+        walking_speed = 3500 / 60
+    return radius, walking_speed
+
+
+# Prompting for the fitness level while handling possible invalid input
+def defining_radius_and_speed():
+    while True:
+        try:
+            fit = int(input('Please enter your fitness level in a scale from 1 to 10 '
+                            '(will affect the maximum walking distance):\n'))
+            radius, walking_speed = radius_and_speed(fit)
+
+            print('Estimated walking speed:', round(walking_speed, 2), 'm/min\nSearch radius:', radius, 'm')
+            return radius, walking_speed
+
+        except ValueError:
+            print('Invalid input. Input is not a number.')
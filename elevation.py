@@ -0,0 +1,474 @@
+# Elevation (DEM) helpers shared by the highest point search and the route weighting
+import heapq
+import json
+import os
+import shutil
+import numpy as np
+import rasterio
+import rasterio.mask
+import rasterio.windows
+import shapely
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from instrumentation import count, span, traced
+from network import source_hash
+
+DEM_PATH = 'elevation/SZ.asc'
+# Increasing the version forces every existing binary DEM to be rebuilt
+DEM_FORMAT_VERSION = 1
+
+
+# Binary copy of the DEM: the ASCII grid is parsed once into a raw .npy array (memory-mapped on load)
+# with its transform, CRS and nodata value in a meta.json sidecar.
+# It offers the part of the rasterio dataset interface used by the DEM readers, so it can be used in its place
+class Dem:
+    def __init__(self, data, meta, name):
+        self.data = data
+        self.meta = meta
+        # Name of the source file: the max index is stored and checked against it
+        self.name = name
+        self.transform = Affine(*meta['transform'])
+        self.crs = CRS.from_wkt(meta['crs']) if meta['crs'] else None
+        self.nodata = meta['nodata']
+        self.height, self.width = data.shape
+        self.shape = data.shape
+        self.dtypes = (str(data.dtype),)
+
+    @property
+    def bounds(self):
+        return BoundingBox(*rasterio.transform.array_bounds(self.height, self.width, self.transform))
+
+    def index(self, x, y):
+        return rasterio.transform.rowcol(self.transform, x, y)
+
+    def window_transform(self, window):
+        return rasterio.windows.transform(window, self.transform)
+
+    # Only the single band of the DEM exists. The window must lie within the grid
+    @traced('dem_read')
+    def read(self, indexes=1, window=None):
+        if window is None:
+            return np.array(self.data)
+        return np.array(self.data[window.toslices()])
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Directory holding the binary DEM, next to the source grid
+def dem_dir(path):
+    return os.path.splitext(path)[0] + '.dem'
+
+
+def _read_dem_meta(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'meta.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_dem_meta(out_dir, meta):
+    tmp_path = os.path.join(out_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(out_dir, 'meta.json'))
+
+
+# Converting the DEM into the binary store (a one-time step, repeated only when the source grid changes)
+@traced('dem_compile')
+def compile_dem(path=DEM_PATH, out_dir=None, digest=None):
+    out_dir = out_dir or dem_dir(path)
+    digest = digest or source_hash(path)
+    with rasterio.open(path) as source:
+        data = source.read(1)
+        meta = {'version': DEM_FORMAT_VERSION, 'source_hash': digest, 'transform': list(source.transform)[:6],
+                'crs': source.crs.to_wkt() if source.crs else None, 'nodata': source.nodata}
+    meta.update(zip(('size', 'mtime_ns'), _stat(path)))
+
+    # Writing to a temporary directory first so that a half-written store is never loaded
+    tmp_dir = out_dir + '.tmp-' + str(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, 'elevation.npy'), data)
+    _write_dem_meta(tmp_dir, meta)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+# Loading the memory-mapped DEM, converting the source grid first if the store is missing or stale
+def load_dem(path=DEM_PATH, out_dir=None):
+    out_dir = out_dir or dem_dir(path)
+    meta = _read_dem_meta(out_dir)
+    size, mtime_ns = _stat(path)
+    if meta is None or meta.get('version') != DEM_FORMAT_VERSION:
+        meta = compile_dem(path, out_dir)
+    elif (meta.get('size'), meta.get('mtime_ns')) != (size, mtime_ns):
+        # The file was touched: only rebuild if its content actually changed
+        digest = source_hash(path)
+        if digest != meta['source_hash']:
+            meta = compile_dem(path, out_dir, digest)
+        else:
+            meta.update(size=size, mtime_ns=mtime_ns)
+            _write_dem_meta(out_dir, meta)
+    return Dem(np.load(os.path.join(out_dir, 'elevation.npy'), mmap_mode='r'), meta, path)
+
+
+_dems = {}
+
+
+# Shared DEM, reused across calls instead of loading it every time
+def open_dem(path=DEM_PATH):
+    if path not in _dems:
+        _dems[path] = load_dem(path)
+    return _dems[path]
+
+
+# Extent (start, stop) along one axis of an index that is an integer, a slice or an array
+def _index_extent(index, size):
+    if isinstance(index, slice):
+        return index.start or 0, size if index.stop is None else index.stop
+    index = np.asarray(index)
+    if index.size == 0:
+        return 0, 0
+    return int(index.min()), int(index.max()) + 1
+
+
+def _shift_index(index, offset):
+    if isinstance(index, slice):
+        return slice(None if index.start is None else index.start - offset,
+                     None if index.stop is None else index.stop - offset)
+    return np.asarray(index) - offset
+
+
+# Elevation data read on demand: indexed with the rows and columns of the whole DEM like the array
+# returned by raster.read(1), but only the window of cells actually used is read from the file.
+# When a request falls outside the window read so far, the window is grown by reading only the missing strips
+class DemWindow:
+    def __init__(self, raster):
+        self.raster = raster
+        self.shape = raster.height, raster.width
+        self.dtype = np.dtype(raster.dtypes[0])
+        self.row_off, self.col_off = 0, 0
+        self.data = np.empty((0, 0), dtype=self.dtype)
+
+    def _read(self, row_start, row_stop, col_start, col_stop):
+        window = rasterio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        count('raster_cells_read', (row_stop - row_start) * (col_stop - col_start))
+        with span('raster_read'):
+            return self.raster.read(1, window=window)
+
+    # Making sure the cells [row_start:row_stop, col_start:col_stop] are in memory
+    def ensure(self, row_start, row_stop, col_start, col_stop):
+        row_start, col_start = max(row_start, 0), max(col_start, 0)
+        row_stop, col_stop = min(row_stop, self.shape[0]), min(col_stop, self.shape[1])
+        if row_start >= row_stop or col_start >= col_stop:
+            return
+        old_rows = self.row_off, self.row_off + self.data.shape[0]
+        old_cols = self.col_off, self.col_off + self.data.shape[1]
+        if self.data.size == 0:
+            self.row_off, self.col_off = row_start, col_start
+            self.data = self._read(row_start, row_stop, col_start, col_stop)
+            return
+        if (old_rows[0] <= row_start and row_stop <= old_rows[1]
+                and old_cols[0] <= col_start and col_stop <= old_cols[1]):
+            return
+        rows = min(row_start, old_rows[0]), max(row_stop, old_rows[1])
+        cols = min(col_start, old_cols[0]), max(col_stop, old_cols[1])
+        data = np.empty((rows[1] - rows[0], cols[1] - cols[0]), dtype=self.dtype)
+
+        def place(values, row, col):
+            data[row - rows[0]:row - rows[0] + values.shape[0], col - cols[0]:col - cols[0] + values.shape[1]] = values
+
+        place(self.data, old_rows[0], old_cols[0])
+        # Strips above and below the old window (full new width), then left and right of it
+        if rows[0] < old_rows[0]:
+            place(self._read(rows[0], old_rows[0], cols[0], cols[1]), rows[0], cols[0])
+        if old_rows[1] < rows[1]:
+            place(self._read(old_rows[1], rows[1], cols[0], cols[1]), old_rows[1], cols[0])
+        if cols[0] < old_cols[0]:
+            place(self._read(old_rows[0], old_rows[1], cols[0], old_cols[0]), old_rows[0], cols[0])
+        if old_cols[1] < cols[1]:
+            place(self._read(old_rows[0], old_rows[1], old_cols[1], cols[1]), old_rows[0], old_cols[1])
+        self.row_off, self.col_off = rows[0], cols[0]
+        self.data = data
+
+    # Making sure the cells within some BNG bounds are in memory
+    def ensure_bounds(self, left, bottom, right, top):
+        window = rasterio.windows.from_bounds(left, bottom, right, top, self.raster.transform)
+        self.ensure(int(np.floor(window.row_off)), int(np.ceil(window.row_off + window.height)),
+                    int(np.floor(window.col_off)), int(np.ceil(window.col_off + window.width)))
+
+    def __getitem__(self, key):
+        rows, cols = key
+        row_start, row_stop = _index_extent(rows, self.shape[0])
+        col_start, col_stop = _index_extent(cols, self.shape[1])
+        self.ensure(row_start, row_stop, col_start, col_stop)
+        return self.data[_shift_index(rows, self.row_off), _shift_index(cols, self.col_off)]
+
+
+# Elevation data of a whole DEM, indexed like raster.read(1) but without reading it all into memory: the
+# memory-mapped array of a binary DEM (its pages shared by every process mapping it), otherwise on-demand
+# windowed reads (see DemWindow)
+def elevation_array(raster):
+    return raster.data if isinstance(raster, Dem) else DemWindow(raster)
+
+
+# Sampling the elevation under many points at once: all coordinates are converted into
+# rows and columns in one call and the DEM is fancy-indexed with the resulting arrays
+@traced('elevation_sampling')
+def sample_elevation(raster, elevation_data, coords):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    count('points_sampled', len(coords))
+    rows, cols = rasterio.transform.rowcol(raster.transform, coords[:, 0], coords[:, 1])
+    return elevation_data[np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)]
+
+
+# Bilinear interpolation of the DEM between the centres of the four cells around every point, all points at once.
+# Points next to a nodata cell take the value of the cell they lie in (as sample_elevation), nodata included
+@traced('elevation_sampling_bilinear')
+def sample_bilinear(raster, elevation_data, coords):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    count('points_sampled', len(coords))
+    # Positions relative to the cell centres (the DEM is north up), and the top left of the four cells around them
+    transform = raster.transform
+    cols = (coords[:, 0] - transform.c) / transform.a - 0.5
+    rows = (coords[:, 1] - transform.f) / transform.e - 0.5
+    col0 = np.clip(cols, 0, max(raster.width - 2, 0)).astype(np.intp)
+    row0 = np.clip(rows, 0, max(raster.height - 2, 0)).astype(np.intp)
+    tx, ty = np.clip(cols - col0, 0, 1), np.clip(rows - row0, 0, 1)
+    if len(coords) == 0:
+        return np.zeros(0)
+    # The window of cells spanned by the points is taken once, and the four cells gathered by flat index from it
+    row_start, col_start = int(row0.min()), int(col0.min())
+    window = np.ascontiguousarray(elevation_data[row_start:min(int(row0.max()) + 2, raster.height),
+                                                 col_start:min(int(col0.max()) + 2, raster.width)])
+    flat = (row0 - row_start) * window.shape[1] + (col0 - col_start)
+    right = np.minimum(col0 + 1, raster.width - 1) - col0
+    below = (np.minimum(row0 + 1, raster.height - 1) - row0) * window.shape[1]
+    window = window.ravel()
+    corners = [window.take(flat), window.take(flat + right), window.take(flat + below),
+               window.take(flat + below + right)]
+    top_left, top_right, bottom_left, bottom_right = corners
+    top = top_left + (top_right - top_left) * tx
+    values = top + (bottom_left + (bottom_right - bottom_left) * tx - top) * ty
+    if raster.nodata is not None:
+        near_nodata = np.logical_or.reduce([corner == raster.nodata for corner in corners])
+        if near_nodata.any():
+            values[near_nodata] = sample_elevation(raster, elevation_data, coords[near_nodata])
+    return values
+
+
+# Elevation profiles along many lines at once (line i has the vertices coords[offsets[i]:offsets[i + 1]]).
+# Every segment is cut into pieces of at most `spacing` metres (the DEM's cell size by default) in one flat buffer,
+# the ends of all the pieces are sampled bilinearly in one batch, and the line, horizontal length and rise of
+# every piece are returned (the last vertex of each line starts an empty piece). A piece with an end on nodata has
+# no known rise: it is counted as flat
+@traced('profile_sampling')
+def sample_profiles(raster, elevation_data, offsets, coords, spacing=None):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if spacing is None:
+        spacing = min(abs(raster.transform.a), abs(raster.transform.e))
+    lines = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    # Segment from every vertex to the next vertex of the same line
+    has_next = np.zeros(len(coords), dtype=bool)
+    has_next[:-1] = lines[:-1] == lines[1:]
+    deltas = np.zeros_like(coords)
+    deltas[:-1] = coords[1:] - coords[:-1]
+    deltas[~has_next] = 0
+    lengths = np.sqrt(deltas[:, 0] ** 2 + deltas[:, 1] ** 2)
+    pieces = np.maximum(np.ceil(lengths / spacing), 1).astype(np.int64)
+    # Start of every piece: its vertex plus the piece's rank along the vertex's segment times the piece vector
+    rank = np.arange(pieces.sum(), dtype=np.float64) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    points = np.repeat(coords, pieces, axis=0) + np.repeat(deltas / pieces[:, None], pieces, axis=0) * rank[:, None]
+    altitudes = sample_bilinear(raster, elevation_data, points)
+    rises = np.zeros(len(points))
+    rises[:-1] = np.diff(altitudes)
+    flat = ~np.repeat(has_next, pieces)
+    missing = np.isnan(altitudes)
+    if raster.nodata is not None:
+        missing |= altitudes == raster.nodata
+    flat[:-1] |= missing[:-1] | missing[1:]
+    rises[flat] = 0
+    return np.repeat(lines, pieces), np.repeat(lengths / pieces, pieces), rises
+
+
+# Same result as rasterio.mask.mask(raster, shapes, crop=True, filled=False), but cut from the elevation
+# array already in memory instead of reading the window from the file again
+@traced('mask_elevation')
+def mask_elevation(raster, elevation_data, shapes):
+    shape_mask, out_transform, window = rasterio.mask.raster_geometry_mask(raster, shapes, crop=True)
+    local_data = elevation_data[window.toslices()]
+    if raster.nodata is not None:
+        shape_mask = shape_mask | (local_data == raster.nodata)
+    return np.ma.masked_array(local_data[np.newaxis], mask=shape_mask[np.newaxis]), out_transform
+
+
+# Max pyramid over the DEM for the highest point search.
+# Level 0 stores the maximum (and the position of its first cell, as a row-major flat index) of every block of
+# block x block cells, level 1 of every block x block group of level 0 blocks, and so on. The highest cell within
+# a polygon is found best-first: blocks entirely inside the polygon are answered by their stored maximum, blocks
+# outside are skipped and only the blocks crossing the boundary are split, down to a scan of their cells
+class MaxIndex:
+    def __init__(self, maxes, args, elevation_data, transform, nodata, block):
+        self.maxes = maxes
+        self.args = args
+        self.data = elevation_data
+        self.transform = transform
+        self.nodata = nodata
+        self.block = block
+
+    @classmethod
+    @traced('max_index_build')
+    def build(cls, elevation_data, transform, nodata, block=8):
+        height, width = elevation_data.shape
+        values = elevation_data.astype(np.float64)
+        if nodata is not None:
+            values[elevation_data == nodata] = -np.inf
+        args = np.arange(height * width, dtype=np.int64).reshape(height, width)
+        maxes, arg_levels = [], []
+        while True:
+            values, args = cls._reduce(values, args, block)
+            maxes.append(values)
+            arg_levels.append(args)
+            if values.shape[0] <= block and values.shape[1] <= block:
+                break
+        return cls(maxes, arg_levels, elevation_data, transform, nodata, block)
+
+    # Maximum of every block x block group, keeping the first cell (row-major) among equal maxima
+    @staticmethod
+    def _reduce(values, args, block):
+        height, width = values.shape
+        rows, cols = -(-height // block), -(-width // block)
+        padded = np.full((rows * block, cols * block), -np.inf)
+        padded[:height, :width] = values
+        padded_args = np.full((rows * block, cols * block), np.iinfo(np.int64).max, dtype=np.int64)
+        padded_args[:height, :width] = args
+        groups = padded.reshape(rows, block, cols, block).swapaxes(1, 2).reshape(rows, cols, -1)
+        group_args = padded_args.reshape(rows, block, cols, block).swapaxes(1, 2).reshape(rows, cols, -1)
+        group_max = groups.max(axis=2)
+        first = np.where(groups == group_max[:, :, np.newaxis], group_args, np.iinfo(np.int64).max).min(axis=2)
+        return group_max, first
+
+    def save(self, path, **meta):
+        arrays = {'max_' + str(i): values for i, values in enumerate(self.maxes)}
+        arrays.update({'arg_' + str(i): args for i, args in enumerate(self.args)})
+        np.savez(path, block=self.block, **arrays, **{'meta_' + key: value for key, value in meta.items()})
+
+    @classmethod
+    def load(cls, path, elevation_data, transform, nodata):
+        with np.load(path) as data:
+            levels = sum(1 for name in data.files if name.startswith('max_'))
+            maxes = [data['max_' + str(i)] for i in range(levels)]
+            args = [data['arg_' + str(i)] for i in range(levels)]
+            meta = {name[len('meta_'):]: data[name].item() for name in data.files if name.startswith('meta_')}
+            index = cls(maxes, args, elevation_data, transform, nodata, int(data['block']))
+        index.meta = meta
+        return index
+
+    # Pushing the blocks of a level that reach into the polygon, classified all at once: a block whose cell
+    # centres are all inside is exact, otherwise its maximum is only an upper bound. Blocks lower than the best
+    # exact value found so far (floor) can never win and are dropped
+    def _push_blocks(self, heap, polygon, level, rows, cols, floor):
+        rows, cols = rows.ravel(), cols.ravel()
+        values = self.maxes[level][rows, cols]
+        keep = (values > -np.inf) & (values >= floor)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+        if not len(values):
+            return floor
+        size = self.block ** (level + 1)
+        height, width = self.data.shape
+        row_start, row_end = rows * size, np.minimum((rows + 1) * size, height)
+        col_start, col_end = cols * size, np.minimum((cols + 1) * size, width)
+        # Rectangle around the centres of the cells of each block (grown by a hair so it is never degenerate)
+        t = self.transform
+        xs = t.c + (col_start + 0.5) * t.a, t.c + (col_end - 0.5) * t.a
+        ys = t.f + (row_start + 0.5) * t.e, t.f + (row_end - 0.5) * t.e
+        grow = 1e-6 * abs(t.a)
+        boxes = shapely.box(np.minimum(*xs) - grow, np.minimum(*ys) - grow,
+                            np.maximum(*xs) + grow, np.maximum(*ys) + grow)
+        touching = shapely.intersects(polygon, boxes)
+        inside = shapely.contains(polygon, boxes)
+        args = self.args[level][rows, cols]
+        for i in np.flatnonzero(touching).tolist():
+            if inside[i]:
+                heapq.heappush(heap, (-values[i], int(args[i]), 0, level, 0, 0))
+                floor = max(floor, values[i])
+            else:
+                # No cell of the block comes before its first cell in row-major order
+                first = int(row_start[i]) * width + int(col_start[i])
+                heapq.heappush(heap, (-values[i], first, 1, level, int(rows[i]), int(cols[i])))
+        return floor
+
+    # Scanning the cells of a boundary block whose centres are inside the polygon
+    def _scan(self, heap, polygon, row, col, floor):
+        size = self.block
+        row_start, col_start = row * size, col * size
+        values = self.data[row_start:row_start + size, col_start:col_start + size].astype(np.float64)
+        rows, cols = np.mgrid[row_start:row_start + values.shape[0], col_start:col_start + values.shape[1]]
+        t = self.transform
+        inside = shapely.contains_xy(polygon, t.c + (cols + 0.5) * t.a, t.f + (rows + 0.5) * t.e)
+        if self.nodata is not None:
+            inside &= values != self.nodata
+        values[~inside] = -np.inf
+        best = np.argmax(values)
+        if values.flat[best] > -np.inf and values.flat[best] >= floor:
+            flat = int(rows.flat[best]) * self.data.shape[1] + int(cols.flat[best])
+            heapq.heappush(heap, (-values.flat[best], flat, 0, -1, 0, 0))
+            floor = values.flat[best]
+        return floor
+
+    # Highest cell whose centre lies inside the polygon: (row, column, altitude), or None if there is none.
+    # Among equally high cells the first one in row-major order is returned, as np.where would
+    @traced('max_index_search')
+    def highest(self, polygon):
+        shapely.prepare(polygon)
+        heap = []
+        top = len(self.maxes) - 1
+        floor = self._push_blocks(heap, polygon, top, *np.indices(self.maxes[top].shape), -np.inf)
+        while heap:
+            value, first, partial, level, row, col = heapq.heappop(heap)
+            if not partial:
+                row, col = divmod(first, self.data.shape[1])
+                return row, col, -value
+            if level == 0:
+                floor = self._scan(heap, polygon, row, col, floor)
+                continue
+            child_rows, child_cols = self.maxes[level - 1].shape
+            rows, cols = np.mgrid[row * self.block:min((row + 1) * self.block, child_rows),
+                                  col * self.block:min((col + 1) * self.block, child_cols)]
+            floor = self._push_blocks(heap, polygon, level - 1, rows, cols, floor)
+        return None
+
+
+_max_indexes = {}
+
+
+# Loading the max index of an opened raster, building it (and saving it next to the DEM file) the first time
+# or when the DEM file has changed. The elevation data can be a full array or a DemWindow
+def load_max_index(raster, elevation_data):
+    path = os.path.splitext(raster.name)[0] + '.maxindex.npz'
+    size, mtime_ns = _stat(raster.name)
+    index = _max_indexes.get(path)
+    if index is None and os.path.exists(path):
+        index = MaxIndex.load(path, elevation_data, raster.transform, raster.nodata)
+    if index is None or index.meta.get('size') != size or index.meta.get('mtime_ns') != mtime_ns:
+        # Building the index is the only step needing the whole DEM at once
+        full_data = elevation_data if isinstance(elevation_data, np.ndarray) else raster.read(1)
+        index = MaxIndex.build(full_data, raster.transform, raster.nodata)
+        index.meta = {'size': size, 'mtime_ns': mtime_ns}
+        tmp_path = path[:-len('.npz')] + '.tmp-' + str(os.getpid()) + '.npz'
+        index.save(tmp_path, **index.meta)
+        os.replace(tmp_path, path)
+    index.data = elevation_data
+    _max_indexes[path] = index
+    return index
+
+
+if __name__ == '__main__':
+    print('Converting', DEM_PATH, 'into', dem_dir(DEM_PATH))
+    compile_dem()
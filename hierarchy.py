@@ -0,0 +1,269 @@
+# Contraction hierarchy
+# Offline, the nodes are contracted one by one (least important first) and shortcut edges are added so that
+# shortest path costs between the remaining nodes are preserved. A query is then a bidirectional search that
+# only climbs towards more important nodes, and its shortcuts are unpacked back into the original edges
+import hashlib
+import heapq
+import os
+import numpy as np
+from network import artifact_dir, default_source
+from routing import Route, NoPath
+
+CH_DIR = artifact_dir(default_source())
+ARRAYS = ('rank', 'up_offsets', 'up_targets', 'up_weights', 'up_edges',
+          'down_offsets', 'down_targets', 'down_weights', 'down_edges',
+          'edge_child1', 'edge_child2', 'edge_orig', 'orig_targets')
+
+
+class Hierarchy:
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._up = tuple(memoryview(a) for a in (self.up_offsets, self.up_targets, self.up_weights, self.up_edges))
+        self._down = tuple(memoryview(a) for a in (self.down_offsets, self.down_targets, self.down_weights,
+                                                   self.down_edges))
+
+    def save(self, path):
+        np.savez(path, **{name: getattr(self, name) for name in ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in ARRAYS})
+
+    # Replacing every shortcut by the two edges it was made of, until only original graph edges are left
+    def unpack(self, ch_edges):
+        child1, child2, orig = self.edge_child1, self.edge_child2, self.edge_orig
+        edges = []
+        for ch_edge in ch_edges:
+            stack = [ch_edge]
+            while stack:
+                edge = stack.pop()
+                if child1[edge] < 0:
+                    edges.append(int(orig[edge]))
+                else:
+                    stack.append(child2[edge])
+                    stack.append(child1[edge])
+        return edges
+
+    # Point-to-point query: a forward search on the upward edges from the source and a backward search on the
+    # (reversed) downward edges from the target. Each side stops once its frontier cannot beat the best meeting
+    def route(self, source, target):
+        if source == target:
+            return Route([source], [], 0.0, 1)
+        dists = {source: 0.0}, {target: 0.0}
+        preds = {}, {}
+        heaps = [(0.0, source)], [(0.0, target)]
+        settled = 0
+        best = np.inf
+        meeting = None
+        while True:
+            forward = heaps[0][0][0] if heaps[0] else np.inf
+            backward = heaps[1][0][0] if heaps[1] else np.inf
+            if min(forward, backward) >= best:
+                break
+            side = 0 if forward <= backward else 1
+            d, node = heapq.heappop(heaps[side])
+            dist, other_dist, pred = dists[side], dists[1 - side], preds[side]
+            if d > dist[node]:
+                continue
+            settled += 1
+            if node in other_dist and d + other_dist[node] < best:
+                best = d + other_dist[node]
+                meeting = node
+            offsets, targets, weights, ch_edges = self._up if side == 0 else self._down
+            for i in range(offsets[node], offsets[node + 1]):
+                succ = targets[i]
+                new_d = d + weights[i]
+                if new_d < dist.get(succ, np.inf):
+                    dist[succ] = new_d
+                    pred[succ] = node, ch_edges[i]
+                    heapq.heappush(heaps[side], (new_d, succ))
+        if meeting is None:
+            raise NoPath('No path between nodes ' + str(source) + ' and ' + str(target))
+
+        ch_path = []
+        node = meeting
+        while node != source:
+            node, ch_edge = preds[0][node]
+            ch_path.append(ch_edge)
+        ch_path.reverse()
+        node = meeting
+        while node != target:
+            node, ch_edge = preds[1][node]
+            ch_path.append(ch_edge)
+        edges = self.unpack(ch_path)
+        nodes = [source] + self.orig_targets[edges].tolist()
+        return Route(nodes, edges, best, settled)
+
+
+# Contracting every node of the graph for the given weight.
+# witness_limit bounds the number of nodes settled while looking for a path that makes a shortcut unnecessary
+def build_hierarchy(graph, weight, witness_limit=100):
+    n = graph.n_nodes
+    edge_source = graph.sources().tolist()
+    edge_target = graph.targets.tolist()
+    edge_weight = graph.weights[weight].tolist()
+    edge_child1 = [-1] * len(edge_weight)
+    edge_child2 = [-1] * len(edge_weight)
+    edge_orig = list(range(len(edge_weight)))
+
+    # Remaining graph: out_edges[u][v] / in_edges[v][u] hold the cheapest edge id from u to v
+    out_edges = [{} for _ in range(n)]
+    in_edges = [{} for _ in range(n)]
+    for edge, (u, v, w) in enumerate(zip(edge_source, edge_target, edge_weight)):
+        if u != v and (v not in out_edges[u] or w < edge_weight[out_edges[u][v]]):
+            out_edges[u][v] = edge
+            in_edges[v][u] = edge
+
+    # Costs of the paths from start (avoiding the node being contracted) found within the limits.
+    # The search stops early once all the targets are settled
+    def witness_search(start, avoid, max_cost, targets):
+        dist = {start: 0.0}
+        heap = [(0.0, start)]
+        settled = 0
+        remaining = len(targets)
+        while heap and settled < witness_limit:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            if d > max_cost:
+                break
+            settled += 1
+            if node in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for succ, edge in out_edges[node].items():
+                if succ == avoid:
+                    continue
+                new_d = d + edge_weight[edge]
+                if new_d < dist.get(succ, np.inf):
+                    dist[succ] = new_d
+                    heapq.heappush(heap, (new_d, succ))
+        return dist
+
+    # Shortcuts needed to contract a node: u -> node -> x, unless a witness path at most as cheap exists
+    def shortcuts(node):
+        needed = []
+        outs = list(out_edges[node].items())
+        if not outs:
+            return needed
+        max_out = max(edge_weight[edge] for _, edge in outs)
+        targets = set(out_edges[node])
+        for u, in_edge in in_edges[node].items():
+            w_in = edge_weight[in_edge]
+            dist = witness_search(u, node, w_in + max_out, targets)
+            for x, out_edge in outs:
+                w = w_in + edge_weight[out_edge]
+                if x != u and dist.get(x, np.inf) > w:
+                    needed.append((u, x, w, in_edge, out_edge))
+        return needed
+
+    # Edge difference plus the number of already contracted neighbours (keeps the contraction uniform)
+    contracted_neighbours = [0] * n
+
+    def priority(node, needed):
+        return len(needed) - len(out_edges[node]) - len(in_edges[node]) + contracted_neighbours[node]
+
+    heap = [(priority(node, shortcuts(node)), node) for node in range(n)]
+    heapq.heapify(heap)
+    rank = np.empty(n, dtype=np.int32)
+    up = [None] * n
+    down = [None] * n
+    order = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        # Lazy update: the priority may have changed since it was pushed
+        needed = shortcuts(node)
+        current = priority(node, needed)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, node))
+            continue
+
+        for u, x, w, in_edge, out_edge in needed:
+            if x in out_edges[u] and edge_weight[out_edges[u][x]] <= w:
+                continue
+            edge = len(edge_weight)
+            edge_source.append(u)
+            edge_target.append(x)
+            edge_weight.append(w)
+            edge_child1.append(in_edge)
+            edge_child2.append(out_edge)
+            edge_orig.append(-1)
+            out_edges[u][x] = edge
+            in_edges[x][u] = edge
+
+        # The edges still connecting the node to the remaining graph all lead to more important nodes
+        up[node] = list(out_edges[node].items())
+        down[node] = list(in_edges[node].items())
+        for u in in_edges[node]:
+            del out_edges[u][node]
+            contracted_neighbours[u] += 1
+        for x in out_edges[node]:
+            del in_edges[x][node]
+            contracted_neighbours[x] += 1
+        out_edges[node] = {}
+        in_edges[node] = {}
+        rank[node] = order
+        order += 1
+
+    def csr(adjacency):
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(items) for items in adjacency], out=offsets[1:])
+        targets = np.array([succ for items in adjacency for succ, _ in items], dtype=np.int32)
+        edges = np.array([edge for items in adjacency for _, edge in items], dtype=np.int32)
+        return offsets, targets, np.array(edge_weight, dtype=np.float64)[edges], edges
+
+    arrays = dict(zip(('up_offsets', 'up_targets', 'up_weights', 'up_edges'), csr(up)))
+    arrays.update(zip(('down_offsets', 'down_targets', 'down_weights', 'down_edges'), csr(down)))
+    arrays.update(rank=rank, edge_child1=np.array(edge_child1, dtype=np.int32),
+                  edge_child2=np.array(edge_child2, dtype=np.int32), edge_orig=np.array(edge_orig, dtype=np.int32),
+                  orig_targets=graph.targets.copy())
+    return Hierarchy(arrays)
+
+
+# Hierarchies are stored under a digest of the graph and weight they were built for,
+# so a change in the network, the elevation data or the walking speed selects (or builds) a new one
+def graph_digest(graph, weight):
+    if weight not in graph.digests:
+        digest = hashlib.sha256()
+        for array in (graph.offsets, graph.targets, graph.weights[weight]):
+            digest.update(np.ascontiguousarray(array).data)
+        graph.digests[weight] = digest.hexdigest()[:16]
+    return graph.digests[weight]
+
+
+_loaded = {}
+
+
+def load_hierarchy(graph, weight, directory=CH_DIR):
+    path = os.path.join(directory, 'ch-' + weight + '-' + graph_digest(graph, weight) + '.npz')
+    if path not in _loaded:
+        if not os.path.exists(path):
+            print('Building the contraction hierarchy for', weight, '(one-time step)..')
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = path[:-len('.npz')] + '.tmp-' + str(os.getpid()) + '.npz'
+            build_hierarchy(graph, weight).save(tmp_path)
+            os.replace(tmp_path, path)
+        _loaded[path] = Hierarchy.load(path)
+    return _loaded[path]
+
+
+# Same signature as the searches in routing.SEARCHES
+def hierarchy_search(graph, source, target, weight):
+    return load_hierarchy(graph, weight).route(source, target)
+
+
+# Preprocessing the length weight and the time weight of every walking speed
+if __name__ == '__main__':
+    from elevation import open_dem
+    from network import load_network
+    from task_4 import build_graph, WALKING_SPEEDS
+
+    network = load_network()
+    raster = open_dem()
+    for speed in WALKING_SPEEDS:
+        graph = build_graph(network, raster, speed)
+        for weight in ('length', 'time'):
+            load_hierarchy(graph, weight)
@@ -0,0 +1,196 @@
+# Instrumentation
+# Timed spans around the pipeline's stages and sub-steps (nested), counters (e.g. the nodes settled by every
+# search) and, optionally, the peak memory allocated within every span (traced with tracemalloc).
+# Recorded spans are exported as a Chrome trace-event JSON file (to open in chrome://tracing or ui.perfetto.dev)
+# and summed up per name in a table.
+# Nothing is recorded until enable() is called: span() and count() then cost a single check.
+# main() enables it when the FLOOD_TRACE environment variable gives the trace file to write
+# (with FLOOD_TRACE_MEMORY=1 the memory is traced too, which slows the pure Python steps down)
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tracer._enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer._exit(self)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.counters = {}
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            # Counter event: the running total, drawn as a graph under the spans
+            self.events.append({'name': name, 'ph': 'C', 'ts': self._now(), 'pid': os.getpid(),
+                                'tid': threading.get_ident(), 'args': {name: self.counters[name]}})
+
+    def _now(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    # The tracemalloc peak is reset at every span boundary, after being passed on to every open span:
+    # each span then sees the highest peak reached while it was open, nested spans included
+    def _fold_peak(self, stack):
+        _, peak = tracemalloc.get_traced_memory()
+        for span in stack:
+            span.peak = max(span.peak, peak)
+        tracemalloc.reset_peak()
+
+    def _enter(self, span):
+        stack = self._stack()
+        if self.memory:
+            self._fold_peak(stack)
+            span.start_memory = span.peak = tracemalloc.get_traced_memory()[0]
+        stack.append(span)
+        span.start = self._now()
+
+    def _exit(self, span):
+        end = self._now()
+        stack = self._stack()
+        stack.pop()
+        event = {'name': span.name, 'ph': 'X', 'ts': span.start, 'dur': end - span.start, 'pid': os.getpid(),
+                 'tid': threading.get_ident(), 'args': dict(span.args)}
+        if self.memory:
+            self._fold_peak(stack + [span])
+            event['args']['peak_kb'] = (span.peak - span.start_memory) / 1024
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+
+    # Calls, total, mean and longest time and highest memory peak of every span name, in order of first call,
+    # followed by the counters
+    def summary(self):
+        stats = {}
+        for event in self.events:
+            if event['ph'] != 'X':
+                continue
+            stat = stats.setdefault(event['name'], {'calls': 0, 'total': 0.0, 'max': 0.0, 'peak_kb': None,
+                                                    'first': event['ts']})
+            stat['first'] = min(stat['first'], event['ts'])
+            stat['calls'] += 1
+            stat['total'] += event['dur'] / 1000
+            stat['max'] = max(stat['max'], event['dur'] / 1000)
+            if 'peak_kb' in event['args']:
+                stat['peak_kb'] = max(stat['peak_kb'] or 0.0, event['args']['peak_kb'])
+        width = max([len(name) for name in stats] + [len(name) for name in self.counters] + [4])
+        lines = ['%-*s %7s %12s %12s %12s %12s' % (width, 'span', 'calls', 'total ms', 'mean ms', 'max ms',
+                                                   'peak MB')]
+        for name, stat in sorted(stats.items(), key=lambda item: item[1]['first']):
+            peak = '%.1f' % (stat['peak_kb'] / 1024) if stat['peak_kb'] is not None else '-'
+            lines.append('%-*s %7d %12.2f %12.2f %12.2f %12s' % (width, name, stat['calls'], stat['total'],
+                                                                 stat['total'] / stat['calls'], stat['max'], peak))
+        if self.counters:
+            lines.append('%-*s %20s' % (width, 'counter', 'total'))
+            for name, value in self.counters.items():
+                lines.append('%-*s %20s' % (width, name, value))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+_tracer = None
+
+
+def enable(memory=False):
+    global _tracer
+    _tracer = Tracer(memory)
+    return _tracer
+
+
+# Stopping the recording. Returns the tracer with what it recorded
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+
+def tracer():
+    return _tracer
+
+
+# `with span('name', key=value):` records the time spent in the block (and the given arguments)
+def span(name, **args):
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def count(name, value=1):
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+# Decorator recording every call of a function as a span
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Enabling the recording when the FLOOD_TRACE environment variable is set. Returns the trace file path or None
+def enable_from_environment():
+    path = os.environ.get('FLOOD_TRACE')
+    if path:
+        enable(memory=os.environ.get('FLOOD_TRACE_MEMORY', '') not in ('', '0'))
+    return path
+
+
+# Writing the trace file and printing the summary table of what was recorded since enable()
+def finish(path):
+    tracer = disable()
+    if tracer is None:
+        return
+    tracer.write(path)
+    print(tracer.summary())
+    print('Trace written to', path)
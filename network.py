@@ -0,0 +1,422 @@
+# Precompiled road network
+# The ITN JSON (or the roads shapefiles) is compiled once into a directory of binary .npy arrays which are
+# memory-mapped on load, so that every run does not need to parse the source and rebuild the network from scratch
+import array
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from instrumentation import span, traced
+from shapefiles import read_dbf, read_lines, read_points
+from spatial_index import NodeIndex
+
+ITN_PATH = 'itn/solent_itn.json'
+# The same network as shapefiles: the road nodes (with their ITN identifiers) and the links' geometries
+ROADS_DIR = 'roads'
+ROADS_FILES = ('nodes.shp', 'nodes.shx', 'nodes.dbf', 'links.shp', 'links.shx')
+# Largest distance (m) between a link's end and the node it is snapped to
+SNAP_TOLERANCE = 0.01
+# Increasing the version forces every existing artifact to be rebuilt
+FORMAT_VERSION = 1
+ARRAYS = ('node_ids', 'node_coords', 'link_fids', 'link_start', 'link_end', 'link_length',
+          'geom_offsets', 'geom_coords', 'adj_offsets', 'adj_nodes', 'adj_links', 'adj_forward')
+
+
+class Network:
+    def __init__(self, arrays, meta, directory=None):
+        # Nodes: ITN identifiers interned to integer positions and their coordinates
+        self.node_ids = arrays['node_ids']
+        self.node_coords = arrays['node_coords']
+        # Links: identifiers, start and end node positions and lengths
+        self.link_fids = arrays['link_fids']
+        self.link_start = arrays['link_start']
+        self.link_end = arrays['link_end']
+        self.link_length = arrays['link_length']
+        # Link geometries: one flat coordinate buffer, link i spans geom_offsets[i]:geom_offsets[i + 1]
+        self.geom_offsets = arrays['geom_offsets']
+        self.geom_coords = arrays['geom_coords']
+        # CSR adjacency: every link can be walked both ways, so it appears once from each of its end nodes.
+        # The entries leaving node i are adj_offsets[i]:adj_offsets[i + 1]
+        self.adj_offsets = arrays['adj_offsets']
+        self.adj_nodes = arrays['adj_nodes']
+        self.adj_links = arrays['adj_links']
+        self.adj_forward = arrays['adj_forward']
+        self.meta = meta
+        # Artifact directory the arrays were loaded from, where derived data (e.g. the node index) is stored too
+        self.directory = directory
+        self._node_index = None
+        self._link_index = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_links(self):
+        return len(self.link_fids)
+
+    # Mapping from ITN node identifier to its integer position, only built when first needed
+    def node(self, node_id):
+        if self._node_index is None:
+            self._node_index = {node_id: i for i, node_id in enumerate(self.node_ids.tolist())}
+        return self._node_index[node_id]
+
+    # Mapping from ITN link identifier (fid) to its integer position
+    def link(self, fid):
+        if self._link_index is None:
+            self._link_index = {fid: i for i, fid in enumerate(self.link_fids.tolist())}
+        return self._link_index[fid]
+
+    def link_coords(self, link):
+        return self.geom_coords[self.geom_offsets[link]:self.geom_offsets[link + 1]]
+
+
+# The ITN JSON when it is there, otherwise the roads shapefiles
+def default_source():
+    if os.path.exists(ITN_PATH) or not os.path.isdir(ROADS_DIR):
+        return ITN_PATH
+    return ROADS_DIR
+
+
+# Directory holding the compiled arrays, next to the source JSON (or directory of shapefiles)
+def artifact_dir(itn_path):
+    return os.path.splitext(os.path.normpath(itn_path))[0] + '.network'
+
+
+# Files a source is read from: the file itself, or the shapefiles of a directory
+def _source_files(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in ROADS_FILES]
+    return [path]
+
+
+def source_hash(path):
+    digest = hashlib.sha256()
+    for file_path in _source_files(path):
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_stat(path):
+    stats = [os.stat(file_path) for file_path in _source_files(path)]
+    return {'size': sum(stat.st_size for stat in stats), 'mtime_ns': max(stat.st_mtime_ns for stat in stats)}
+
+
+def _read_meta(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'meta.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(out_dir, meta):
+    tmp_path = os.path.join(out_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(out_dir, 'meta.json'))
+
+
+# Streaming reader: the members of the JSON's top-level objects are decoded one by one from a text buffer
+# refilled chunk by chunk, so that neither the whole file nor the whole document is ever held at once
+class _JsonStream:
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Dropping what was already consumed
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Next character that is not whitespace (consumed when it is one of `expected`), or None at the end
+    def char(self, expected=None):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                char = self.buffer[self.pos]
+                if expected is not None:
+                    if char not in expected:
+                        raise ValueError('Invalid ITN JSON: expected %r, found %r' % (expected, char))
+                    self.pos += 1
+                return char
+            if not self._fill():
+                if expected is not None:
+                    raise ValueError('Invalid ITN JSON: unexpected end of file, expected %r' % expected)
+                return None
+
+    # Decoding the next JSON value. A value ending with the buffer might continue in the next chunk
+    # (e.g. a number), so it is only accepted when followed by another character or at the end of the file
+    def value(self):
+        self.char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    # (key, value) members of the object starting at the current position
+    def members(self):
+        self.char('{')
+        if self.char() == '}':
+            self.char('}')
+            return
+        while True:
+            key = self.value()
+            self.char(':')
+            yield key, self.value()
+            if self.char(',}') == '}':
+                return
+
+
+# (section, identifier, feature) of every road node and road link of the ITN JSON, in file order
+# (the other top-level members are skipped)
+def iter_itn(itn_path=ITN_PATH, chunk_size=1 << 20):
+    with open(itn_path) as file:
+        stream = _JsonStream(file, chunk_size)
+        for section in _top_level(stream):
+            for key, feature in stream.members():
+                yield section, key, feature
+
+
+# Names of the top-level members holding the road nodes and road links, whose objects are left to the caller
+# to read. Any other member is decoded and discarded
+def _top_level(stream):
+    stream.char('{')
+    if stream.char() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.char(':')
+        if key in ('roadnodes', 'roadlinks'):
+            yield key
+        else:
+            stream.value()
+        if stream.char(',}') == '}':
+            return
+
+
+def _in_bbox(xy, bbox):
+    return bbox[0] <= xy[0] <= bbox[2] and bbox[1] <= xy[1] <= bbox[3]
+
+
+# Whether the envelope of a link's coordinates intersects the bounding box
+def _crosses_bbox(coords, bbox):
+    xs = [xy[0] for xy in coords]
+    ys = [xy[1] for xy in coords]
+    return min(xs) <= bbox[2] and max(xs) >= bbox[0] and min(ys) <= bbox[3] and max(ys) >= bbox[1]
+
+
+# Reading the ITN JSON as a dictionary like json.load() does, streaming it feature by feature.
+# With a bounding box (min x, min y, max x, max y), only the nodes within it and the links whose envelope
+# intersects it are kept, so that memory grows with the area of interest and not with the whole file.
+# The end nodes outside the box of the links crossing its edge are taken from the links' own end coordinates
+def read_itn(itn_path=ITN_PATH, bbox=None, chunk_size=1 << 20):
+    itn_dict = {'roadnodes': {}, 'roadlinks': {}}
+    for section, key, feature in iter_itn(itn_path, chunk_size):
+        if bbox is None:
+            itn_dict[section][key] = feature
+        elif section == 'roadnodes' and _in_bbox(feature['coords'], bbox):
+            itn_dict[section][key] = {'coords': feature['coords']}
+        elif section == 'roadlinks' and _crosses_bbox(feature['coords'], bbox):
+            itn_dict[section][key] = {name: feature[name] for name in ('start', 'end', 'length', 'coords')}
+    if bbox is not None:
+        nodes = itn_dict['roadnodes']
+        for link in itn_dict['roadlinks'].values():
+            nodes.setdefault(link['start'], {'coords': link['coords'][0]})
+            nodes.setdefault(link['end'], {'coords': link['coords'][-1]})
+    return itn_dict
+
+
+# Columns of the network filled feature by feature (coordinates and lengths in compact typed arrays rather than
+# in the features' lists and dictionaries), then turned into the network's flat arrays
+class _Columns:
+    def __init__(self):
+        self.node_ids = []
+        self.node_coords = array.array('d')
+        self.link_fids = []
+        self.link_start = []
+        self.link_end = []
+        self.link_length = array.array('d')
+        self.geom_sizes = array.array('q')
+        self.geom_coords = array.array('d')
+
+    def add_node(self, node_id, node):
+        self.node_ids.append(node_id)
+        self.node_coords.extend(node['coords'][:2])
+
+    def add_link(self, fid, link):
+        self.link_fids.append(fid)
+        self.link_start.append(link['start'])
+        self.link_end.append(link['end'])
+        self.link_length.append(link['length'])
+        self.geom_sizes.append(len(link['coords']))
+        for xy in link['coords']:
+            self.geom_coords.extend(xy[:2])
+
+    def arrays(self):
+        node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        node_coords = np.frombuffer(self.node_coords, dtype=np.float64).reshape(-1, 2).copy()
+
+        link_start = np.array([node_index[node_id] for node_id in self.link_start], dtype=np.int32)
+        link_end = np.array([node_index[node_id] for node_id in self.link_end], dtype=np.int32)
+        link_length = np.frombuffer(self.link_length, dtype=np.float64).copy()
+
+        geom_offsets = np.zeros(len(self.link_fids) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(self.geom_sizes, dtype=np.int64), out=geom_offsets[1:])
+        geom_coords = np.frombuffer(self.geom_coords, dtype=np.float64).reshape(-1, 2).copy()
+        return _network_arrays(self.node_ids, node_coords, self.link_fids, link_start, link_end, link_length,
+                               geom_offsets, geom_coords)
+
+
+# The network's arrays from its nodes and links, with the adjacency built from the links' end nodes
+def _network_arrays(node_ids, node_coords, link_fids, link_start, link_end, link_length, geom_offsets, geom_coords):
+    # Each link produces two directed entries: start -> end (forward) and end -> start (backward)
+    n_links = len(link_fids)
+    sources = np.concatenate([link_start, link_end])
+    order = np.argsort(sources, kind='stable')
+    adj_nodes = np.concatenate([link_end, link_start])[order].astype(np.int32)
+    adj_links = np.concatenate([np.arange(n_links, dtype=np.int32)] * 2)[order]
+    adj_forward = np.concatenate([np.ones(n_links, dtype=bool), np.zeros(n_links, dtype=bool)])[order]
+    adj_offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=adj_offsets[1:])
+
+    return {'node_ids': np.array(node_ids, dtype=str), 'node_coords': node_coords,
+            'link_fids': np.array(link_fids, dtype=str), 'link_start': link_start, 'link_end': link_end,
+            'link_length': link_length, 'geom_offsets': geom_offsets, 'geom_coords': geom_coords,
+            'adj_offsets': adj_offsets, 'adj_nodes': adj_nodes, 'adj_links': adj_links,
+            'adj_forward': adj_forward}
+
+
+# Converting the ITN dictionary into flat arrays
+def build_arrays(itn_dict):
+    columns = _Columns()
+    for node_id, node in itn_dict['roadnodes'].items():
+        columns.add_node(node_id, node)
+    for fid, link in itn_dict['roadlinks'].items():
+        columns.add_link(fid, link)
+    return columns.arrays()
+
+
+# Converting the ITN JSON into flat arrays while it is streamed, without building the ITN dictionary
+def stream_arrays(itn_path=ITN_PATH):
+    columns = _Columns()
+    for section, key, feature in iter_itn(itn_path):
+        if section == 'roadnodes':
+            columns.add_node(key, feature)
+        else:
+            columns.add_link(key, feature)
+    return columns.arrays()
+
+
+# Converting the roads shapefiles into flat arrays, read column by column (see shapefiles.py).
+# links.shp has no attribute table: the links are named after their record numbers (from 1), their lengths are
+# measured along their geometries and their ends snapped to the nodes they lie on
+def shapefile_arrays(roads_dir=ROADS_DIR):
+    node_coords = read_points(os.path.join(roads_dir, 'nodes.shp'))
+    node_ids = read_dbf(os.path.join(roads_dir, 'nodes.dbf'), ['fid'])['fid']
+    geom_offsets, geom_coords = read_lines(os.path.join(roads_dir, 'links.shp'))
+    n_links = len(geom_offsets) - 1
+    if np.any(np.diff(geom_offsets) < 2):
+        raise ValueError('%s: links without two vertices' % roads_dir)
+
+    lines = np.repeat(np.arange(n_links), np.diff(geom_offsets))
+    segments = np.hypot(*np.diff(geom_coords, axis=0).T) * (lines[:-1] == lines[1:])
+    link_length = np.bincount(lines[:-1], weights=segments, minlength=n_links)
+
+    # The ends are looked up among the nodes sorted by coordinates (complex numbers sort by x, then y), and only
+    # the ones not found exactly are snapped to their nearest node
+    ends = np.concatenate([geom_coords[geom_offsets[:-1]], geom_coords[geom_offsets[1:] - 1]])
+    node_keys, end_keys = node_coords[:, 0] + 1j * node_coords[:, 1], ends[:, 0] + 1j * ends[:, 1]
+    order = np.argsort(node_keys, kind='stable')
+    found = np.minimum(np.searchsorted(node_keys[order], end_keys), len(order) - 1)
+    nodes = order[found]
+    inexact = np.flatnonzero(node_keys[nodes] != end_keys)
+    if len(inexact):
+        nearest, distances = NodeIndex.build(node_coords).nearest(ends[inexact], 1)
+        if np.any(distances[:, 0] > SNAP_TOLERANCE):
+            raise ValueError('%s: %d link ends are not on a node'
+                             % (roads_dir, np.sum(distances[:, 0] > SNAP_TOLERANCE)))
+        nodes[inexact] = nearest[:, 0]
+    link_start, link_end = nodes[:n_links].astype(np.int32), nodes[n_links:].astype(np.int32)
+    link_fids = np.arange(1, n_links + 1).astype(str)
+    return _network_arrays(node_ids, node_coords, link_fids, link_start, link_end, link_length, geom_offsets,
+                           geom_coords)
+
+
+# Compiling the ITN JSON, or the directory of roads shapefiles, into the binary artifact (a one-time step,
+# repeated only when the source changes)
+def compile_network(itn_path=None, out_dir=None, digest=None):
+    itn_path = itn_path or default_source()
+    out_dir = out_dir or artifact_dir(itn_path)
+    digest = digest or source_hash(itn_path)
+    if os.path.isdir(itn_path):
+        with span('shapefile_arrays'):
+            arrays = shapefile_arrays(itn_path)
+    else:
+        with span('itn_stream_arrays'):
+            arrays = stream_arrays(itn_path)
+
+    # Writing to a temporary directory first so that a half-written artifact is never loaded
+    tmp_dir = out_dir + '.tmp-' + str(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_dir, name + '.npy'), arrays[name])
+    meta = dict(version=FORMAT_VERSION, source_hash=digest, **_source_stat(itn_path))
+    _write_meta(tmp_dir, meta)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+# Loading the memory-mapped network, compiling it first if it is missing or stale.
+# The source is the ITN JSON or a directory of roads shapefiles (by default the JSON if there is one)
+@traced('load_network')
+def load_network(itn_path=None, out_dir=None):
+    itn_path = itn_path or default_source()
+    out_dir = out_dir or artifact_dir(itn_path)
+    meta = _read_meta(out_dir)
+    if meta is None or meta.get('version') != FORMAT_VERSION:
+        meta = compile_network(itn_path, out_dir)
+    elif {'size': meta.get('size'), 'mtime_ns': meta.get('mtime_ns')} != _source_stat(itn_path):
+        # The file was touched: only rebuild if its content actually changed
+        digest = source_hash(itn_path)
+        if digest != meta['source_hash']:
+            meta = compile_network(itn_path, out_dir, digest)
+        else:
+            meta.update(_source_stat(itn_path))
+            _write_meta(out_dir, meta)
+
+    arrays = {name: np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+    return Network(arrays, meta, out_dir)
+
+
+# Network of the part of the ITN within a bounding box (min x, min y, max x, max y), e.g. the search area
+# around a location, read straight from the JSON into memory without compiling the whole file
+@traced('load_region')
+def load_region(bbox, itn_path=ITN_PATH):
+    return Network(build_arrays(read_itn(itn_path, bbox)), {'bbox': list(bbox)})
+
+
+if __name__ == '__main__':
+    print('Compiling', default_source(), 'into', artifact_dir(default_source()))
+    compile_network()
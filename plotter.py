@@ -1,14 +1,68 @@
+import os
 import rasterio
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import rasterio.plot
+import rasterio.windows
+import shapely
 from matplotlib import cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 from mpl_toolkits.axes_grid1.anchored_artists import AnchoredSizeBar
+from instrumentation import count, traced
+
+BACKGROUND_PATH = 'background/raster-50k_2724246.tif'
+
+
+# Opened basemap and its colour palette, kept for every map drawn by the process
+# (GDAL also keeps the blocks it has decoded, so overlapping maps do not decode them again)
+class Basemap:
+    def __init__(self, path=BACKGROUND_PATH):
+        self.dataset = rasterio.open(path)
+        self.palette = np.array([value for key, value in self.dataset.colormap(1).items()])
+
+    # Reading the basemap only within the plotted bounds (left, bottom, right, top), decimated so that no more
+    # than `pixels` pixels are decoded along each side (rasterio uses the overviews of the file when it has some),
+    # and colour-mapping only these pixels. Returns the RGB image and its extent, or None outside the basemap
+    @traced('basemap_read')
+    def image(self, bounds, pixels):
+        background = self.dataset
+        window = rasterio.windows.from_bounds(*bounds, transform=background.transform)
+        col_start = max(int(np.floor(window.col_off)), 0)
+        row_start = max(int(np.floor(window.row_off)), 0)
+        col_stop = min(int(np.ceil(window.col_off + window.width)), background.width)
+        row_stop = min(int(np.ceil(window.row_off + window.height)), background.height)
+        if col_start >= col_stop or row_start >= row_stop:
+            return None
+        window = rasterio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        step = max(1, int(np.ceil(max(window.width, window.height) / pixels)))
+        out_shape = int(np.ceil(window.height / step)), int(np.ceil(window.width / step))
+        back_array = background.read(1, window=window, out_shape=out_shape)
+        count('basemap_pixels_read', out_shape[0] * out_shape[1])
+        left, bottom, right, top = background.window_bounds(window)
+        return self.palette[back_array], [left, right, bottom, top]
+
+
+_basemaps = {}
+
+
+# One basemap per process (dataset handles cannot be shared with forked processes)
+def load_basemap(path=BACKGROUND_PATH):
+    key = path, os.getpid()
+    if key not in _basemaps:
+        _basemaps[key] = Basemap(path)
+    return _basemaps[key]
+
+
+def read_basemap(bounds, pixels, path=BACKGROUND_PATH):
+    return load_basemap(path).image(bounds, pixels)
 
 
 class Plotter:
     def __init__(self, user_loc, dest, altitudes, alt_array, trans_output, radius,
-                 fast_path_gpd, fast_path_data, short_path_gpd, short_path_data, user_to_node, node_to_dest):
+                 fast_path, fast_path_data, short_path, short_path_data, user_to_node, node_to_dest):
         self.user_location = user_loc
         self.destination = dest
         self.user_alt = altitudes[0]
@@ -16,64 +70,60 @@ class Plotter:
         self.altitude_array = alt_array
         self.transform_output = trans_output
         self.radius = radius
-        self.fast_path_gpd = fast_path_gpd
+        self.fast_path = fast_path
         self.fast_path_data = fast_path_data
-        self.short_path_gpd = short_path_gpd
+        self.short_path = short_path
         self.short_path_data = short_path_data
         self.user_to_node = user_to_node
         self.node_to_dest = node_to_dest
 
+    # Interactive map (pyplot window)
     def background_map(self):
+        fig, ax = plt.subplots()
+        self.draw(fig, ax)
+        self.show()
 
-        # Read the raster
-        background = rasterio.open('background/raster-50k_2724246.tif')
-        back_array = background.read(1)
+    # Drawing the whole map on the given figure and axes (no pyplot state involved)
+    @traced('draw_map')
+    def draw(self, fig, ax):
+        terrain = matplotlib.colormaps['terrain']
 
-        # Set colours
-        palette = np.array([value for key, value in background.colormap(1).items()])
-        background_image = palette[back_array]
+        # Read the part of the raster shown by the plot, at the resolution of the figure
+        view = (self.user_location.x - self.radius, self.user_location.y - self.radius,
+                self.user_location.x + self.radius, self.user_location.y + self.radius)
+        basemap = read_basemap(view, int(max(fig.get_size_inches()) * fig.dpi))
 
         # Plot the map with correct width and height
-        bounds = background.bounds
-        extent = [bounds.left, bounds.right, bounds.bottom, bounds.top]
-
-        # Set a plot
-        fig, ax = plt.subplots()
-        ax.imshow(background_image, extent=extent, zorder=0)
+        if basemap is not None:
+            background_image, extent = basemap
+            ax.imshow(background_image, extent=extent, zorder=0)
 
         # Zoom in on the map
-        plt.xlim(self.user_location.x - self.radius, self.user_location.x + self.radius)
-        plt.ylim(self.user_location.y - self.radius, self.user_location.y + self.radius)
+        ax.set_xlim(view[0], view[2])
+        ax.set_ylim(view[1], view[3])
 
         # Set the title
         ax.set_title(label='Isle of Wight:\nFlood Emergency Planning', fontdict={'fontsize': 20})
 
         # Show the elevation
         rasterio.plot.show(source=self.altitude_array, ax=ax, zorder=1,
-                           transform=self.transform_output, alpha=0.4, cmap=plt.get_cmap('terrain'))
+                           transform=self.transform_output, alpha=0.4, cmap=terrain)
 
         # Draw elevation colour bar using task 2 buffer
         norm = cm.colors.Normalize(vmax=np.max(self.altitude_array), vmin=np.min(self.altitude_array))
-        cb = fig.colorbar(cm.ScalarMappable(norm=norm, cmap=plt.get_cmap('terrain')), ax=ax)
+        cb = fig.colorbar(cm.ScalarMappable(norm=norm, cmap=terrain), ax=ax)
         cb.ax.set_ylabel(ylabel='Elevation(m)', size=10)
 
         # Assign the size of the colour bar
         cb.ax.tick_params(labelsize=10)
 
         # Plot the different paths
-        if self.short_path_data[0] == self.fast_path_data[0] and self.short_path_data[1] == self.fast_path_data[1]:
-            self.fast_path_gpd.plot(ax=ax, edgecolor='r', linewidth=2, zorder=2,
-                                    label='Fastest path (Distance: ' + str(round(self.fast_path_data[0])) +
-                                          ' m / Travel time: ' + str(round(self.fast_path_data[1])) + ' min)')
-
-        else:
-            self.fast_path_gpd.plot(ax=ax, edgecolor='r', linewidth=2, zorder=2,
-                                    label='Fastest path (Distance: ' + str(round(self.fast_path_data[0])) +
-                                          ' m / Travel time: ' + str(round(self.fast_path_data[1])) + ' min)')
-
-            self.short_path_gpd.plot(ax=ax, edgecolor='b', linewidth=2, zorder=2,
-                                     label='Shortest path (Distance: ' + str(round(self.short_path_data[0])) +
-                                           ' m / Travel time: ' + str(round(self.short_path_data[1])) + ' min)')
+        self.add_path(ax, self.fast_path, 'r', 'Fastest path (Distance: ' + str(round(self.fast_path_data[0])) +
+                      ' m / Travel time: ' + str(round(self.fast_path_data[1])) + ' min)')
+        if self.short_path_data[0] != self.fast_path_data[0] or self.short_path_data[1] != self.fast_path_data[1]:
+            self.add_path(ax, self.short_path, 'b', 'Shortest path (Distance: ' +
+                          str(round(self.short_path_data[0])) + ' m / Travel time: ' +
+                          str(round(self.short_path_data[1])) + ' min)')
 
         # Draw scale bar
         scale_bar = AnchoredSizeBar(ax.transData, size=1000,
@@ -89,36 +139,55 @@ class Plotter:
                     xycoords=ax.transAxes)
 
         # Call the plots
-        self.add_user_location()
-        self.add_destination()
-        self.connections()
+        self.add_user_location(ax)
+        self.add_destination(ax)
+        self.connections(ax)
+        self.legend(ax)
 
-        self.show()
+    # Adds a path as its single merged line
+    @staticmethod
+    def add_path(ax, path, colour, label):
+        lines = [shapely.get_coordinates(path.line)]
+        ax.add_collection(LineCollection(lines, colors=colour, linewidths=2, zorder=2, label=label), autolim=False)
 
     # Adds initial position of the user
-    def add_user_location(self):
-        plt.plot(self.user_location.x, self.user_location.y,
-                 marker='*', color='w', markersize=10, markerfacecolor='gold', markeredgecolor='k',
-                 label='You are here (Elev: ' + str(int(self.user_alt)) + ' m)')
+    def add_user_location(self, ax):
+        ax.plot(self.user_location.x, self.user_location.y,
+                marker='*', color='w', markersize=10, markerfacecolor='gold', markeredgecolor='k',
+                label='You are here (Elev: ' + str(int(self.user_alt)) + ' m)')
 
     # Adds destination point
-    def add_destination(self):
-        plt.plot(self.destination.x, self.destination.y,
-                 marker='^', color='w', markersize=10, markerfacecolor='forestgreen', markeredgecolor='k',
-                 label='Safe place (Elev: ' + str(int(self.dest_alt)) + ' m)')
+    def add_destination(self, ax):
+        ax.plot(self.destination.x, self.destination.y,
+                marker='^', color='w', markersize=10, markerfacecolor='forestgreen', markeredgecolor='k',
+                label='Safe place (Elev: ' + str(int(self.dest_alt)) + ' m)')
 
-    def connections(self):
-        plt.plot(self.user_to_node.xy[0], self.user_to_node.xy[1], 'k--',
-                 self.node_to_dest.xy[0], self.node_to_dest.xy[1], 'k--', label='Off road / By sea')
+    def connections(self, ax):
+        ax.plot(self.user_to_node.xy[0], self.user_to_node.xy[1], 'k--',
+                self.node_to_dest.xy[0], self.node_to_dest.xy[1], 'k--', label='Off road / By sea')
 
-    def show(self):
-        handles, labels = plt.gca().get_legend_handles_labels()
+    def legend(self, ax):
+        handles, labels = ax.get_legend_handles_labels()
         by_label = dict(zip(labels, handles))
-        plt.legend(by_label.values(), by_label.keys(),
-                   loc='upper center', bbox_to_anchor=(0.5, -0.05), fontsize='medium',
-                   fancybox=True, shadow=True, ncol=5)
+        ax.legend(by_label.values(), by_label.keys(),
+                  loc='upper center', bbox_to_anchor=(0.5, -0.05), fontsize='medium',
+                  fancybox=True, shadow=True, ncol=5)
 
+    def show(self):
         plt.show()
 
-
-
+    # Headless map: drawn with the Agg renderer on a figure reused by every map of the process,
+    # and written to a file whose extension gives the format (e.g. .png or .pdf)
+    @traced('save_map')
+    def save(self, path, dpi=100):
+        fig = _figures.get(os.getpid())
+        if fig is None:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            _figures[os.getpid()] = fig
+        fig.clf()
+        self.draw(fig, fig.add_subplot())
+        fig.savefig(path, dpi=dpi)
+
+
+_figures = {}
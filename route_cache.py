@@ -0,0 +1,102 @@
+# Route cache
+# Route results are kept per (start node, destination node, walking speed) in a bounded in-memory LRU, and
+# optionally in a directory shared by several processes. Every entry is stored with the version it was found for
+# (a digest of the routing graph, i.e. of the network, the elevation data and the time model) and is only
+# returned for that same version: entries of an older network or DEM are dropped when looked up, or evicted
+import os
+import pickle
+from collections import OrderedDict
+from hierarchy import graph_digest
+
+
+class RouteCache:
+    def __init__(self, maxsize=1024, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(source, target, speed):
+        return int(source), int(target), round(float(speed), 9)
+
+    def _path(self, key, version):
+        return os.path.join(self.directory, version, '%d-%d-%r.pkl' % key)
+
+    def get(self, key, version):
+        if key in self._entries:
+            entry_version, value = self._entries[key]
+            if entry_version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        if self.directory:
+            try:
+                with open(self._path(key, version), 'rb') as file:
+                    value = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                self._store(key, value, version)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, version):
+        self._store(key, value, version)
+        if self.directory:
+            # Written to a temporary file first so that other processes never read a half-written entry
+            path = self._path(key, version)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp-' + str(os.getpid())
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(value, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    def _store(self, key, value, version):
+        self._entries[key] = version, value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # Moving the in-memory entries of a graph version to the version the graph has after a change,
+    # for the entries which keep(value) says are still valid. The other entries of that version are dropped
+    def revalidate(self, old_version, new_version, keep):
+        if old_version == new_version:
+            return
+        for key, (version, value) in list(self._entries.items()):
+            if version != old_version:
+                continue
+            if keep(value):
+                self._entries[key] = new_version, value
+            else:
+                del self._entries[key]
+
+    # Dropping the in-memory entries (the directory is left untouched)
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'disk_hits': self.disk_hits, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Version of the routes found on a graph: a digest of both of its weights
+def graph_version(graph):
+    return graph_digest(graph, 'length') + graph_digest(graph, 'time')
+
+
+# Cache used by paths() unless another one is given
+route_cache = RouteCache()
@@ -0,0 +1,74 @@
+# Geometry of a route, built from the network's flat link coordinate buffer
+# The coordinates of all the links of a route are gathered with one fancy index (no Python loop over the links),
+# the links' own LineStrings and the GeoDataFrame are only created when asked for
+import geopandas as gpd
+import numpy as np
+import shapely
+from instrumentation import span
+
+
+# Positions in the coordinate buffer of a sequence of links, each one walked from start to end when forward
+# is True and from end to start otherwise. Also returns the link (as its index in the sequence) of every position
+def _coord_index(offsets, links, forward):
+    starts, stops = offsets[links], offsets[links + 1]
+    sizes = stops - starts
+    which = np.repeat(np.arange(len(links)), sizes)
+    within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return np.where(forward[which], starts[which] + within, stops[which] - 1 - within), which
+
+
+class RouteGeometry:
+    # links: network link positions in travel order, forward: whether each link is walked from its start node
+    def __init__(self, network, links, forward):
+        self.network = network
+        self.links = np.asarray(links, dtype=np.int64)
+        self.forward = np.asarray(forward, dtype=bool)
+        self._lines = None
+        self._line = None
+        self._gdf = None
+
+    @classmethod
+    def from_route(cls, network, route):
+        # The routing graph's edges are the network's adjacency entries
+        return cls(network, network.adj_links[route.edges], network.adj_forward[route.edges])
+
+    # ITN identifiers of the links
+    @property
+    def fids(self):
+        return self.network.link_fids[self.links].tolist()
+
+    # One LineString per link, in the link's own direction
+    @property
+    def lines(self):
+        if self._lines is None and len(self.links) == 0:
+            self._lines = np.empty(0, dtype=object)
+        if self._lines is None:
+            index, which = _coord_index(self.network.geom_offsets, self.links, np.ones(len(self.links), dtype=bool))
+            self._lines = shapely.linestrings(self.network.geom_coords[index], indices=which)
+        return self._lines
+
+    # The whole route as a single LineString in travel order (shared vertices between links appear once)
+    @property
+    def line(self):
+        if self._line is None:
+            with span('route_geometry'):
+                index, _ = _coord_index(self.network.geom_offsets, self.links, self.forward)
+                coords = self.network.geom_coords[index]
+                keep = np.ones(len(coords), dtype=bool)
+                keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+                coords = coords[keep]
+                self._line = shapely.linestrings(coords) if len(coords) >= 2 else shapely.LineString()
+        return self._line
+
+    def simplified(self, tolerance):
+        return shapely.simplify(self.line, tolerance)
+
+    # GeoDataFrame of the links (one row per link with its fid and geometry)
+    @property
+    def gdf(self):
+        if self._gdf is None:
+            self._gdf = gpd.GeoDataFrame({'fid': self.fids, 'geometry': self.lines})
+        return self._gdf
+
+    def __len__(self):
+        return len(self.links)
@@ -0,0 +1,395 @@
+# Array-backed routing engine
+# The graph is stored in CSR form: the edges leaving node i are offsets[i]:offsets[i + 1], and every weight
+# (e.g. 'length' and 'time') is an array parallel to the edges. Nodes are the integer positions of the network
+import heapq
+import math
+from collections import namedtuple
+import numpy as np
+
+# Result of a search: the nodes and edges of the path, its cost and the number of nodes settled by the search
+Route = namedtuple('Route', ['nodes', 'edges', 'cost', 'settled'])
+# Result of a search to every node: for each node its cost, the source it was reached from
+# and the edge it was reached through (-1 for the sources and unreachable nodes)
+Tree = namedtuple('Tree', ['dist', 'origin', 'pred'])
+
+
+class NoPath(Exception):
+    pass
+
+
+class Graph:
+    def __init__(self, offsets, targets, links, coords=None, **weights):
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.targets = np.ascontiguousarray(targets, dtype=np.int32)
+        # Network link traversed by each edge
+        self.links = np.ascontiguousarray(links, dtype=np.int32)
+        # Node coordinates (only needed by the goal-directed searches)
+        self.coords = coords
+        self.weights = {name: np.ascontiguousarray(values, dtype=np.float64) for name, values in weights.items()}
+        self._views = {}
+        self._rates = {}
+        self._reverse = None
+        self._reverse_index = None
+        # Nodes sorted by x and their sorted x (see nodes_within), sorted when first needed
+        self._x_order = None
+        self._sorted_x = None
+        # Digests of the weights (see hierarchy.graph_digest), to be cleared whenever a weight is changed
+        self.digests = {}
+
+    @classmethod
+    def from_network(cls, network, **weights):
+        return cls(network.adj_offsets, network.adj_nodes, network.adj_links, network.node_coords, **weights)
+
+    @property
+    def n_nodes(self):
+        return len(self.offsets) - 1
+
+    # Memoryviews over the arrays: indexing them returns plain Python numbers (as fast as a list)
+    # without copying the arrays into Python objects
+    def view(self, weight):
+        if weight not in self._views:
+            self._views[weight] = (memoryview(self.offsets), memoryview(self.targets),
+                                   memoryview(self.weights[weight]))
+        return self._views[weight]
+
+    def sources(self):
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.offsets))
+
+    # Transposed graph (edges pointing the other way), used by the backward half of the bidirectional search.
+    # edge_ids maps each reversed edge back to the edge of this graph it comes from
+    def reverse(self):
+        if self._reverse is None:
+            order = np.argsort(self.targets, kind='stable')
+            offsets = np.zeros(len(self.offsets), dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.n_nodes), out=offsets[1:])
+            weights = {name: values[order] for name, values in self.weights.items()}
+            self._reverse = Graph(offsets, self.sources()[order], self.links[order], self.coords, **weights)
+            self._reverse.edge_ids = order
+        return self._reverse
+
+    # Nodes v within the ellipse |v - a| + |v - b| <= reach around nodes a and b, in increasing order. Only the
+    # nodes in the strip of x within the ellipse's bounding circle (a slice of the nodes sorted by x) are measured
+    def nodes_within(self, a, b, reach):
+        if self._sorted_x is None:
+            self._x_order = np.argsort(self.coords[:, 0], kind='stable')
+            self._sorted_x = np.ascontiguousarray(self.coords[self._x_order, 0])
+        (ax, ay), (bx, by) = self.coords[a].tolist(), self.coords[b].tolist()
+        half = reach / 2 * (1 + 1e-9)
+        start, stop = np.searchsorted(self._sorted_x, [(ax + bx) / 2 - half, (ax + bx) / 2 + half]).tolist()
+        candidates = self._x_order[start:stop]
+        x, y = self.coords[candidates, 0], self.coords[candidates, 1]
+        # sqrt of the squares rather than np.hypot, several times faster on large arrays
+        sums = np.sqrt((x - ax) ** 2 + (y - ay) ** 2) + np.sqrt((x - bx) ** 2 + (y - by) ** 2)
+        return np.sort(candidates[sums <= reach])
+
+    # Subgraph of the given nodes (in increasing order) and of the edges between them, returned with the
+    # positions in this graph of its edges. Both keep their order, and the subgraph uses this graph's rates,
+    # so that a search on it visits nodes and edges in the same order
+    def subgraph(self, nodes):
+        positions = np.full(self.n_nodes, -1, dtype=np.int64)
+        positions[nodes] = np.arange(len(nodes))
+        counts = self.offsets[nodes + 1] - self.offsets[nodes]
+        first = np.repeat(self.offsets[nodes] - np.cumsum(counts) + counts, counts)
+        edges = first + np.arange(len(first))
+        edge_sources = np.repeat(np.arange(len(nodes)), counts)
+        inside = positions[self.targets[edges]] >= 0
+        edges, edge_sources = edges[inside], edge_sources[inside]
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edge_sources, minlength=len(nodes)), out=offsets[1:])
+        subgraph = Graph(offsets, positions[self.targets[edges]], self.links[edges],
+                         None if self.coords is None else self.coords[nodes],
+                         **{name: values[edges] for name, values in self.weights.items()})
+        subgraph._rates = dict(self._rates)
+        return subgraph, edges
+
+    # Changing the weight of some edges in place, e.g. for closed or slowed roads (values is a scalar or an array
+    # parallel to edges). The reversed graph is kept in step, and everything derived from the weights is reset
+    def update_weights(self, weight, edges, values):
+        edges = np.asarray(edges, dtype=np.int64)
+        self.weights[weight][edges] = values
+        self._rates.pop(weight, None)
+        self.digests.pop(weight, None)
+        if self._reverse is not None:
+            if self._reverse_index is None:
+                self._reverse_index = np.empty_like(self._reverse.edge_ids)
+                self._reverse_index[self._reverse.edge_ids] = np.arange(len(self._reverse.edge_ids))
+            self._reverse.update_weights(weight, self._reverse_index[edges], values)
+
+    # Smallest cost per metre of straight-line distance over all edges. Multiplying a straight-line distance
+    # by it never overestimates the remaining cost: it is ~1 for 'length' (a road is never shorter than
+    # the straight line between its ends) and the inverse of the fastest walking speed found for 'time'
+    def min_rate(self, weight):
+        return self._edge_rates(weight)[0]
+
+    # Median cost per metre of straight-line distance: what a route typically costs per metre
+    def median_rate(self, weight):
+        return self._edge_rates(weight)[1]
+
+    def _edge_rates(self, weight):
+        if weight not in self._rates:
+            chords = np.hypot(*(self.coords[self.targets] - self.coords[self.sources()]).T)
+            moving = chords > 0
+            rates = self.weights[weight][moving] / chords[moving]
+            self._rates[weight] = ((max(float(rates.min()), 0.0), float(np.median(rates))) if rates.size
+                                   else (0.0, 0.0))
+        return self._rates[weight]
+
+    # Admissible estimate of the cost from every node to the target
+    def heuristic(self, target, weight):
+        return np.hypot(*(self.coords - self.coords[target]).T) * self.min_rate(weight)
+
+
+# Length and travel time of a route, both summed exactly (math.fsum) from its edges' weights whatever weight it
+# was found for, so that the same route always gets the very same figures
+def route_totals(graph, route):
+    return tuple(math.fsum(graph.weights[weight][route.edges].tolist()) for weight in ('length', 'time'))
+
+
+# Rebuilding the path from the predecessor edges stored during a search
+def _unwind(pred, source, target):
+    nodes = [target]
+    edges = []
+    node = target
+    while node != source:
+        node, edge = pred[node]
+        nodes.append(node)
+        edges.append(edge)
+    nodes.reverse()
+    edges.reverse()
+    return nodes, edges
+
+
+# Heap-based Dijkstra from source to target over the given weight
+def dijkstra(graph, source, target, weight):
+    offsets, targets, costs = graph.view(weight)
+    dist = {source: 0.0}
+    pred = {}
+    settled = set()
+    heap = [(0.0, source)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        if node == target:
+            nodes, edges = _unwind(pred, source, target)
+            return Route(nodes, edges, d, len(settled) + 1)
+        settled.add(node)
+        for edge in range(offsets[node], offsets[node + 1]):
+            succ = targets[edge]
+            new_d = d + costs[edge]
+            if new_d < dist.get(succ, np.inf):
+                dist[succ] = new_d
+                pred[succ] = node, edge
+                heapq.heappush(heap, (new_d, succ))
+    raise NoPath('No path between nodes ' + str(source) + ' and ' + str(target))
+
+
+# A* search: Dijkstra ordered by cost so far plus the straight-line estimate of the cost left,
+# so that only the nodes lying towards the target are settled
+def astar(graph, source, target, weight):
+    offsets, targets, costs = graph.view(weight)
+    estimate = memoryview(graph.heuristic(target, weight))
+    dist = {source: 0.0}
+    pred = {}
+    settled = set()
+    heap = [(estimate[source], 0.0, source)]
+    while heap:
+        _, d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        if node == target:
+            nodes, edges = _unwind(pred, source, target)
+            return Route(nodes, edges, d, len(settled) + 1)
+        settled.add(node)
+        for edge in range(offsets[node], offsets[node + 1]):
+            succ = targets[edge]
+            new_d = d + costs[edge]
+            if new_d < dist.get(succ, np.inf):
+                dist[succ] = new_d
+                pred[succ] = node, edge
+                heapq.heappush(heap, (new_d + estimate[succ], new_d, succ))
+    raise NoPath('No path between nodes ' + str(source) + ' and ' + str(target))
+
+
+# Bidirectional Dijkstra: one search forward from the source and one backward from the target on the
+# reversed graph, always expanding the side with the smaller frontier, until the two frontiers together
+# cannot improve on the best meeting point found so far
+def bidirectional_dijkstra(graph, source, target, weight):
+    if source == target:
+        return Route([source], [], 0.0, 1)
+    reverse = graph.reverse()
+    views = graph.view(weight), reverse.view(weight)
+    edge_ids = None, memoryview(reverse.edge_ids)
+    dists = {source: 0.0}, {target: 0.0}
+    preds = {}, {}
+    settled = set(), set()
+    heaps = [(0.0, source)], [(0.0, target)]
+    best = np.inf
+    meeting = None
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        d, node = heapq.heappop(heaps[side])
+        if node in settled[side]:
+            continue
+        settled[side].add(node)
+        offsets, targets, costs = views[side]
+        dist, other_dist, pred = dists[side], dists[1 - side], preds[side]
+        for edge in range(offsets[node], offsets[node + 1]):
+            succ = targets[edge]
+            new_d = d + costs[edge]
+            if new_d < dist.get(succ, np.inf):
+                dist[succ] = new_d
+                # Edges are always stored as edges of the forward graph
+                pred[succ] = node, (edge if side == 0 else edge_ids[1][edge])
+                heapq.heappush(heaps[side], (new_d, succ))
+                if succ in other_dist and new_d + other_dist[succ] < best:
+                    best = new_d + other_dist[succ]
+                    meeting = succ
+    if meeting is None:
+        raise NoPath('No path between nodes ' + str(source) + ' and ' + str(target))
+
+    # Joining the forward half (source -> meeting node) and the backward half (meeting node -> target)
+    nodes, edges = _unwind(preds[0], source, meeting)
+    node = meeting
+    while node != target:
+        node, edge = preds[1][node]
+        nodes.append(node)
+        edges.append(edge)
+    return Route(nodes, edges, best, len(settled[0]) + len(settled[1]))
+
+
+# Dijkstra from a whole set of sources at once: every node is reached from its closest source
+def multi_source_dijkstra(graph, sources, weight):
+    offsets, targets, costs = graph.view(weight)
+    n = graph.n_nodes
+    dist = [np.inf] * n
+    origin = [-1] * n
+    pred = [-1] * n
+    settled = [False] * n
+    heap = []
+    for source in sources:
+        dist[source] = 0.0
+        origin[source] = source
+        heap.append((0.0, source))
+    heapq.heapify(heap)
+    while heap:
+        d, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = True
+        for edge in range(offsets[node], offsets[node + 1]):
+            succ = targets[edge]
+            new_d = d + costs[edge]
+            if new_d < dist[succ]:
+                dist[succ] = new_d
+                origin[succ] = origin[node]
+                pred[succ] = edge
+                heapq.heappush(heap, (new_d, succ))
+    return Tree(np.array(dist), np.array(origin, dtype=np.int32), np.array(pred, dtype=np.int64))
+
+
+# Repairing a tree (see multi_source_dijkstra) after the weight of some edges changed, instead of searching again.
+# The nodes whose tree path uses a changed edge lose their cost; they are then reached again from the best of
+# their neighbours that kept theirs, and from there the search continues as usual (also through the changed
+# edges that became cheaper). Returns the repaired tree and the number of nodes that lost their cost
+def repair_tree(graph, tree, changed_edges, weight):
+    dist, origin, pred = tree.dist.copy(), tree.origin.copy(), tree.pred.copy()
+    n = graph.n_nodes
+    edge_sources = graph.sources()
+    costs = graph.weights[weight]
+    changed_edges = np.unique(np.asarray(changed_edges, dtype=np.int64))
+    changed_targets = graph.targets[changed_edges]
+
+    # Subtrees hanging from the changed tree edges, found level by level over the children of every node
+    parent = np.where(pred >= 0, edge_sources[np.maximum(pred, 0)], -1)
+    has_parent = np.flatnonzero(parent >= 0)
+    children = has_parent[np.argsort(parent[has_parent], kind='stable')]
+    child_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parent[has_parent], minlength=n), out=child_offsets[1:])
+    frontier = np.unique(changed_targets[pred[changed_targets] == changed_edges])
+    affected = np.zeros(n, dtype=bool)
+    while len(frontier):
+        affected[frontier] = True
+        counts = child_offsets[frontier + 1] - child_offsets[frontier]
+        first = np.repeat(child_offsets[frontier] - np.cumsum(counts) + counts, counts)
+        frontier = children[first + np.arange(len(first))]
+    affected_nodes = np.flatnonzero(affected)
+    dist[affected_nodes] = np.inf
+    origin[affected_nodes] = -1
+    pred[affected_nodes] = -1
+
+    # Candidate edges: every edge into an affected node, and every changed edge
+    reverse = graph.reverse()
+    counts = reverse.offsets[affected_nodes + 1] - reverse.offsets[affected_nodes]
+    first = np.repeat(reverse.offsets[affected_nodes] - np.cumsum(counts) + counts, counts)
+    into_affected = reverse.edge_ids[first + np.arange(len(first))]
+    candidates = np.concatenate([into_affected, changed_edges])
+    candidate_dist = dist[edge_sources[candidates]] + costs[candidates]
+    candidate_targets = graph.targets[candidates]
+    improving = candidate_dist < dist[candidate_targets]
+    seeds = zip(candidate_dist[improving].tolist(), candidate_targets[improving].tolist(),
+                candidates[improving].tolist(), edge_sources[candidates[improving]].tolist())
+
+    # The search itself runs on lists, like multi_source_dijkstra
+    dist, origin, pred = dist.tolist(), origin.tolist(), pred.tolist()
+    heap = []
+    for d, node, edge, source in seeds:
+        if d < dist[node]:
+            dist[node] = d
+            pred[node] = edge
+            origin[node] = origin[source]
+            heap.append((d, node))
+    heapq.heapify(heap)
+
+    offsets, targets, weights = graph.view(weight)
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        for edge in range(offsets[node], offsets[node + 1]):
+            succ = targets[edge]
+            new_d = d + weights[edge]
+            if new_d < dist[succ]:
+                dist[succ] = new_d
+                origin[succ] = origin[node]
+                pred[succ] = edge
+                heapq.heappush(heap, (new_d, succ))
+    tree = Tree(np.array(dist), np.array(origin, dtype=np.int32), np.array(pred, dtype=np.int64))
+    return tree, len(affected_nodes)
+
+
+# A* on the subgraph within an ellipse around the source and the target, grown until the route found is the
+# one a search on the whole graph finds. Every node v of a path costing C lies within the ellipse
+# |v - source| + |v - target| <= C / min_rate, so once the ellipse of size `reach` holds a route costing less than
+# reach * min_rate, no node outside it could be part of a route as cheap (or be visited by A* on the whole graph).
+# The first ellipse is the size proving a route costing what routes typically cost per metre (the median rate of
+# the edges) over `slack` times the distance between the nodes plus `margin` metres; it is grown to the size
+# proven by the route found, or doubled when there is none, up to the whole graph
+def local_search(graph, source, target, weight, slack=1.5, margin=500):
+    if graph.coords is None or graph.min_rate(weight) <= 0:
+        return astar(graph, source, target, weight)
+    rate = graph.min_rate(weight)
+    distance = float(np.hypot(*(graph.coords[target] - graph.coords[source])))
+    reach = (distance * slack + margin) * graph.median_rate(weight) / rate
+    settled = 0
+    while True:
+        nodes = graph.nodes_within(source, target, reach)
+        everything = len(nodes) == graph.n_nodes
+        subgraph, edges = graph.subgraph(nodes)
+        local_source, local_target = np.searchsorted(nodes, [source, target]).tolist()
+        try:
+            route = astar(subgraph, local_source, local_target, weight)
+        except NoPath:
+            if everything:
+                raise
+            reach *= 2
+            continue
+        settled += route.settled
+        if everything or route.cost * (1 + 1e-9) < reach * rate:
+            return Route(nodes[route.nodes].tolist(), edges[route.edges].tolist(), route.cost, settled)
+        reach = max(2 * reach, route.cost / rate)
+
+
+SEARCHES = {'dijkstra': dijkstra, 'astar': astar, 'bidirectional': bidirectional_dijkstra, 'local': local_search}
@@ -0,0 +1,151 @@
+# Local routing service
+# An asyncio HTTP server answering JSON route requests. The Planner (network, node index, DEM and routing graphs)
+# is loaded once at startup and the CPU-bound planning runs in a pool of worker processes, forked after loading
+# so that they share it, while the event loop keeps accepting requests.
+# Usage: python service.py [--host 127.0.0.1] [--port 8000] [--processes N]
+# POST /route with {"easting": ..., "northing": ..., "fitness": ...} returns the evacuation as JSON
+# (status, destination, both routes with their distances, times and lines, and the time taken to plan it).
+# GET /health returns {"status": "ok"}
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from api import Planner
+from route_cache import route_cache
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+# Largest request body accepted (bytes)
+MAX_BODY = 1 << 16
+
+_planner = None
+
+
+def load_planner():
+    global _planner
+    if _planner is None:
+        _planner = Planner()
+    return _planner
+
+
+# Workers do not print the progress messages of every request
+def _init_worker():
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _ready():
+    return os.getpid()
+
+
+# Planning one request in a worker process
+def plan(easting, northing, fitness):
+    start = time.perf_counter()
+    result = load_planner().evacuate(easting, northing, fitness).to_json()
+    result['plan_ms'] = (time.perf_counter() - start) * 1000
+    result['cache'] = route_cache.stats()
+    return result
+
+
+# Reading the location and fitness of a request body, raising ValueError when they are missing or invalid
+def parse_route_request(body):
+    try:
+        request = json.loads(body)
+        easting, northing, fitness = float(request['easting']), float(request['northing']), int(request['fitness'])
+    except (KeyError, TypeError, ValueError) as error:
+        raise ValueError('expected a JSON object with easting, northing and fitness: ' + str(error))
+    if not 1 <= fitness <= 10:
+        raise ValueError('fitness must be between 1 and 10')
+    return easting, northing, fitness
+
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) < 2:
+        return None, None, b''
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0) or 0)
+    if length > MAX_BODY:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return request_line[0].upper(), request_line[1], body
+
+
+def write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    head = ('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+            % (status, REASONS[status], len(body)))
+    writer.write(head.encode('latin-1') + body)
+
+
+async def handle(reader, writer, executor):
+    try:
+        try:
+            method, path, body = await read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            write_response(writer, 400, {'error': str(error)})
+            return
+        if method is None:
+            return
+        if path == '/health':
+            write_response(writer, 200, {'status': 'ok'})
+        elif path != '/route':
+            write_response(writer, 404, {'error': 'unknown path ' + path})
+        elif method != 'POST':
+            write_response(writer, 405, {'error': 'use POST'})
+        else:
+            try:
+                location = parse_route_request(body)
+            except ValueError as error:
+                write_response(writer, 400, {'error': str(error)})
+                return
+            start = time.perf_counter()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(executor, plan, *location)
+            except Exception as error:
+                write_response(writer, 500, {'error': repr(error)})
+                return
+            result['total_ms'] = (time.perf_counter() - start) * 1000
+            write_response(writer, 200, result)
+    finally:
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+def serve(host='127.0.0.1', port=8000, processes=None):
+    load_planner()
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(processes, multiprocessing.get_context(start_method), _init_worker) as executor:
+        # Starting the workers now, before the event loop runs
+        executor.submit(_ready).result()
+
+        async def main():
+            server = await asyncio.start_server(lambda reader, writer: handle(reader, writer, executor), host, port)
+            print('Serving routes on http://%s:%d' % (host, port))
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local HTTP service routing locations to safety.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.processes)
@@ -0,0 +1,96 @@
+# Columnar shapefile reading
+# The records of a .shp file are located with its .shx index and their coordinates gathered straight from the
+# file's bytes into NumPy arrays, and a .dbf table is read as fixed-width columns: no Python object is created
+# per feature (unlike geopandas/fiona, which build a geometry and a dictionary of attributes for each of them)
+import os
+import struct
+import numpy as np
+
+# Shape types read, with their M and Z variants (which store the same x and y first)
+POINT_TYPES = (1, 11, 21)
+POLYLINE_TYPES = (3, 13, 23)
+NULL_SHAPE = 0
+
+
+# Byte offsets of the records' contents (after their 8 byte headers) in the .shp, from the .shx index
+# (a 100 byte header then one offset and length per record, big-endian and in 16 bit words)
+def _record_offsets(shp_path):
+    shx = np.fromfile(os.path.splitext(shp_path)[0] + '.shx', dtype='>i4', offset=100).reshape(-1, 2)
+    return shx[:, 0].astype(np.int64) * 2 + 8
+
+
+# count little-endian values of a dtype read at each of many byte offsets of the file's bytes
+def _gather(data, offsets, dtype, count=1):
+    dtype = np.dtype(dtype)
+    index = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(dtype.itemsize * count)
+    return data[index].view(dtype).reshape(len(index), count)
+
+
+def _read(shp_path, shape_types):
+    data = np.fromfile(shp_path, dtype=np.uint8)
+    offsets = _record_offsets(shp_path)
+    types = _gather(data, offsets, '<i4')[:, 0]
+    unexpected = ~np.isin(types, shape_types + (NULL_SHAPE,))
+    if unexpected.any():
+        raise ValueError('%s: unexpected shape type %d' % (shp_path, types[unexpected][0]))
+    return data, offsets, types != NULL_SHAPE
+
+
+# Coordinates (x, y) of the points of a point shapefile (NaN for null shapes)
+def read_points(shp_path):
+    data, offsets, present = _read(shp_path, POINT_TYPES)
+    coords = np.full((len(offsets), 2), np.nan)
+    coords[present] = _gather(data, offsets[present] + 4, '<f8', 2)
+    return coords
+
+
+# Vertices of the lines of a polyline shapefile as one flat (x, y) buffer: line i spans offsets[i]:offsets[i + 1].
+# The parts of a multi-part line follow each other, null shapes are empty lines
+def read_lines(shp_path):
+    data, offsets, present = _read(shp_path, POLYLINE_TYPES)
+    # Record: shape type, bounding box (4 doubles), number of parts, number of points, part starts, points
+    n_parts, n_points = np.zeros((2, len(offsets)), dtype=np.int64)
+    n_parts[present], n_points[present] = _gather(data, offsets[present] + 36, '<i4', 2).T
+    line_offsets = np.zeros(len(offsets) + 1, dtype=np.int64)
+    np.cumsum(n_points, out=line_offsets[1:])
+    # Byte offset of every point: its record's first point plus 16 bytes per point before it in the record
+    rank = np.arange(line_offsets[-1]) - np.repeat(line_offsets[:-1], n_points)
+    point_offsets = np.repeat(offsets + 44 + 4 * n_parts, n_points) + 16 * rank
+    return line_offsets, _gather(data, point_offsets, '<f8', 2)
+
+
+# Columns of a .dbf table, all of them or the given field names: text fields as str arrays (stripped), numeric
+# fields as float arrays (NaN when empty or null, i.e. filled with '*'). Every record is kept (deleted ones too),
+# in step with the records of the .shp. The text encoding is taken from the .cpg file when there is one
+def read_dbf(dbf_path, names=None):
+    with open(dbf_path, 'rb') as file:
+        n_records, header_length, record_length = struct.unpack('<IHH', file.read(32)[4:12])
+        header = file.read(header_length - 32)
+    # Field descriptors: 32 bytes each (name, type, ..., length), ended by 0x0D
+    fields = []
+    for start in range(0, len(header) - 31, 32):
+        if header[start] == 0x0D:
+            break
+        descriptor = header[start:start + 32]
+        fields.append((descriptor[:11].split(b'\0')[0].decode('ascii'), chr(descriptor[11]), descriptor[16]))
+    dtype = [('deletion_flag', 'S1')] + [(name, 'S%d' % length) for name, _, length in fields]
+    used = 1 + sum(length for _, _, length in fields)
+    if used < record_length:
+        dtype.append(('padding', 'S%d' % (record_length - used)))
+    records = np.fromfile(dbf_path, dtype=np.dtype(dtype), count=n_records, offset=header_length)
+
+    cpg_path = os.path.splitext(dbf_path)[0] + '.cpg'
+    encoding = 'latin-1'
+    if os.path.exists(cpg_path):
+        with open(cpg_path) as file:
+            encoding = file.read().strip() or encoding
+    columns = {}
+    for name, field_type, _ in fields:
+        if names is not None and name not in names:
+            continue
+        values = np.char.strip(records[name])
+        if field_type in 'NF':
+            columns[name] = np.where(np.char.strip(values, b'*') == b'', b'nan', values).astype(np.float64)
+        else:
+            columns[name] = np.char.decode(values, encoding)
+    return columns
@@ -0,0 +1,153 @@
+# Spatial index of the road nodes
+# The nodes are bucketed into a uniform grid in one vectorized pass (sorting them by cell, CSR style: the nodes
+# of cell c are order[cell_start[c]:cell_start[c + 1]]). The index is saved with the compiled network, and
+# nearest() answers many points at once by searching rings of cells around all of them together
+import os
+import numpy as np
+from instrumentation import span
+
+# Average number of nodes per grid cell
+NODES_PER_CELL = 2
+
+
+# Distance from points to an axis-aligned box
+def _box_distance(px, py, x0, y0, x1, y1):
+    return np.hypot(np.maximum.reduce([x0 - px, px - x1, np.zeros_like(px)]),
+                    np.maximum.reduce([y0 - py, py - y1, np.zeros_like(py)]))
+
+
+class NodeIndex:
+    def __init__(self, origin, cell, shape, cell_start, order, coords, source_hash=None):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell = float(cell)
+        self.shape = int(shape[0]), int(shape[1])
+        self.cell_start = cell_start
+        self.order = order
+        self.coords = coords
+        self.source_hash = source_hash
+
+    @classmethod
+    def build(cls, coords, source_hash=None):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(coords) == 0:
+            return cls((0.0, 0.0), 1.0, (1, 1), np.zeros(2, dtype=np.int64), np.zeros(0, dtype=np.int32), coords,
+                       source_hash)
+        origin = coords.min(axis=0)
+        extent = np.maximum(coords.max(axis=0) - origin, 1e-9)
+        cell = max(float(np.sqrt(extent[0] * extent[1] * NODES_PER_CELL / len(coords))), float(extent.max()) / 4096,
+                   1e-9)
+        shape = (int(extent[1] // cell) + 1, int(extent[0] // cell) + 1)
+        cells = cls._cells(coords, origin, cell, shape)
+        order = np.argsort(cells, kind='stable').astype(np.int32)
+        cell_start = np.zeros(shape[0] * shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=shape[0] * shape[1]), out=cell_start[1:])
+        return cls(origin, cell, shape, cell_start, order, coords, source_hash)
+
+    @staticmethod
+    def _cells(coords, origin, cell, shape):
+        col = np.clip(((coords[:, 0] - origin[0]) // cell).astype(np.int64), 0, shape[1] - 1)
+        row = np.clip(((coords[:, 1] - origin[1]) // cell).astype(np.int64), 0, shape[0] - 1)
+        return row * shape[1] + col
+
+    def save(self, path):
+        np.savez(path, origin=self.origin, cell=self.cell, shape=self.shape, cell_start=self.cell_start,
+                 order=self.order, source_hash=self.source_hash or '')
+
+    @classmethod
+    def load(cls, path, coords):
+        with np.load(path) as data:
+            return cls(data['origin'], data['cell'], data['shape'], data['cell_start'], data['order'], coords,
+                       str(data['source_hash']) or None)
+
+    # The k nearest nodes to every point (an array of x, y rows). Returns the node positions and their
+    # distances as two (points, k) arrays, closest first (-1 and inf where there are fewer than k nodes)
+    def nearest(self, points, k=1):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n_points = len(points)
+        ids = np.full((n_points, k), -1, dtype=np.int64)
+        dists = np.full((n_points, k), np.inf)
+        if n_points == 0 or len(self.order) == 0:
+            return ids, dists
+        rows, cols = self.shape
+        # Cell of each point (the closest cell of the grid for points beyond the nodes' bounding box)
+        point_col = np.clip((points[:, 0] - self.origin[0]) // self.cell, 0, cols - 1).astype(np.int64)
+        point_row = np.clip((points[:, 1] - self.origin[1]) // self.cell, 0, rows - 1).astype(np.int64)
+        grid_x = self.origin[0], self.origin[0] + cols * self.cell
+        grid_y = self.origin[1], self.origin[1] + rows * self.cell
+        active = np.arange(n_points)
+        ring = 0
+        while len(active):
+            # Offsets of the cells at Chebyshev distance `ring` from the point's cell
+            if ring == 0:
+                d_row, d_col = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+            else:
+                side = np.arange(-ring, ring + 1)
+                inner = side[1:-1]
+                d_row = np.concatenate([np.full(len(side), -ring), np.full(len(side), ring), inner, inner])
+                d_col = np.concatenate([side, side, np.full(len(inner), -ring), np.full(len(inner), ring)])
+            cand_row = point_row[active, np.newaxis] + d_row
+            cand_col = point_col[active, np.newaxis] + d_col
+            inside = (cand_row >= 0) & (cand_row < rows) & (cand_col >= 0) & (cand_col < cols)
+            which = np.broadcast_to(active[:, np.newaxis], inside.shape)[inside]
+            cells = cand_row[inside] * cols + cand_col[inside]
+            starts = self.cell_start[cells]
+            counts = self.cell_start[cells + 1] - starts
+            if counts.sum():
+                # One entry per (point, node in one of its ring cells)
+                cand_point = np.repeat(which, counts)
+                first = np.repeat(starts - np.cumsum(counts) + counts, counts)
+                cand_node = self.order[first + np.arange(len(first))].astype(np.int64)
+                cand_dist = np.hypot(*(self.coords[cand_node] - points[cand_point]).T)
+                self._merge(ids, dists, active, cand_point, cand_node, cand_dist, k)
+
+            # The nodes not searched yet lie in the part of the grid beyond one of the sides of the block of cells
+            # searched so far, so they are at least as far as the closest of these parts (if any)
+            row, col = point_row[active], point_col[active]
+            low_x = self.origin[0] + (col - ring) * self.cell
+            low_y = self.origin[1] + (row - ring) * self.cell
+            high_x = low_x + (2 * ring + 1) * self.cell
+            high_y = low_y + (2 * ring + 1) * self.cell
+            px, py = points[active, 0], points[active, 1]
+            (x0, x1), (y0, y1) = grid_x, grid_y
+            bound = np.minimum.reduce([
+                np.where(col - ring > 0, _box_distance(px, py, x0, y0, low_x, y1), np.inf),
+                np.where(col + ring < cols - 1, _box_distance(px, py, high_x, y0, x1, y1), np.inf),
+                np.where(row - ring > 0, _box_distance(px, py, x0, y0, x1, low_y), np.inf),
+                np.where(row + ring < rows - 1, _box_distance(px, py, x0, high_y, x1, y1), np.inf)])
+            active = active[dists[active, -1] > bound]
+            ring += 1
+        return ids, dists
+
+    # Keeping the k closest of the current best nodes and the new candidates of every active point
+    @staticmethod
+    def _merge(ids, dists, active, cand_point, cand_node, cand_dist, k):
+        best_point = np.repeat(active, k)
+        all_point = np.concatenate([best_point, cand_point])
+        all_node = np.concatenate([ids[active].ravel(), cand_node])
+        all_dist = np.concatenate([dists[active].ravel(), cand_dist])
+        # Sorting by point, then distance, then node position (ties go to the lowest position)
+        order = np.lexsort((all_node, all_dist, all_point))
+        all_point, all_node, all_dist = all_point[order], all_node[order], all_dist[order]
+        group_start = np.searchsorted(all_point, all_point, side='left')
+        rank = np.arange(len(all_point)) - group_start
+        keep = rank < k
+        ids[all_point[keep], rank[keep]] = all_node[keep]
+        dists[all_point[keep], rank[keep]] = all_dist[keep]
+
+
+# Loading the node index saved with the compiled network, building it when it is missing
+# or was built for another version of the network
+def load_node_index(network):
+    source_hash = network.meta.get('source_hash')
+    path = os.path.join(network.directory, 'node_index.npz') if network.directory else None
+    if path and os.path.exists(path):
+        index = NodeIndex.load(path, network.node_coords)
+        if index.source_hash == source_hash:
+            return index
+    with span('node_index_build'):
+        index = NodeIndex.build(network.node_coords, source_hash)
+    if path:
+        tmp_path = path[:-len('.npz')] + '.tmp-' + str(os.getpid()) + '.npz'
+        index.save(tmp_path)
+        os.replace(tmp_path, path)
+    return index
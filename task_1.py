@@ -1,7 +1,6 @@
 # Task 1 and task 6
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Point
+from boundary import load_boundary
 
 
 # Prompting for user location while handling possible invalid input
@@ -23,26 +22,20 @@ def user_input():
         except ValueError:
             print('Invalid input. Input is not a coordinate.')
 
-    # Defining the bounding box vertices against which checking the user location
-    data = {'point': ['bottom_left', 'bottom_right', 'top_right', 'top_left'],
-            'easting_coordinate': [430000, 465000, 465000, 430000],
-            'northing_coordinate': [80000, 80000, 95000, 95000]}
-
-    # Creating a dataframe and its polygon
-    df = pd.DataFrame(data)
-    box_poly = Polygon(df[['easting_coordinate', 'northing_coordinate']].values)
-
     # Checking the user location
-    # First attempt (for task 1): checking the bounding box
-    if box_poly.contains(user_loc) or box_poly.touches(user_loc):
+    check = location_check(user_loc)
+    if check == 'box':
         print('You are in the bounding box.')
+    elif check == 'island':
+        print('You are not in the bounding box but on the island.')
     else:
-        # Second attempt (for task 6): checking with the shapefile
-        shape = gpd.read_file('shape/isle_of_wight.shp')
-        if shape.contains(user_loc).iloc[0] or shape.touches(user_loc).iloc[0]:
-            print('You are not in the bounding box but on the island.')
-        else:
-            print('Invalid location: outside boundaries, quitting.')
-            quit()
+        print('Invalid location: outside boundaries, quitting.')
+        quit()
 
     return user_loc
+
+
+# Checking a location: 'box' if in the bounding box, 'island' if outside it but on the island, otherwise None
+# (the island boundary is only loaded once and reused by every check)
+def location_check(user_loc):
+    return load_boundary().check(user_loc.x, user_loc.y)[0]
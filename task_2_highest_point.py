@@ -1,16 +1,22 @@
 # Task 2
-import numpy as np
 from shapely.geometry import Point, Polygon
 import rasterio
-from rasterio import mask
+from elevation import mask_elevation, load_max_index, open_dem, DemWindow
 
 # Searching for the highest point withing the defined radius from the user location
-def highest_point(location, radius):
+# An already opened raster and its elevation data (a full array) can be passed in to avoid reading the file again.
+# When not interactive, the search is never extended beyond 5000 m without asking
+def highest_point(location, radius, raster=None, elevation_data=None, interactive=True):
     print('Highest point search in progress..\n')
     buffer = location.buffer(radius)
-    # Reading elevation data file to get the raster which defines the bounding box
-    raster = rasterio.open('elevation/SZ.asc')
-    elevation_data = raster.read(1)
+    # Getting the shared elevation dataset which defines the bounding box
+    if raster is None:
+        raster = open_dem()
+    # Only reading the window of elevation data around the searched area (grown when the radius is increased)
+    if elevation_data is None:
+        elevation_data = DemWindow(raster)
+    if isinstance(elevation_data, DemWindow):
+        elevation_data.ensure_bounds(*buffer.bounds)
     # Searching for the raster bounds and creating its polygon
     elevation_bounds = raster.bounds
     elevation_poly = Polygon([(elevation_bounds[0], elevation_bounds[1]),
@@ -22,16 +28,12 @@ def highest_point(location, radius):
     user_altitude = elevation_data[user_row, user_col]
     # Finding the intersection between the user location buffer and the elevation polygon
     mask_polygon = buffer.intersection(elevation_poly)
-    # Identifying local area's highest altitude
-    local_altitude_array, out_transform = rasterio.mask.mask(dataset=raster, shapes=[mask_polygon],
-                                                             crop=True, filled=False)
-    max_altitude = np.max(local_altitude_array)
-    # Determining the pixel of the highest point
-    loc = np.where(local_altitude_array == max_altitude)
-    row_highest_point = loc[1][0]
-    col_highest_point = loc[2][0]
+    # Identifying local area's highest altitude and its pixel with the precomputed max index of the DEM
+    # (only the blocks crossing the edge of the searched area are scanned)
+    row_highest_point, col_highest_point, max_altitude = \
+        load_max_index(raster, elevation_data).highest(mask_polygon)
     # Convert the row and the column into BNG coordinates
-    x, y = rasterio.transform.xy(out_transform, row_highest_point, col_highest_point)
+    x, y = rasterio.transform.xy(raster.transform, row_highest_point, col_highest_point)
     # Creating a Point class instance for the destination
     dest = Point(x, y)
     print('Current altitude:', int(user_altitude), 'm')
@@ -43,18 +45,21 @@ def highest_point(location, radius):
             radius += 500
             print('Increasing the search radius by 500 m. Search radius:', radius, 'm.')
             dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude) = highest_point(
-                location, radius)
+                location, radius, raster, elevation_data, interactive)
             return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
-        else:
+        elif interactive:
             inc = input("5000 m search radius reached. Would you like to increase it anyway?"
                         " Type 'y' to proceed or any other input to resume the current search:\n")
             if inc.lower() == 'y':
                 radius += 500
                 print('Increasing the search radius by 500 m. Search radius:', radius, 'm.')
                 dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude) = \
-                    highest_point(location, radius)
+                    highest_point(location, radius, raster, elevation_data, interactive)
                 return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
             else:
                 print('Current search resumed.')
 
+    # Cutting the searched area out of the DEM (only for the final radius) to be plotted
+    local_altitude_array, out_transform = mask_elevation(raster, elevation_data, [mask_polygon])
+
     return dest, raster, local_altitude_array, out_transform, radius, (user_altitude, max_altitude)
@@ -1,26 +1,32 @@
 # Task 3
-import json
-from rtree import index
+from shapely.geometry import LineString
+from instrumentation import traced
+from network import load_network
+from spatial_index import load_node_index
+
+
+# Loading the node index saved with the network (built in one pass the first time)
+def node_index(network):
+    return load_node_index(network)
+
+
+# Identifying the nearest node (identifier and coordinates) to the user and to the destination
+@traced('nearest_nodes')
+def nearest_nodes(network, idx, user, dest):
+    # Both points are snapped in a single query
+    nearest, _ = idx.nearest([(user.x, user.y), (dest.x, dest.y)], 1)
+    nearest_to_user, nearest_to_dest = [(str(network.node_ids[i]), network.node_coords[i].tolist())
+                                        for i in nearest[:, 0]]
+    return nearest_to_user, nearest_to_dest
 
 
 # Task 3
 # Identifying the nearest ITN node to the user and the nearest to the destination
 def itn_nodes_parser(user, dest):
-    # Opening the ITN data as a dictionary
-    with open('itn/solent_itn.json') as file:
-        itn_dict = json.load(file)
-    # Creating an index and adding each node's data to the index
-    idx = index.Index()
-    for i, node in enumerate(itn_dict['roadnodes'].items()):
-        idx.insert(i, (node[1]['coords'][0], node[1]['coords'][1]), obj=node[0])
-    # # Assigning the two variables to empty strings to deal with a PEP8 notification
-    nearest_to_user = ''
-    nearest_to_dest = ''
-    # Identifying the nearest node to the user and destination
-    for i in idx.nearest((user.x, user.y), 1, objects='raw'):
-        nearest_to_user = i, itn_dict['roadnodes'][i]['coords']
-    for i in idx.nearest((dest.x, dest.y), 1, objects='raw'):
-        nearest_to_dest = i, itn_dict['roadnodes'][i]['coords']
+    # Loading the precompiled ITN network (the JSON is only parsed again when it changes)
+    network = load_network()
+    idx = node_index(network)
+    nearest_to_user, nearest_to_dest = nearest_nodes(network, idx, user, dest)
     # Avoiding empty paths from trying to be plotted
     if nearest_to_user == nearest_to_dest:
         print('No paths available for the searched area, quitting.')
@@ -31,4 +37,4 @@ def itn_nodes_parser(user, dest):
     user_to_node = LineString([(user.x, user.y), (nearest_to_user[1][0], nearest_to_user[1][1])])
     node_to_dest = LineString([(nearest_to_dest[1][0], nearest_to_dest[1][1]), (dest.x, dest.y)])
 
-    return itn_dict, nearest_to_user, nearest_to_dest, user_to_node, node_to_dest
+    return network, nearest_to_user, nearest_to_dest, user_to_node, node_to_dest
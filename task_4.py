@@ -1,169 +1,174 @@
 # Task 4
-import geopandas as gpd
-from shapely.geometry import LineString
-import networkx as nx
-
-
-class Roadlink:
-    def __init__(self, fid, node_a, node_b, length, alt_diff):
-        self.fid = fid
-        self.node_a = node_a
-        self.node_b = node_b
-        self.length = length
-        self.alt_diff = alt_diff
-
-    # Calculating the time required to travel the roadlink.
-    # The function identifies three different values (to be used in the network).
-    # For climbing roadlinks, different 'time penalties' are used depending on the fitness level typed by the user.
-    # For descending roadlinks, Langmuir's integration to Naismith's rule was used
-
-    def time_weight(self, length, speed, alt_diff):
-        base = length / speed
-        slope = alt_diff / length * 100
-
-        # Climbing time weight
-        if speed == 5000 / 60:
-            with_slope_asc = base + abs(alt_diff / 10)
-        elif speed == 4000 / 60:
-            with_slope_asc = base + 1.25 * abs(alt_diff / 10)
-        else:
-            with_slope_asc = base + 1.5 * abs(alt_diff / 10)
-
-        # Descending time weight
-        if 5 < abs(slope) < 12:
-            with_slope_des = base - abs(alt_diff / 30)
-            if with_slope_des < 0:
-                with_slope_des = 0.001
-        elif abs(slope) > 12:
-            with_slope_des = base + abs(alt_diff / 30)
-        else:
-            with_slope_des = base
-
-        return base, with_slope_asc, with_slope_des
-
-    # Alternative 1 (Naismith's rule without Langmuir's integration)
-
-    # def time_weight(self, length, speed, alt_diff):
-    #     base = length / speed
-    #
-    #     # Climbing time weight
-    #     if speed == 5000 / 60:
-    #         with_slope_asc = base + abs(alt_diff / 10)
-    #     elif speed == 4000 / 60:
-    #         with_slope_asc = base + 1.25 * abs(alt_diff / 10)
-    #     else:
-    #         with_slope_asc = base + 1.5 * abs(alt_diff / 10)
-    #
-    #     with_slope_des = base
-    #
-    #     return base, with_slope_asc, with_slope_des
-
-    # Alternative code 2 (producing the same paths of the image
-    # in the assignment instructions for the test point)
-
-    # def time_weight(self, length, speed, alt_diff):
-    #     base = length / speed
-    #     if speed == 5000 / 60:
-    #         with_slope_asc = abs(base + alt_diff / 10)
-    #     elif speed == 4000 / 60:
-    #         with_slope_asc = abs(base + 1.25 * (alt_diff / 10))
-    #     else:
-    #         with_slope_asc = abs(base + 1.5 * (alt_diff / 10))
-    #
-    #     with_slope_des = base
-    #
-    #     return base, with_slope_asc, with_slope_des
+import os
+import numpy as np
+from elevation import sample_profiles, DemWindow
+from routing import Graph, SEARCHES, route_totals
+from hierarchy import hierarchy_search
+from instrumentation import count, span, traced
+from route_geometry import RouteGeometry
+from route_cache import route_cache, graph_version
+
+
+# Walking speeds (m/min) of the three fitness classes
+WALKING_SPEEDS = (5000 / 60, 4000 / 60, 3500 / 60)
+# Climbing 'time penalties' of the three fitness classes (minutes per 10 m of climb)
+CLIMB_FACTORS = (1, 1.25, 1.5)
+# Version of the time model below, stored with the link times computed with it
+TIME_MODEL_VERSION = 3
+# Rises and drops summed per link by link_profiles
+PROFILE_NAMES = ('ascent', 'descent', 'gentle_ascent', 'steep_ascent', 'gentle_descent', 'steep_descent')
+# Number of links whose profiles are sampled together (their samples then stay in the processor's cache)
+PROFILE_CHUNK = 4096
+
+
+# Climbing time penalty of a walking speed (other speeds than the fitness classes' are counted as the slowest)
+def climb_factor(speed):
+    return CLIMB_FACTORS[WALKING_SPEEDS.index(speed)] if speed in WALKING_SPEEDS else CLIMB_FACTORS[-1]
+
+
+# Calculating the time required to travel every link, in both directions, as array operations over all the links,
+# from their elevation profiles (see link_profiles).
+# The time penalty of the fitness level is added to the base time for every 10 m climbed along the link.
+# For the descents, Langmuir's integration to Naismith's rule was used: 10 minutes are taken off for every 300 m
+# of gentle descent (5 to 12 % slope) and added for every 300 m of steep descent (over 12 %).
+# Returns the times walking the links forward (from start to end node) and backward
+def link_times(length, profiles, speed):
+    base = length / speed
+
+    def walk(climb, gentle_descent, steep_descent):
+        time = base + climb_factor(speed) * climb / 10 - gentle_descent / 30 + steep_descent / 30
+        return np.where(time < 0, 0.001, time)
+
+    # Walked backward, the link's rises are descents and its drops climbs
+    return (walk(profiles['ascent'], profiles['gentle_descent'], profiles['steep_descent']),
+            walk(profiles['descent'], profiles['gentle_ascent'], profiles['steep_ascent']))
+
+
+# Elevation profile of every link: the total rise and drop walking it forward along its geometry, sampled about
+# every DEM cell (see elevation.sample_profiles), and the rise and drop of its gentle and steep pieces
+def link_profiles(network, raster, elevation_data=None):
+    # Only reading the window of elevation data spanned by the roads
+    if elevation_data is None:
+        elevation_data = DemWindow(raster)
+    profiles = {name: np.zeros(network.n_links) for name in PROFILE_NAMES}
+    offsets = network.geom_offsets
+    for start in range(0, network.n_links, PROFILE_CHUNK):
+        stop = min(start + PROFILE_CHUNK, network.n_links)
+        links, runs, rises = sample_profiles(raster, elevation_data, offsets[start:stop + 1] - offsets[start],
+                                             network.geom_coords[offsets[start]:offsets[stop]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.abs(rises / runs * 100)
+        gentle, steep = (5 < slope) & (slope < 12), slope > 12
+        up, down = np.maximum(rises, 0), np.maximum(-rises, 0)
+        parts = {'ascent': up, 'descent': down, 'gentle_ascent': up * gentle, 'steep_ascent': up * steep,
+                 'gentle_descent': down * gentle, 'steep_descent': down * steep}
+        for name in PROFILE_NAMES:
+            profiles[name][start:stop] = np.bincount(links, weights=parts[name], minlength=stop - start)
+    return profiles
+
+
+# Link times loaded or computed per artifact path, with the stamp (network and DEM hashes, time model version)
+# they were computed for: a newer network or DEM replaces them
+_link_times = {}
+
+
+# Link times of every fitness class, as two (fitness classes, links) arrays: forward and backward, with the links'
+# elevation profiles. They are computed in one pass the first time and stored with the compiled network, for the
+# DEM they were sampled from, so that choosing a fitness class afterwards is a column lookup (and any other
+# walking speed only needs the stored profiles)
+def load_link_times(network, raster, elevation_data=None):
+    # Only stored for a compiled network and a binary DEM (see elevation.Dem), whose source hashes identify them
+    dem_hash = raster.meta.get('source_hash') if isinstance(raster.meta, dict) else None
+    path = os.path.join(network.directory, 'link_times.npz') if network.directory and dem_hash else None
+    stamp = dict(source_hash=network.meta.get('source_hash') or '', dem_hash=dem_hash or '',
+                 version=TIME_MODEL_VERSION)
+    if path in _link_times and _link_times[path][0] == stamp:
+        return _link_times[path][1]
+    if path and os.path.exists(path):
+        with np.load(path) as data:
+            if (all(str(data[name]) == str(value) for name, value in stamp.items())
+                    and np.array_equal(data['speeds'], WALKING_SPEEDS)):
+                _link_times[path] = stamp, (data['forward'], data['backward'],
+                                            {name: data[name] for name in PROFILE_NAMES})
+                return _link_times[path][1]
+
+    with span('link_times'):
+        profiles = link_profiles(network, raster, elevation_data)
+        times = [link_times(network.link_length, profiles, speed) for speed in WALKING_SPEEDS]
+        forward = np.stack([time_forward for time_forward, _ in times])
+        backward = np.stack([time_backward for _, time_backward in times])
+    if path:
+        tmp_path = path[:-len('.npz')] + '.tmp-' + str(os.getpid()) + '.npz'
+        np.savez(tmp_path, forward=forward, backward=backward, speeds=WALKING_SPEEDS, **profiles, **stamp)
+        os.replace(tmp_path, path)
+        _link_times[path] = stamp, (forward, backward, profiles)
+    return forward, backward, profiles
 
 
 # Task 4
-# Identifying the shortest and fastest routes between the two identified nodes
+# Building the routing graph of the network for the given walking speed
+@traced('build_graph')
+def build_graph(network, raster, speed, elevation_data=None):
+    # The link times of the fitness classes are all computed at once (or loaded), any other speed's from the profiles
+    time_forward, time_backward, profiles = load_link_times(network, raster, elevation_data)
+    if speed in WALKING_SPEEDS:
+        column = WALKING_SPEEDS.index(speed)
+        time_forward, time_backward = time_forward[column], time_backward[column]
+    else:
+        time_forward, time_backward = link_times(network.link_length, profiles, speed)
+
+    # Building the routing graph on the network's adjacency arrays, with one length and one time weight per edge
+    adj_links = network.adj_links
+    return Graph.from_network(network, length=network.link_length[adj_links],
+                              time=np.where(network.adj_forward, time_forward[adj_links], time_backward[adj_links]))
+
+
 # Task 4
 # Identifying the shortest and fastest routes between the two identified nodes
-def paths(itn, raster, speed, nearest_to_user, nearest_to_dest):
+# The search can be 'astar' (default), 'local' (A* on the part of the graph around both nodes),
+# 'bidirectional', a plain 'dijkstra' or 'ch' (contraction hierarchy, built once and stored with the compiled network).
+# A graph already built for this walking speed can be passed in to avoid building it again.
+# Routes already found between the same nodes at the same speed are taken from the cache (None disables it)
+def paths(network, raster, speed, nearest_to_user, nearest_to_dest, method='astar', graph=None, cache=route_cache):
 
     print('Fastest path search in progress..\n')
 
-    def link_alt_diff():
-        # Retrieving point 1 altitude
-        p1_xy = itn['roadnodes'][attr['start']]['coords'][0], itn['roadnodes'][attr['start']]['coords'][1]
-        p1_row, p1_col = raster.index(p1_xy[0], p1_xy[1])
-        p1_alt = elevation_data[p1_row, p1_col]
-        # Retrieving point 2 altitude
-        p2_xy = itn['roadnodes'][attr['end']]['coords'][0], itn['roadnodes'][attr['end']]['coords'][1]
-        p2_row, p2_col = raster.index(p2_xy[0], p2_xy[1])
-        p2_alt = elevation_data[p2_row, p2_col]
-        # Calculating the difference in altitude
-        diff = p2_alt - p1_alt
-
-        return diff
-
-    elevation_data = raster.read(1)
-
-    # Retrieving data for each node and adding it to a Roadlink object list
-    roadlink_list = []
-    for osgb, attr in itn['roadlinks'].items():
-        alt_diff = link_alt_diff()
-        # Adding data
-        roadlink_list.append(Roadlink(osgb, attr['start'], attr['end'], attr['length'], alt_diff))
-
-    # Initializing a directed graph
-    graph = nx.DiGraph()
-    # Adding to the graph two edges for each roadlink for allowing different weights:
-    # if walking uphill from A to B the time counting the slope is added, otherwise the base time is used
-    for link in roadlink_list:
-        base, with_slope_asc, with_slope_des = link.time_weight(link.length, speed, link.alt_diff)
-        if link.alt_diff > 0:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=with_slope_asc)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=with_slope_des)
-        elif link.alt_diff == 0:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=base)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=base)
-        else:
-            graph.add_edge(link.node_a, link.node_b, fid=link.fid, length=link.length, time=with_slope_des)
-            graph.add_edge(link.node_b, link.node_a, fid=link.fid, length=link.length, time=with_slope_asc)
-
-    # Identifying the shortest route
-    short_path = nx.dijkstra_path(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='length')
-    # Identifying shortest route's length
-    short_path_distance = nx.dijkstra_path_length(graph, source=nearest_to_user[0],
-                                                  target=nearest_to_dest[0], weight='length')
-
-    roads = itn['roadlinks']
-    # Creating its geoDataFrame to be plotted
-    links = []
-    geom = []
-    short_path_time = 0
-
-    first_node = short_path[0]
-    for node in short_path[1:]:
-        link_fid = graph.edges[first_node, node]['fid']
-        links.append(link_fid)
-        link_time = graph.edges[first_node, node]['time']
-        short_path_time += link_time
-        geom.append(LineString(roads[link_fid]['coords']))
-        first_node = node
-
-    short_path_gpd = gpd.GeoDataFrame({'fid': links, 'geometry': geom})
-
-    # Identifying the fastest route
-    fast_path = nx.dijkstra_path(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='time')
-    # Identifying fastest route's travel time
-    fast_path_time = nx.dijkstra_path_length(graph, source=nearest_to_user[0], target=nearest_to_dest[0], weight='time')
-
-    # Creating its geoDataFrame to be plotted
-    links = []
-    geom = []
-    fast_path_distance = 0
-
-    first_node = fast_path[0]
-    for node in fast_path[1:]:
-        link_fid = graph.edges[first_node, node]['fid']
-        links.append(link_fid)
-        link_dist = graph.edges[first_node, node]['length']
-        fast_path_distance += link_dist
-        geom.append(LineString(roads[link_fid]['coords']))
-        first_node = node
-
-    fast_path_gpd = gpd.GeoDataFrame({'fid': links, 'geometry': geom})
-
-    return short_path_gpd, (short_path_distance, short_path_time), fast_path_gpd, (fast_path_distance, fast_path_time)
+    if graph is None:
+        graph = build_graph(network, raster, speed)
+
+    source = network.node(nearest_to_user[0])
+    target = network.node(nearest_to_dest[0])
+
+    # The cache entries are only valid for this graph (network, elevation data and walking speed)
+    cached = None
+    if cache is not None:
+        version = graph_version(graph)
+        key = cache.key(source, target, speed)
+        cached = cache.get(key, version)
+        count('route_cache_misses' if cached is None else 'route_cache_hits')
+
+    if cached is None:
+        search = hierarchy_search if method == 'ch' else SEARCHES[method]
+
+        # Identifying the shortest route, with its length and travel time
+        with span('search', method=method, weight='length'):
+            short_path = search(graph, source, target, 'length')
+        count('nodes_settled', short_path.settled)
+        short_path_data = route_totals(graph, short_path)
+
+        # Identifying the fastest route and its travel time
+        with span('search', method=method, weight='time'):
+            fast_path = search(graph, source, target, 'time')
+        count('nodes_settled', fast_path.settled)
+        fast_path_data = route_totals(graph, fast_path)
+
+        if cache is not None:
+            cache.put(key, (short_path, short_path_data, fast_path, fast_path_data), version)
+    else:
+        short_path, short_path_data, fast_path, fast_path_data = cached
+
+    # Their geometries to be plotted (built from the network's link coordinate arrays when first used)
+    short_path_geom = RouteGeometry.from_route(network, short_path)
+    fast_path_geom = RouteGeometry.from_route(network, fast_path)
+
+    return short_path_geom, short_path_data, fast_path_geom, fast_path_data
@@ -0,0 +1,72 @@
+# The project's modules are flat files at the top of the repository
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+from rasterio.transform import from_origin  # noqa: E402
+from benchmarks.synthetic import make_itn  # noqa: E402
+from elevation import Dem  # noqa: E402
+from network import Network, build_arrays  # noqa: E402
+from routing import Graph  # noqa: E402
+
+# The test DEMs: 10 m cells, their top left corner at (0, 200), nodata at -9999
+DEM_CELL = 10
+DEM_NODATA = -9999.0
+
+
+def _make_dem(altitude, source_hash=None):
+    meta = {'transform': list(from_origin(0, 200, DEM_CELL, DEM_CELL))[:6], 'crs': None, 'nodata': DEM_NODATA}
+    if source_hash is not None:
+        meta['source_hash'] = source_hash
+    return Dem(np.asarray(altitude, dtype=np.float32), meta, 'test')
+
+
+# Network of straight west to east links at y = 100, each given by its start and end x (and a middle vertex)
+def _make_line_network(*links, meta=None, directory=None):
+    nodes, roadlinks = {}, {}
+    for i, (x0, x1) in enumerate(links):
+        nodes['a%d' % i], nodes['b%d' % i] = {'coords': [x0, 100.0]}, {'coords': [x1, 100.0]}
+        roadlinks['l%d' % i] = {'start': 'a%d' % i, 'end': 'b%d' % i, 'length': float(x1 - x0),
+                                'coords': [[x0, 100.0], [(x0 + x1) / 2, 100.0], [x1, 100.0]]}
+    return Network(build_arrays({'roadnodes': nodes, 'roadlinks': roadlinks}), meta or {},
+                   None if directory is None else str(directory))
+
+
+def _make_network(n_nodes=400, seed=0):
+    return Network(build_arrays(make_itn(n_nodes, seed=seed)), {})
+
+
+# Routing graph of a synthetic road network, its travel times random (and different each way)
+def _make_graph(n_nodes=400, seed=0, network=None):
+    if network is None:
+        network = _make_network(n_nodes, seed)
+    length = network.link_length[network.adj_links]
+    time = length * np.random.default_rng(seed).uniform(0.5, 2.0, len(length))
+    return Graph.from_network(network, length=length, time=time)
+
+
+# DEM from an array of altitudes: make_dem(altitude, source_hash=None)
+@pytest.fixture
+def make_dem():
+    return _make_dem
+
+
+# Network of straight links: make_line_network((x0, x1), ..., meta=None, directory=None)
+@pytest.fixture
+def make_line_network():
+    return _make_line_network
+
+
+# Synthetic road network (see benchmarks/synthetic.py): make_network(n_nodes=400, seed=0)
+@pytest.fixture
+def make_network():
+    return _make_network
+
+
+# Its routing graph: make_graph(n_nodes=400, seed=0, network=None)
+@pytest.fixture
+def make_graph():
+    return _make_graph
@@ -0,0 +1,85 @@
+# Trees repaired after closures, slowdowns and floods against trees computed again from scratch
+import numpy as np
+from closures import Closures, link_min_altitudes, route_still_valid
+from routing import Graph, dijkstra, multi_source_dijkstra
+from time_to_safety import repair_time_to_safety, time_to_safety
+
+SAFE_NODES = [5, 150, 333]
+
+
+def same_tree(tree, expected):
+    assert np.allclose(tree.dist, expected.dist)
+    # The weights are random, so no two routes cost the same and the tree is unique
+    reached = np.isfinite(expected.dist)
+    assert np.array_equal(tree.origin[reached], expected.origin[reached])
+    assert np.array_equal(tree.pred[reached], expected.pred[reached])
+    assert np.all(tree.origin[~reached] == -1)
+
+
+# Network changes in turn, as (method, arguments): links closed then slowed, the water rising then falling,
+# the closed links reopened and the slowed ones back to normal
+def changes(network):
+    rng = np.random.default_rng(2)
+    closed = rng.choice(network.n_links, 40, replace=False)
+    slowed = rng.choice(network.n_links, 40, replace=False)
+    min_altitudes = rng.uniform(0, 100, network.n_links)
+    return [('close', (closed,)), ('slow', (slowed, 3.0)), ('flood', (min_altitudes, 8)),
+            ('flood', (min_altitudes, 15)), ('flood', (min_altitudes, 4)), ('reopen', (closed,)),
+            ('slow', (slowed, 1)), ('flood', (min_altitudes, 0))]
+
+
+def test_repaired_time_to_safety_matches_a_new_one(make_network, make_graph):
+    network = make_network()
+    graph = make_graph(network=network)
+    closures = Closures(network, graph)
+    tree = time_to_safety(graph, SAFE_NODES)
+    for method, args in changes(network):
+        change = getattr(closures, method)(*args)
+        tree, _ = repair_time_to_safety(graph, tree, change.edges)
+        same_tree(tree, time_to_safety(graph, SAFE_NODES))
+    # Every change undone: the times are back to the original ones
+    assert np.array_equal(graph.weights['time'], closures.base['time'])
+    same_tree(tree, time_to_safety(graph, SAFE_NODES))
+
+
+def test_repaired_tree_matches_a_new_one(make_network, make_graph):
+    network = make_network()
+    graph = make_graph(network=network)
+    closures = Closures(network, graph)
+    trees = {weight: multi_source_dijkstra(graph, SAFE_NODES, weight) for weight in ('length', 'time')}
+    for method, args in changes(network):
+        change = getattr(closures, method)(*args)
+        for weight in trees:
+            trees[weight], _ = closures.repair(graph, trees[weight], change, weight)
+            same_tree(trees[weight], multi_source_dijkstra(graph, SAFE_NODES, weight))
+
+
+def test_route_avoiding_slowed_links_stays_valid(make_network, make_graph):
+    network = make_network()
+    graph = make_graph(network=network)
+    closures = Closures(network, graph)
+    routes = [dijkstra(graph, 0, 399, 'length'), None, dijkstra(graph, 0, 399, 'time'), None]
+    used = set(graph.links[routes[0].edges].tolist()) | set(graph.links[routes[2].edges].tolist())
+    unused = [link for link in range(network.n_links) if link not in used]
+    assert route_still_valid(routes, closures.slow(unused[:10], 2.0))
+    assert not route_still_valid(routes, closures.slow(unused[:10], 1))
+    assert not route_still_valid(routes, closures.close(sorted(used)[:1]))
+
+
+def test_nodata_vertices_are_never_under_water(make_dem, make_line_network):
+    # Land rising eastwards from 5 m, the sea (nodata) in the first 7 columns and one NaN cell
+    altitude = np.tile(np.arange(60, dtype=np.float32) + 5, (20, 1))
+    altitude[:, :7] = -9999.0
+    altitude[10, 40] = np.nan
+    dem = make_dem(altitude)
+    # From the sea inland, all in the sea, and inland over the NaN cell (vertices in columns 5 30 55, 1 3 6, 30 40 50)
+    network = make_line_network((50, 550), (10, 60), (300, 500))
+    min_altitudes = link_min_altitudes(network, dem, altitude)
+    assert min_altitudes.tolist() == [35, np.inf, 35]
+
+    length = network.link_length[network.adj_links]
+    closures = Closures(network, Graph.from_network(network, length=length, time=length))
+    closures.flood(min_altitudes, 0)
+    assert closures.flooded == set()
+    closures.flood(min_altitudes, 36)
+    assert closures.flooded == {0, 2}
@@ -0,0 +1,72 @@
+# Streamed reading of the ITN JSON against json.load
+import json
+import numpy as np
+import pytest
+from benchmarks.synthetic import make_itn
+from network import build_arrays, read_itn, stream_arrays
+
+
+# Small ITN with other top-level members around the road nodes and links (holding braces, quotes and escapes
+# inside strings), the links first, written compactly or indented
+def write_itn(path, indent=None):
+    itn = make_itn(16, seed=3)
+    document = {'meta': {'name': 'a } tricky { "name"', 'list': [1, {'x': '\\'}, []]},
+                'roadlinks': itn['roadlinks'], 'empty': {}, 'roadnodes': itn['roadnodes'],
+                'extra': [1.5e-3, -2E+4, True, None, 'café']}
+    with open(path, 'w') as file:
+        json.dump(document, file, indent=indent)
+    return path
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_streamed_itn_equals_json_load(tmp_path, indent, chunk_size):
+    path = write_itn(str(tmp_path / 'itn.json'), indent)
+    with open(path) as file:
+        document = json.load(file)
+    itn_dict = read_itn(path, chunk_size=chunk_size)
+    assert itn_dict == {'roadnodes': document['roadnodes'], 'roadlinks': document['roadlinks']}
+
+
+def test_streamed_arrays_equal_the_loaded_ones(tmp_path):
+    path = write_itn(str(tmp_path / 'itn.json'), 2)
+    with open(path) as file:
+        expected = build_arrays(json.load(file))
+    arrays = stream_arrays(path)
+    assert arrays.keys() == expected.keys()
+    for name, values in expected.items():
+        assert np.array_equal(arrays[name], values), name
+
+
+def test_bbox_keeps_the_nodes_inside_and_the_links_crossing_it(tmp_path):
+    path = write_itn(str(tmp_path / 'itn.json'))
+    itn = read_itn(path)
+    xs = [node['coords'][0] for node in itn['roadnodes'].values()]
+    ys = [node['coords'][1] for node in itn['roadnodes'].values()]
+    bbox = (min(xs), min(ys), (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2)
+    region = read_itn(path, bbox, chunk_size=1)
+    assert 0 < len(region['roadlinks']) < len(itn['roadlinks'])
+    for fid, link in itn['roadlinks'].items():
+        (x0, y0), (x1, y1) = np.min(link['coords'], axis=0), np.max(link['coords'], axis=0)
+        crosses = x0 <= bbox[2] and x1 >= bbox[0] and y0 <= bbox[3] and y1 >= bbox[1]
+        assert (fid in region['roadlinks']) == crosses
+        if crosses:
+            assert region['roadlinks'][fid] == link
+    for node_id, node in itn['roadnodes'].items():
+        x, y = node['coords']
+        if bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]:
+            assert region['roadnodes'][node_id] == node
+    # Every link's end nodes are there, the ones outside the box from the link's end coordinates
+    for link in region['roadlinks'].values():
+        assert region['roadnodes'][link['start']]['coords'] == link['coords'][0]
+        assert region['roadnodes'][link['end']]['coords'] == link['coords'][-1]
+
+
+def test_truncated_itn_is_an_error(tmp_path):
+    path = write_itn(str(tmp_path / 'itn.json'))
+    with open(path) as file:
+        text = file.read()
+    with open(path, 'w') as file:
+        file.write(text[:len(text) // 2])
+    with pytest.raises(ValueError):
+        read_itn(path, chunk_size=1)
@@ -0,0 +1,42 @@
+# Link elevation profiles and the travel times computed from them
+import numpy as np
+from elevation import sample_bilinear
+from task_4 import WALKING_SPEEDS, link_profiles, link_times
+
+# Cell size and nodata value of the DEMs of make_dem (conftest.py), 20 x 60 cells here
+CELL = 10
+NODATA = -9999.0
+
+
+def test_bilinear_sampling_interpolates_between_cell_centres(make_dem):
+    altitude = np.tile(np.arange(60, dtype=np.float32), (20, 1))
+    dem = make_dem(altitude)
+    values = sample_bilinear(dem, altitude, [(15.0, 100.0), (20.0, 100.0), (25.0, 55.0)])
+    assert np.allclose(values, [1.0, 1.5, 2.0])
+
+
+def test_hill_climbed_and_descended_is_not_flat(make_dem, make_line_network):
+    # A 30 m high ridge between x = 200 and x = 400, the ends of the link at the same altitude
+    x = (np.arange(60) + 0.5) * CELL
+    altitude = np.tile(np.clip(30 - np.abs(x - 300) * 0.3, 0, None), (20, 1))
+    network = make_line_network((50, 550))
+    profiles = link_profiles(network, make_dem(altitude), altitude)
+    assert np.isclose(profiles['ascent'][0], 30, atol=1.5)
+    assert np.isclose(profiles['descent'][0], profiles['ascent'][0])
+    forward, backward = link_times(network.link_length, profiles, WALKING_SPEEDS[0])
+    assert forward[0] > 500 / WALKING_SPEEDS[0] + 2 and backward[0] > 500 / WALKING_SPEEDS[0] + 2
+
+
+def test_link_crossing_nodata_gets_a_finite_time(make_dem, make_line_network):
+    # Flat land at 5 m with a nodata strip (e.g. a missing tile) across the link
+    altitude = np.full((20, 60), 5.0, dtype=np.float32)
+    altitude[:, 20:24] = NODATA
+    network = make_line_network((50, 550), (150, 300))
+    profiles = link_profiles(network, make_dem(altitude), altitude)
+    for name in ('ascent', 'descent'):
+        assert np.all(profiles[name] == 0)
+    for speed in WALKING_SPEEDS:
+        forward, backward = link_times(network.link_length, profiles, speed)
+        assert np.all(np.isfinite(forward)) and np.all(np.isfinite(backward))
+        assert np.allclose(forward, network.link_length / speed)
+        assert np.allclose(backward, network.link_length / speed)
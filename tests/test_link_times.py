@@ -0,0 +1,19 @@
+# Link times stored with the compiled network and kept in memory
+import numpy as np
+from task_4 import WALKING_SPEEDS, load_link_times
+
+
+def test_times_follow_a_changed_dem_or_network(tmp_path, make_dem, make_line_network):
+    flat = np.zeros((20, 60))
+    slope = np.tile(np.arange(60) * 1.0, (20, 1))
+    network = make_line_network((50, 550), meta={'source_hash': 'n1'}, directory=tmp_path)
+    flat_times = load_link_times(network, make_dem(flat, 'd1'))[0]
+    assert np.allclose(flat_times[:, 0], 500 / np.array(WALKING_SPEEDS))
+
+    # A new DEM in the same process: the times are computed again, not served from memory
+    slope_times = load_link_times(network, make_dem(slope, 'd2'))[0]
+    assert np.all(slope_times[:, 0] > flat_times[:, 0])
+    # Back to the first DEM, the same for a recompiled network
+    assert np.array_equal(load_link_times(network, make_dem(flat, 'd1'))[0], flat_times)
+    recompiled = make_line_network((50, 550), meta={'source_hash': 'n2'}, directory=tmp_path)
+    assert np.array_equal(load_link_times(recompiled, make_dem(slope, 'd2'))[0], slope_times)
@@ -0,0 +1,41 @@
+# Highest point of a polygon from the max index against a scan of every cell
+import numpy as np
+import shapely
+from rasterio.transform import from_origin
+from elevation import MaxIndex
+
+NODATA = -9999.0
+TRANSFORM = from_origin(1000, 2000, 10, 10)
+
+
+# Highest cell whose centre is inside the polygon, the first one in row-major order among equals
+def brute_force_highest(altitude, polygon):
+    rows, cols = np.indices(altitude.shape)
+    t = TRANSFORM
+    inside = shapely.contains_xy(polygon, t.c + (cols + 0.5) * t.a, t.f + (rows + 0.5) * t.e) & (altitude != NODATA)
+    if not inside.any():
+        return None
+    values = np.where(inside, altitude, -np.inf)
+    row, col = divmod(int(np.argmax(values)), altitude.shape[1])
+    return row, col, values[row, col]
+
+
+def test_highest_matches_a_full_scan():
+    rng = np.random.default_rng(0)
+    # Rounded altitudes so that equal maxima occur, and a few nodata cells
+    altitude = np.round(rng.uniform(0, 50, (90, 130))).astype(np.float32)
+    altitude[rng.random(altitude.shape) < 0.05] = NODATA
+    index = MaxIndex.build(altitude, TRANSFORM, NODATA, block=4)
+    assert len(index.maxes) > 2
+    for _ in range(40):
+        x, y = rng.uniform(1000, 2300), rng.uniform(1100, 2000)
+        polygon = shapely.Point(x, y).buffer(rng.uniform(5, 400))
+        expected = brute_force_highest(altitude, polygon)
+        assert index.highest(polygon) == expected
+
+
+def test_polygon_without_cell_centres_has_no_highest_point():
+    altitude = np.ones((20, 20), dtype=np.float32)
+    index = MaxIndex.build(altitude, TRANSFORM, NODATA, block=4)
+    # Between the centres of four cells
+    assert index.highest(shapely.Point(1010, 1990).buffer(2)) is None
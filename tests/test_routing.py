@@ -0,0 +1,41 @@
+# Route costs of the searches and of the contraction hierarchy against plain Dijkstra
+import numpy as np
+import pytest
+from hierarchy import build_hierarchy
+from routing import SEARCHES, dijkstra
+
+
+# Random pairs of distinct nodes
+def node_pairs(graph, n_pairs=30, seed=1):
+    pairs = np.random.default_rng(seed).integers(graph.n_nodes, size=(n_pairs, 2))
+    return pairs[pairs[:, 0] != pairs[:, 1]].tolist()
+
+
+def route_cost(graph, route, weight):
+    return graph.weights[weight][route.edges].sum()
+
+
+@pytest.mark.parametrize('search', ['astar', 'bidirectional', 'local'])
+@pytest.mark.parametrize('weight', ['length', 'time'])
+def test_searches_find_the_dijkstra_cost(search, weight, make_graph):
+    graph = make_graph()
+    for source, target in node_pairs(graph):
+        expected = dijkstra(graph, source, target, weight)
+        route = SEARCHES[search](graph, source, target, weight)
+        assert route.nodes[0] == source and route.nodes[-1] == target
+        assert np.isclose(route.cost, expected.cost)
+        assert np.isclose(route_cost(graph, route, weight), expected.cost)
+
+
+@pytest.mark.parametrize('weight', ['length', 'time'])
+def test_hierarchy_finds_the_dijkstra_cost(weight, make_graph):
+    graph = make_graph()
+    hierarchy = build_hierarchy(graph, weight)
+    for source, target in node_pairs(graph):
+        expected = dijkstra(graph, source, target, weight)
+        route = hierarchy.route(source, target)
+        assert np.isclose(route.cost, expected.cost)
+        # The unpacked shortcuts are a path of the graph from source to target
+        assert graph.sources()[route.edges[0]] == source and graph.targets[route.edges[-1]] == target
+        assert np.array_equal(graph.targets[route.edges[:-1]], graph.sources()[route.edges[1:]])
+        assert np.isclose(route_cost(graph, route, weight), expected.cost)
@@ -0,0 +1,67 @@
+# Columnar shapefile reading against geopandas, on small shapefiles written by the test
+import os
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, MultiLineString, Point
+from network import shapefile_arrays
+from shapefiles import read_dbf, read_lines, read_points
+
+CRS = 'EPSG:27700'
+
+
+# Point shapefile with a null shape, text (UTF-8, so with a .cpg file) and numeric columns, one of them null
+def write_points(directory):
+    path = os.path.join(directory, 'nodes.shp')
+    frame = gpd.GeoDataFrame({'fid': ['n1', 'n2', 'nœud 3', 'n4'], 'height': [1.5, None, -20.0, 1e6],
+                              'count': [1, 2, 3, 4]},
+                             geometry=[Point(0, 0), Point(10.25, -3.5), None, Point(430000.125, 75000.5)], crs=CRS)
+    frame.to_file(path, encoding='utf-8')
+    return path
+
+
+def test_points_and_columns(tmp_path):
+    path = write_points(str(tmp_path))
+    coords = read_points(path)
+    assert np.array_equal(coords[[0, 1, 3]], [[0, 0], [10.25, -3.5], [430000.125, 75000.5]])
+    # The null shape
+    assert np.all(np.isnan(coords[2]))
+
+    columns = read_dbf(path[:-len('.shp')] + '.dbf')
+    assert columns['fid'].tolist() == ['n1', 'n2', 'nœud 3', 'n4']
+    assert np.array_equal(columns['height'], [1.5, np.nan, -20.0, 1e6], equal_nan=True)
+    assert columns['count'].tolist() == [1, 2, 3, 4]
+    assert list(read_dbf(path[:-len('.shp')] + '.dbf', ['fid'])) == ['fid']
+
+
+def test_lines_with_parts_and_null_shapes(tmp_path):
+    path = str(tmp_path / 'links.shp')
+    geometries = [LineString([(0, 0), (1, 1), (2, 0.5)]), None,
+                  MultiLineString([[(5, 5), (6, 6)], [(7, 7), (8, 8), (9, 7.5)]]), LineString([(-1, -2), (3, 4)])]
+    gpd.GeoDataFrame({'n': [1, 2, 3, 4]}, geometry=geometries, crs=CRS).to_file(path)
+    offsets, coords = read_lines(path)
+    assert offsets.tolist() == [0, 3, 3, 8, 10]
+    assert np.array_equal(coords, [(0, 0), (1, 1), (2, 0.5), (5, 5), (6, 6), (7, 7), (8, 8), (9, 7.5),
+                                   (-1, -2), (3, 4)])
+
+
+def test_unexpected_shape_type(tmp_path):
+    path = write_points(str(tmp_path))
+    with pytest.raises(ValueError):
+        read_lines(path)
+
+
+# Roads shapefiles: four nodes and three links, one of them ending a hair away from its node
+def test_network_from_shapefiles(tmp_path):
+    nodes = [Point(0, 0), Point(100, 0), Point(100, 50), Point(0, 80)]
+    gpd.GeoDataFrame({'fid': ['a', 'b', 'c', 'd']}, geometry=nodes, crs=CRS).to_file(str(tmp_path / 'nodes.shp'))
+    links = [LineString([(0, 0), (50, 0), (100, 0)]), LineString([(100, 0), (100, 50)]),
+             LineString([(100, 50), (0, 50), (0, 80.005)])]
+    gpd.GeoDataFrame(geometry=links, crs=CRS).to_file(str(tmp_path / 'links.shp'))
+    arrays = shapefile_arrays(str(tmp_path))
+    assert arrays['node_ids'].tolist() == ['a', 'b', 'c', 'd']
+    assert arrays['link_fids'].tolist() == ['1', '2', '3']
+    assert arrays['link_start'].tolist() == [0, 1, 2]
+    assert arrays['link_end'].tolist() == [1, 2, 3]
+    assert np.allclose(arrays['link_length'], [100, 50, 130.005])
+    assert arrays['geom_offsets'].tolist() == [0, 3, 5, 8]
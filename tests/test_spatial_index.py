@@ -0,0 +1,33 @@
+# Nearest nodes from the grid index against the distances to every node
+import numpy as np
+from spatial_index import NodeIndex
+
+
+def brute_force_nearest(coords, points, k):
+    dists = np.hypot(*(points[:, np.newaxis, :] - coords[np.newaxis, :, :]).transpose(2, 0, 1))
+    ids = np.argsort(dists, axis=1, kind='stable')[:, :k]
+    return ids, np.take_along_axis(dists, ids, axis=1)
+
+
+def test_k_nearest_match_a_full_scan():
+    rng = np.random.default_rng(0)
+    # Clustered nodes, so that most cells are empty and some crowded
+    centres = rng.uniform(0, 10000, (8, 2))
+    coords = centres[rng.integers(len(centres), size=500)] + rng.normal(0, 300, (500, 2))
+    index = NodeIndex.build(coords)
+    # Points among the nodes and far outside their bounding box
+    points = np.concatenate([rng.uniform(0, 10000, (200, 2)), rng.uniform(-20000, 30000, (50, 2))])
+    for k in (1, 5):
+        ids, dists = index.nearest(points, k)
+        expected_ids, expected_dists = brute_force_nearest(coords, points, k)
+        assert np.array_equal(ids, expected_ids)
+        assert np.allclose(dists, expected_dists)
+
+
+def test_fewer_nodes_than_k(tmp_path):
+    coords = np.array([[0.0, 0.0], [3.0, 4.0]])
+    index = NodeIndex.build(coords)
+    index.save(str(tmp_path / 'index.npz'))
+    ids, dists = NodeIndex.load(str(tmp_path / 'index.npz'), coords).nearest([[0.0, 1.0]], k=3)
+    assert ids.tolist() == [[0, 1, -1]]
+    assert np.allclose(dists, [[1.0, np.hypot(3, 3), np.inf]])
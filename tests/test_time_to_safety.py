@@ -0,0 +1,25 @@
+# Time to safety of every node against a search from each node to each safe node
+import numpy as np
+from routing import NoPath, dijkstra
+from time_to_safety import path_to_safety, time_to_safety
+
+
+def test_every_node_gets_its_nearest_safe_node(make_graph):
+    graph = make_graph(100)
+    safe_nodes = [3, 40, 77]
+    tree = time_to_safety(graph, safe_nodes)
+    for node in range(graph.n_nodes):
+        costs = {}
+        for safe in safe_nodes:
+            try:
+                costs[safe] = dijkstra(graph, node, safe, 'time').cost
+            except NoPath:
+                pass
+        if not costs:
+            assert tree.origin[node] == -1 and tree.dist[node] == np.inf
+            continue
+        assert np.isclose(tree.dist[node], min(costs.values()))
+        assert np.isclose(costs[tree.origin[node]], tree.dist[node])
+        route = path_to_safety(graph, tree, node)
+        assert route.nodes[-1] == tree.origin[node]
+        assert np.isclose(graph.weights['time'][route.edges].sum(), tree.dist[node])
@@ -0,0 +1,94 @@
+# Island-wide time to safety
+# Instead of one search per user, a single multi-source Dijkstra on the reversed graph starts from all the safe
+# places at once: the cost of a node in the reversed graph is its travel time towards the nearest safe place.
+# Usage: python time_to_safety.py output.csv [--fitness N] [--threshold 70]
+import argparse
+import csv
+import numpy as np
+from creativity_marks import radius_and_speed
+from elevation import sample_elevation, open_dem
+from instrumentation import traced
+from network import load_network
+from routing import Route, Tree, NoPath, multi_source_dijkstra, repair_tree
+from task_4 import build_graph
+
+
+# Road nodes lying on DEM cells at or above the threshold altitude
+def high_nodes(network, raster, elevation_data, threshold=70):
+    return np.flatnonzero(sample_elevation(raster, elevation_data, network.node_coords) >= threshold)
+
+
+# Snapping safe places given as points (e.g. the destinations found by highest_point()) to their nearest node
+def snap_points(idx, points):
+    nearest, _ = idx.nearest([(point.x, point.y) for point in points], 1)
+    return np.unique(nearest[:, 0]).tolist()
+
+
+# Travel cost from every node to its nearest safe node. The returned tree's pred holds, for every node,
+# the edge of the (forward) graph to follow towards safety, and origin the safe node it leads to
+@traced('time_to_safety')
+def time_to_safety(graph, safe_nodes, weight='time'):
+    reverse = graph.reverse()
+    tree = multi_source_dijkstra(reverse, safe_nodes, weight)
+    next_edge = np.where(tree.pred >= 0, reverse.edge_ids[np.maximum(tree.pred, 0)], -1)
+    return Tree(tree.dist, tree.origin, next_edge)
+
+
+# Repairing a time to safety tree after the weights of some edges of the (forward) graph changed (see
+# closures.Closures), on the reversed graph where it was computed. Returns the tree and the number of nodes
+# whose time had to be found again
+@traced('repair_time_to_safety')
+def repair_time_to_safety(graph, tree, changed_edges, weight='time'):
+    reverse = graph.reverse()
+    # Edges of the reversed graph from the forward graph's ones
+    reverse_index = np.empty_like(reverse.edge_ids)
+    reverse_index[reverse.edge_ids] = np.arange(len(reverse.edge_ids))
+    pred = np.where(tree.pred >= 0, reverse_index[np.maximum(tree.pred, 0)], -1)
+    repaired, n_affected = repair_tree(reverse, Tree(tree.dist, tree.origin, pred), reverse_index[changed_edges],
+                                       weight)
+    next_edge = np.where(repaired.pred >= 0, reverse.edge_ids[np.maximum(repaired.pred, 0)], -1)
+    return Tree(repaired.dist, repaired.origin, next_edge), n_affected
+
+
+# Following the tree from a node to its safe place
+def path_to_safety(graph, tree, node):
+    if tree.origin[node] < 0:
+        raise NoPath('No safe place can be reached from node ' + str(node))
+    nodes = [node]
+    edges = []
+    while tree.pred[node] >= 0:
+        edge = int(tree.pred[node])
+        node = int(graph.targets[edge])
+        edges.append(edge)
+        nodes.append(node)
+    return Route(nodes, edges, float(tree.dist[nodes[0]]), 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Travel time from every road node to the nearest safe place.')
+    parser.add_argument('output', help='CSV file for the results')
+    parser.add_argument('--fitness', type=int, default=5, help='fitness level from 1 to 10')
+    parser.add_argument('--threshold', type=float, default=70, help='minimum altitude of a safe place (m)')
+    args = parser.parse_args()
+
+    network = load_network()
+    raster = open_dem()
+    elevation_data = raster.read(1)
+    _, walking_speed = radius_and_speed(args.fitness)
+    graph = build_graph(network, raster, walking_speed, elevation_data)
+    safe_nodes = high_nodes(network, raster, elevation_data, args.threshold)
+    print('Safe nodes (above', args.threshold, 'm):', len(safe_nodes))
+    tree = time_to_safety(graph, safe_nodes)
+
+    with open(args.output, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['node', 'easting', 'northing', 'time', 'safe_node'])
+        for node in range(network.n_nodes):
+            safe = tree.origin[node]
+            writer.writerow([network.node_ids[node], *network.node_coords[node].tolist(),
+                             tree.dist[node] if safe >= 0 else '', network.node_ids[safe] if safe >= 0 else ''])
+    print('Time to safety written to', args.output)
+
+
+if __name__ == "__main__":
+    main()